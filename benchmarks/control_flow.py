@@ -0,0 +1,149 @@
+"""
+Micro-benchmark for break / continue.
+
+Runs the same Whisper programs twice: on the interpreter's Machine, where
+break and continue unwind straight to the innermost loop, and on
+StopIterationMachine, a reference copy of the machine that still signals
+them the old way (raise StopIteration("break"), catch it in the dispatch
+loop, compare str(e)). Everything else is shared, so the ratio between
+the two columns is the cost of the old signalling. A loop without skip
+or break is included as a control; its ratio should stay close to 1.
+
+Usage: python benchmarks/control_flow.py [iterations]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from whisper import nodes  # noqa: E402
+from whisper.interpreter import (EXECUTORS, Interpreter, LimitExceeded, Machine,  # noqa: E402
+                                 compile_program)
+
+PROGRAMS = {
+    "plain loop": """
+let total be 0
+for each i in numbers:
+    when i % 2 == 0:
+        increase total by i
+""",
+    "skip in loop": """
+let total be 0
+for each i in numbers:
+    when i % 2 == 1:
+        skip
+    increase total by i
+""",
+    "break inner loop": """
+let total be 0
+for each i in rows:
+    for each j in digits:
+        when j == 2:
+            break
+        increase total by j
+""",
+}
+
+
+# ======== Reference: exception-based signalling ========
+
+def raise_break(stmt, variables, machine):
+    raise StopIteration("break")
+
+
+def raise_continue(stmt, variables, machine):
+    raise StopIteration("continue")
+
+
+REFERENCE_EXECUTORS = dict(EXECUTORS)
+REFERENCE_EXECUTORS[nodes.Break] = raise_break
+REFERENCE_EXECUTORS[nodes.Continue] = raise_continue
+
+
+class StopIterationMachine(Machine):
+    """The Machine with break/continue signalled by raising StopIteration."""
+
+    def resume(self, base):
+        stack = self.stack
+        executors = REFERENCE_EXECUTORS
+        outer, self.base = self.base, base
+        countdown = self.countdown
+        try:
+            while len(stack) > base:
+                countdown -= 1
+                if countdown < 0:
+                    countdown = self.check_limits()
+                top = stack[-1]
+                pos = top.pos
+                try:
+                    if pos < len(top.body):
+                        stmt = top.body[pos]
+                        top.pos = pos + 1
+                        executors[stmt.__class__](stmt, self.frame, self)
+                    else:
+                        top.finish(self)
+                except LimitExceeded:
+                    raise
+                except StopIteration as e:
+                    self.unwind_loop(str(e), base)
+                except Exception as e:
+                    self.unwind_error(e, base)
+        finally:
+            self.countdown = countdown
+            self.base = outer
+
+    def unwind_loop(self, signal, base):
+        """Handle break / continue by leaving blocks up to the innermost loop."""
+        stack = self.stack
+        while len(stack) > base:
+            record = stack[-1]
+            if record.is_loop:
+                if signal == "break":
+                    stack.pop()
+                else:
+                    record.next_iteration(self)
+                return
+            self.pop()
+        raise RuntimeError(f"'{signal}' used outside of a loop")
+
+
+# ======== Timing ========
+
+def time_run(program, machine_class, n):
+    """Return the wall time of running program over n numbers, and its total."""
+    variables = {"numbers": list(range(n)),
+                 "rows": list(range(max(n // 10, 1))),
+                 "digits": list(range(10))}
+    machine = machine_class(Interpreter(), variables)
+    start = time.perf_counter()
+    machine.run(program.statements)
+    return time.perf_counter() - start, variables["total"]
+
+
+def compare(program, n, repeats=7):
+    """Best times on Machine and StopIterationMachine, run alternately so drift hits both."""
+    best = {Machine: None, StopIterationMachine: None}
+    totals = set()
+    for _ in range(repeats):
+        for machine_class in best:
+            elapsed, total = time_run(program, machine_class, n)
+            totals.add(total)
+            if best[machine_class] is None or elapsed < best[machine_class]:
+                best[machine_class] = elapsed
+    if len(totals) != 1:
+        raise SystemExit(f"the two machines computed different totals: {sorted(totals)}")
+    return best[Machine], best[StopIterationMachine]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f"{'program':<20}{'direct (s)':>12}{'StopIteration (s)':>19}{'ratio':>8}")
+    for name, source in PROGRAMS.items():
+        direct, reference = compare(compile_program(source), n)
+        print(f"{name:<20}{direct:>12.3f}{reference:>19.3f}{reference / direct:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
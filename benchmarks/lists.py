@@ -0,0 +1,51 @@
+"""
+Benchmark for lists in expressions.
+
+Runs a for-each loop that indexes into a second list and calls len() on
+every iteration, over lists of growing size. Lists are read by reference,
+so the time per element should stay flat as the lists grow.
+
+Usage: python benchmarks/lists.py [largest size]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from whisper.interpreter import Interpreter, compile_program  # noqa: E402
+
+PROGRAM = """
+let total be 0
+let i be 0
+for each item in items:
+    increase total by item * weights[i] + len(weights)
+    increase i by 1
+"""
+
+
+def time_size(program, size, repeats=3):
+    """Return the best wall time of the program over lists of size elements."""
+    best = None
+    for _ in range(repeats):
+        variables = {"items": list(range(size)), "weights": [2] * size}
+        start = time.perf_counter()
+        Interpreter().run(program, variables)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    program = compile_program(PROGRAM)
+    sizes = [largest // 8, largest // 4, largest // 2, largest]
+    print(f"{'elements':>10}{'seconds':>10}{'us/element':>13}")
+    for size in sizes:
+        elapsed = time_size(program, size)
+        print(f"{size:>10}{elapsed:>10.3f}{elapsed / size * 1e6:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark for the memory used by story objects.
+
+Runs a program that declares many story objects and keeps them in a list,
+then reports the bytes each object takes (measured with tracemalloc) next
+to what the same objects cost as plain dicts, the representation story
+objects used before they became slotted records.
+
+Usage: python benchmarks/story_memory.py [number of objects]
+"""
+
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from whisper.interpreter import Interpreter, compile_program  # noqa: E402
+from whisper.output import CaptureSink  # noqa: E402
+
+PROGRAM = """
+make army with []
+let i be 0
+repeat count:
+    there is a soldier with health 100, attack 12, armor 5, speed 3, gold i
+    add soldier to army
+    increase i by 1
+"""
+
+PROPERTIES = ("health", "attack", "armor", "speed", "gold")
+
+
+def record_bytes(program, count):
+    """Return the bytes per object held by the army list after the program runs."""
+    variables = {"count": count}
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    Interpreter(CaptureSink()).run(program, variables)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / count
+
+
+def dict_bytes(count):
+    """Return the bytes per object when the same objects are plain dicts."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    army = []
+    for i in range(count):
+        army.append(dict(zip(PROPERTIES, (100, 12, 5, 3, i))))
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del army
+    return (after - before) / count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    program = compile_program(PROGRAM)
+    records = record_bytes(program, count)
+    dicts = dict_bytes(count)
+    print(f"{count} objects with {len(PROPERTIES)} properties")
+    print(f"{'as dicts':<16}{dicts:>10.1f} bytes/object")
+    print(f"{'as records':<16}{records:>10.1f} bytes/object")
+    print(f"{'saved':<16}{(1 - records / dicts) * 100:>9.1f}%")
+
+
+if __name__ == "__main__":
+    main()
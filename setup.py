@@ -25,6 +25,7 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     packages=find_packages(),
+    package_data={'whisper': ['bench_programs/*.wsp']},
     entry_points={
         'console_scripts': [
             'whisper=whisper.interpreter:main',
@@ -50,4 +51,7 @@ setup(
     keywords='programming-language interpreter whisper natural-language conversational education beginner-friendly',
     python_requires='>=3.7',
     install_requires=[],
+    extras_require={
+        'numpy': ['numpy'],
+    },
 )
\ No newline at end of file
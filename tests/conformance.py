@@ -0,0 +1,127 @@
+"""
+Conformance check for `whisper --compile`, `whisper --optimize` and
+`whisper --cache-conditions`.
+
+Runs tests/test_all.wsp, tests/optimizer_cases.wsp,
+tests/condition_cases.wsp and every examples/*.wsp program interpreted
+as parsed, then compiled to Python, with each optimizer pass on its own,
+with all of them, compiled with all of them, with the condition cache,
+and with number arrays on the array.array fallback instead of NumPy, and
+reports any difference in output or final variables from the first run.
+Programs that ask questions get the same scripted answers on every run,
+and the random number generator starts from the same seed. The
+optimizer's hidden __invariant_N__ variables must not be left behind, so
+they are compared like any other variable.
+
+Usage: python tests/conformance.py [program.wsp ...]
+"""
+
+import difflib
+import glob
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from whisper import arrays  # noqa: E402
+from whisper.compiler import compile_whisper  # noqa: E402
+from whisper.interpreter import Interpreter, compile_program  # noqa: E402
+from whisper.optimizer import PASSES, optimize  # noqa: E402
+from whisper.output import CaptureSink  # noqa: E402
+
+# Answers for the examples that ask questions
+ANSWERS = {
+    "calculator.wsp": "6\n3\n",
+    "guessing_game.wsp": "50\n25\n75\n12\n88\n60\n40\n30\n20\n10\n",
+    "rpg_battle.wsp": "1\n2\n3\n" + "1\n" * 30,
+    "story_adventure.wsp": "RIGHT\nOPEN\n",
+    "todo_list.wsp": "1\nmilk\n1\neggs\n2\n3\nmilk\n2\n4\n",
+}
+
+
+def interpreted(passes=()):
+    def runner(program, variables, output):
+        Interpreter(output).run(optimize(program, passes), variables)
+    return runner
+
+
+def cached(program, variables, output):
+    Interpreter(output, cache_conditions=True).run(program, variables)
+
+
+def without_numpy(program, variables, output):
+    saved, arrays.numpy = arrays.numpy, None
+    try:
+        Interpreter(output).run(program, variables)
+    finally:
+        arrays.numpy = saved
+
+
+def compiled(passes=()):
+    def runner(program, variables, output):
+        compile_whisper(optimize(program, passes)).run(variables, output)
+    return runner
+
+
+MODES = [("compiled", compiled())]
+MODES += [(name, interpreted((name,))) for name in PASSES]
+MODES += [("optimized", interpreted(PASSES)), ("optimized, compiled", compiled(PASSES))]
+MODES += [("cached conditions", cached)]
+if arrays.numpy is not None:
+    MODES += [("without NumPy", without_numpy)]
+
+
+def run(path, runner):
+    """Run a program in a scratch folder; return its output and variables as text."""
+    with open(path, "r", encoding="utf-8") as f:
+        program = compile_program(f.read())
+    output = CaptureSink()
+    variables = {}
+    stdin, cwd = sys.stdin, os.getcwd()
+    folder = tempfile.mkdtemp()
+    random.seed(1234)
+    sys.stdin = io.StringIO(ANSWERS.get(os.path.basename(path), ""))
+    os.chdir(folder)
+    try:
+        runner(program, variables, output)
+    except Exception as e:
+        output.write(f"Error: {e}\n")
+    finally:
+        sys.stdin = stdin
+        os.chdir(cwd)
+        shutil.rmtree(folder)
+    state = [f"{name} = {value!r}" for name, value in sorted(variables.items())]
+    return output.getvalue().splitlines() + ["-- variables --"] + state
+
+
+def main():
+    paths = sys.argv[1:] or ([os.path.join(ROOT, "tests", name)
+                              for name in ("test_all.wsp", "optimizer_cases.wsp", "condition_cases.wsp")]
+                             + sorted(glob.glob(os.path.join(ROOT, "examples", "*.wsp"))))
+    failed = 0
+    for path in paths:
+        expected = run(path, interpreted())
+        differences = []
+        for mode, runner in MODES:
+            actual = run(path, runner)
+            if actual != expected:
+                differences.append((mode, actual))
+        if not differences:
+            print(f"same  {path}")
+            continue
+        failed += 1
+        for mode, actual in differences:
+            print(f"DIFF  {path} ({mode})")
+            for line in difflib.unified_diff(expected, actual, "interpreted", mode, lineterm=""):
+                print("      " + line)
+    print(f"{len(paths) - failed} of {len(paths)} programs match")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,395 @@
+"""
+Checks for the parts of Whisper a .wsp program cannot see for itself:
+output sinks, the Interpreter API, limits, remembered functions, the
+profiler, `whisper bench` and `whisper run-many`.
+
+tests/test_all.wsp covers the language; this script runs small programs
+from Python and checks what the host gets back.
+
+Usage: python tests/embedding.py
+"""
+
+import io
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import whisper  # noqa: E402
+from whisper.output import CaptureSink, OutputSink  # noqa: E402
+
+CHECKS = []
+
+
+def check(func):
+    CHECKS.append(func)
+    return func
+
+
+def expect(actual, expected, what):
+    if actual != expected:
+        raise AssertionError(f"{what}: expected {expected!r}, got {actual!r}")
+
+
+# ======== Output sinks ========
+
+@check
+def capture_sink_collects_output():
+    output = CaptureSink()
+    whisper.run('whisper "a"\nshow 1 + 1\ntell me "b"\njust say "c"\nannounce "d "\nwhisper "e"', output)
+    expect(output.getvalue(), "a\n2\nb\nc\nd e\n", "captured output")
+    output.clear()
+    expect(output.getvalue(), "", "output after clear()")
+
+
+class Stream(io.StringIO):
+    """A stream that counts how often text reached it."""
+
+    def __init__(self):
+        io.StringIO.__init__(self)
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        return io.StringIO.write(self, text)
+
+
+@check
+def output_sink_buffers_until_flush():
+    stream = Stream()
+    sink = OutputSink(stream, buffer_size=1000)
+    whisper.Interpreter(sink).run('repeat 50:\n    show "line"')
+    expect(stream.getvalue(), "line\n" * 50, "output after the run")
+    expect(stream.writes, 1, "writes to the stream")
+
+
+@check
+def output_sink_flushes_before_an_error():
+    stream = Stream()
+    error = None
+    try:
+        whisper.Interpreter(OutputSink(stream, buffer_size=1000)).run('show "before"\ncall missing')
+    except RuntimeError as e:
+        error = str(e)
+    expect(error, "Function 'missing' not defined", "error")
+    expect(stream.getvalue(), "before\n", "output written before the error")
+
+
+@check
+def output_sink_flushes_before_ask():
+    stream = Stream()
+    seen = []
+
+    class Answers(io.StringIO):
+        def readline(self, *args):
+            seen.append(stream.getvalue())
+            return io.StringIO.readline(self, *args)
+
+    stdin, sys.stdin = sys.stdin, Answers("Ada\n")
+    try:
+        variables = whisper.Interpreter(OutputSink(stream, buffer_size=1000)).run(
+            'show "hello"\nask "Name?" into name\nshow "hi " + name')
+    finally:
+        sys.stdin = stdin
+    expect(seen, ["hello\nName? "], "output already written when ask read input")
+    expect(variables["name"], "Ada", "answer")
+    expect(stream.getvalue(), "hello\nName? hi Ada\n", "all output")
+
+
+# ======== Profiler ========
+
+PROFILED = """define square with n:
+    give back n * n
+let total be 0
+for each i from 1 to 4:
+    call square with i
+    increase total by __last_result__
+show total
+"""
+
+
+@check
+def profiler_counts_lines_and_functions():
+    from whisper.profiler import profile
+    output = CaptureSink()
+    result = profile(PROFILED, output)
+    expect(output.getvalue(), "30\n", "program output")
+    hits = {number: stats.hits for number, stats in result.lines.items()}
+    expect(hits, {1: 1, 2: 4, 3: 1, 4: 1, 5: 4, 6: 4, 7: 1}, "hits per line")
+    expect(result.functions["square"].hits, 4, "calls of square")
+    for number, stats in result.lines.items():
+        if not 0 <= stats.self_time <= stats.total + 1e-9:
+            raise AssertionError(f"line {number}: self time {stats.self_time} above total {stats.total}")
+    data = result.as_dict()
+    expect(sorted(data), ["functions", "lines", "total"], "JSON report keys")
+    expect(sorted(data["lines"][0]), ["hits", "line", "self", "source", "total"], "JSON line keys")
+    expect([entry["function"] for entry in data["functions"]], ["square"], "JSON functions")
+    if "call square with i" not in result.report():
+        raise AssertionError("the text report does not quote the source lines")
+
+
+@check
+def profiler_keeps_the_profile_of_a_failed_run():
+    from whisper.profiler import profile
+    try:
+        profile('show "a"\ncall missing', CaptureSink())
+    except RuntimeError as e:
+        expect(sorted(e.profile.lines), [1, 2], "lines profiled before the error")
+    else:
+        raise AssertionError("the error was not raised")
+
+
+# ======== whisper bench ========
+
+@check
+def bench_counts_statements():
+    from whisper.bench import bench_program
+    result = bench_program("let total be 0\nrepeat 10:\n    increase total by 1", warmup=0, repeat=2)
+    expect(sorted(result), ["best", "mean", "statements", "statements_per_second"], "result keys")
+    expect(result["statements"], 12, "statements run")
+    if not 0 < result["best"] <= result["mean"]:
+        raise AssertionError(f"best {result['best']} is not between 0 and mean {result['mean']}")
+
+
+@check
+def bench_compares_against_a_baseline():
+    from whisper.bench import compare
+    results = {"fast": {"statements_per_second": 150.0},
+               "slow": {"statements_per_second": 50.0},
+               "new": {"statements_per_second": 10.0}}
+    baseline = {"fast": {"statements_per_second": 100.0},
+                "slow": {"statements_per_second": 100.0}}
+    changes, regressions = compare(results, baseline, threshold=10.0)
+    expect(changes, {"fast": 50.0, "slow": -50.0}, "percent changes")
+    expect(regressions, ["slow"], "regressions")
+
+
+@check
+def bench_bundles_its_programs():
+    from whisper.bench import bundled_programs
+    expect(sorted(bundled_programs()), ["for_each_list", "recursion", "story_objects",
+                                        "string_concat", "when_chain", "while_counter"],
+           "bundled programs")
+
+
+# ======== Interpreter API ========
+
+@check
+def interpreters_do_not_share_definitions():
+    first, second = whisper.Interpreter(CaptureSink()), whisper.Interpreter(CaptureSink())
+    first.run("define greet with name:\n    give back \"hi \" + name\nlet x be 1\nthere is a hero with health 10")
+    expect(first.call("greet", "Ada"), "hi Ada", "call on the defining interpreter")
+    expect(sorted(second.functions), [], "functions seen by another interpreter")
+    expect(second.variables, {}, "variables seen by another interpreter")
+    try:
+        second.call("greet", "Ada")
+    except RuntimeError as e:
+        expect(str(e), "Function 'greet' not defined", "error")
+    else:
+        raise AssertionError("the other interpreter could call greet")
+
+
+@check
+def programs_run_many_times():
+    program = whisper.compile_program("let total be 0\nfor each n in numbers:\n    increase total by n")
+    interpreter = whisper.Interpreter(CaptureSink())
+    for numbers, total in (([1, 2, 3], 6), ([10], 10), ([], 0)):
+        variables = interpreter.run(program, {"numbers": numbers})
+        expect(variables["total"], total, f"total of {numbers}")
+    expect("total" in interpreter.variables, False, "interpreter store after runs on supplied stores")
+    expect(interpreter.run("let again be 1")["again"], 1, "own store")
+
+
+@check
+def programs_run_from_threads():
+    import threading
+    program = whisper.compile_program("let total be 0\nfor each i from 1 to limit:\n    increase total by i")
+    results = {}
+
+    def work(limit):
+        results[limit] = whisper.Interpreter(CaptureSink()).run(program, {"limit": limit})["total"]
+
+    threads = [threading.Thread(target=work, args=(limit,)) for limit in range(1, 9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    expect(results, {limit: limit * (limit + 1) // 2 for limit in range(1, 9)}, "totals per thread")
+
+
+@check
+def compiled_programs_recurse_from_threads():
+    import threading
+    from whisper.compiler import compile_whisper
+    deep = compile_whisper(whisper.compile_program(
+        "define down with n:\n    when n == 0:\n        give back 0\n"
+        "    call down with n - 1\n    give back __last_result__ + 1\n"
+        "call down with depth\nlet reached be __last_result__"))
+    errors = []
+
+    def recurse(depth):
+        try:
+            for _ in range(20):
+                expect(deep.run({"depth": depth}, CaptureSink())["reached"], depth, "depth reached")
+        except Exception as e:
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=recurse, args=(depth,)) for depth in (50, 3000, 100, 2000)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    expect(errors, [], "errors in the threads")
+
+
+@check
+def reset_forgets_everything():
+    interpreter = whisper.Interpreter(CaptureSink())
+    interpreter.run("define twice with n:\n    give back n * 2\nlet x be 3")
+    expect(interpreter.call("twice", 4), 8, "call before reset")
+    interpreter.reset()
+    expect((interpreter.variables, interpreter.functions), ({}, {}), "state after reset")
+
+
+@check
+def condition_cache_forgets_dropped_programs():
+    import gc
+    interpreter = whisper.Interpreter(CaptureSink(), cache_conditions=True)
+    program = whisper.compile_program("let total be 0\nwhile total < 3:\n    increase total by 1")
+    interpreter.run(program)
+    interpreter.run(program)
+    for n in range(50):
+        interpreter.run(f"let x be {n}\nwhen x > 10:\n    let big be True")
+    gc.collect()
+    expect(len(interpreter.conditions.prepared), 1, "programs the cache still holds")
+    expect(interpreter.run(program)["total"], 3, "total after running the kept program again")
+
+
+# ======== whisper run-many ========
+
+SCRIPTS = {
+    "a_ok.wsp": 'show "one"\nshow 1 + 1',
+    "b_error.wsp": "call missing",
+    "c_forever.wsp": "let n be 0\nwhile n >= 0:\n    increase n by 1",
+}
+
+
+def write_scripts(folder):
+    for name, code in SCRIPTS.items():
+        with open(os.path.join(folder, name), "w", encoding="utf-8") as f:
+            f.write(code)
+    with open(os.path.join(folder, "notes.txt"), "w", encoding="utf-8") as f:
+        f.write("not a script")
+
+
+@check
+def run_many_reports_each_script():
+    import tempfile
+    from whisper.batch import run_many, summarize
+    with tempfile.TemporaryDirectory() as folder:
+        write_scripts(folder)
+        paths = [os.path.join(folder, name) for name in sorted(SCRIPTS)]
+        results = run_many(paths, workers=2, timeout=0.5)
+    expect([result["path"] for result in results], paths, "result order")
+    expect([result["status"] for result in results], ["ok", "error", "timeout"], "statuses")
+    expect(results[0]["output"], "one\n2\n", "output of the script that ran")
+    expect(results[1]["error"], "Function 'missing' not defined", "error of the failing script")
+    summary = summarize(results, 2.0)
+    expect({key: summary[key] for key in ("scripts", "ok", "errors", "timeouts", "scripts_per_second")},
+           {"scripts": 3, "ok": 1, "errors": 1, "timeouts": 1, "scripts_per_second": 1.5}, "summary")
+
+
+@check
+def run_many_finds_scripts():
+    import tempfile
+    from whisper.batch import expand, read_manifest
+    with tempfile.TemporaryDirectory() as folder:
+        write_scripts(folder)
+
+        def names(paths):
+            return [os.path.relpath(path, folder) for path in paths]
+
+        expect(names(expand(folder)), sorted(SCRIPTS), "scripts in a folder")
+        expect(names(expand(os.path.join(folder, "*_o*.wsp"))), ["a_ok.wsp"], "scripts matching a glob")
+        manifest = os.path.join(folder, "scripts.txt")
+        with open(manifest, "w", encoding="utf-8") as f:
+            f.write("# smoke tests\n\nb_error.wsp\n*_ok.wsp\n")
+        expect(names(read_manifest(manifest)), ["b_error.wsp", "a_ok.wsp"], "scripts in a manifest")
+
+
+# ======== Execution limits ========
+
+FOREVER = "let n be 0\nwhile n >= 0:\n    increase n by 1"
+
+
+def limit_of(code, **limits):
+    """Run code under limits and return the LimitExceeded it stopped with."""
+    try:
+        whisper.Interpreter(CaptureSink(), **limits).run(code)
+    except whisper.LimitExceeded as e:
+        return e
+    raise AssertionError(f"{limits} did not stop the program")
+
+
+@check
+def limits_stop_a_program():
+    expect(limit_of(FOREVER, max_steps=1000).limit, "steps", "step limit")
+    expect(limit_of(FOREVER, timeout=0.2).limit, "time", "time limit")
+    deep = "define down with n:\n    call down with n + 1\ncall down with 0"
+    expect(limit_of(deep, max_depth=50).limit, "depth", "depth limit")
+    variables = whisper.Interpreter(CaptureSink(), max_steps=1000).run("let n be 0\nrepeat 100:\n    increase n by 1")
+    expect(variables["n"], 100, "a program within its limit")
+
+
+@check
+def attempt_cannot_catch_a_limit():
+    code = "attempt:\n    " + FOREVER.replace("\n", "\n    ") + "\nhandle:\n    show \"caught\""
+    output = CaptureSink()
+    try:
+        whisper.Interpreter(output, max_steps=1000).run(code)
+    except whisper.LimitExceeded as e:
+        expect(e.limit, "steps", "limit")
+    else:
+        raise AssertionError("the limit did not stop the program")
+    expect(output.getvalue(), "", "output of the handler")
+
+
+# ======== Remembered functions ========
+
+@check
+def memo_stats_count_hits_and_misses():
+    interpreter = whisper.Interpreter(CaptureSink())
+    interpreter.run("define remembered twice with n:\n    give back n * 2\n"
+                    "call twice with 1\ncall twice with 2\ncall twice with 1\ncall twice with [1]")
+    expect(interpreter.memo_stats(), {"twice": {"hits": 1, "misses": 2, "size": 2, "max_size": 1024}},
+           "stats after four calls")
+    interpreter.run("define remembered twice with n:\n    give back n * 3")
+    expect(interpreter.memo_stats()["twice"]["size"], 0, "results kept after redefining")
+
+
+@check
+def memo_size_bounds_the_cache():
+    interpreter = whisper.Interpreter(CaptureSink(), memo_size=3)
+    interpreter.run("define remembered square with n:\n    give back n * n\n"
+                    "for each i from 1 to 10:\n    call square with i\ncall square with 10\ncall square with 1")
+    expect(interpreter.memo_stats()["square"], {"hits": 1, "misses": 11, "size": 3, "max_size": 3},
+           "stats of a cache holding three results")
+
+
+def main():
+    failed = 0
+    for func in CHECKS:
+        try:
+            func()
+        except Exception as e:
+            failed += 1
+            print(f"FAIL  {func.__name__}: {type(e).__name__}: {e}")
+            continue
+        print(f"ok    {func.__name__}")
+    print(f"{len(CHECKS) - failed} of {len(CHECKS)} checks pass")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
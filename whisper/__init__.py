@@ -10,6 +10,11 @@ __license__ = "MIT"
 __email__ = "ibrahimmustafa787898@gmail.com"
 __website__ = "https://whisper.ibrahimmustafaopu.com"
 
-from .interpreter import main, run
+from .interpreter import Interpreter, LimitExceeded, Program, compile_program, main, run
+from .output import CaptureSink, OutputSink
+from .compiler import CompiledProgram, compile_whisper
+from .optimizer import optimize
 
-__all__ = ['main', 'run', '__version__', '__website__']
\ No newline at end of file
+__all__ = ['main', 'run', 'compile_program', 'Interpreter', 'Program',
+           'LimitExceeded', 'optimize', 'compile_whisper', 'CompiledProgram',
+           'CaptureSink', 'OutputSink', '__version__', '__website__']
\ No newline at end of file
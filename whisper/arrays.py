@@ -0,0 +1,344 @@
+"""
+Numeric arrays for Whisper programs.
+
+array([...]) turns a list of numbers into a NumberArray. Arithmetic and
+comparisons on an array work on every element at once (data * 2,
+data + other, data > 5), and sum, average, min, max and sort handle the
+whole array in one call. Comparisons give a mask that selects elements:
+data[data > 5].
+
+With NumPy installed the elements live in a NumPy array and every bulk
+operation is a single NumPy call. Without it they live in a standard
+library array.array and operations run as tight map() loops, which is
+slower but gives the same results.
+
+Both keep whole numbers as 64-bit integers. Where a result does not fit,
+it is worked out again with Python's own integers, the way the fallback
+computes it: element-wise results become floats and sum() gives the exact
+whole number. A whole number to a negative power is a float, as in
+Python.
+"""
+
+import operator
+from array import array as typed_array
+from itertools import repeat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Integer results at least this large are checked for 64-bit overflow
+INT_SAFE = 2 ** 62
+INT_MIN, INT_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def number_list(values):
+    """Return values as a list of numbers, or raise TypeError."""
+    if isinstance(values, NumberArray):
+        return values.tolist()
+    if isinstance(values, (int, float)):
+        return [values]
+    items = list(values)
+    for item in items:
+        if not isinstance(item, (int, float)):
+            raise TypeError(f"array() needs numbers, got {item!r}")
+    return items
+
+
+def store(items, typecode=None):
+    """Put a list of numbers in the backing storage."""
+    if numpy is not None:
+        values = numpy.array(items, dtype=None if items else int)
+        if values.dtype.kind not in 'if':
+            # True/False count as 1/0; integers too big for int64 become floats
+            values = values.astype(int) if values.dtype == bool else numpy.array(items, dtype=float)
+        return values
+    if typecode is None:
+        typecode = 'q' if all(isinstance(item, int) for item in items) else 'd'
+    try:
+        return typed_array(typecode, items)
+    except OverflowError:
+        return typed_array('d', items)
+
+
+class NumberArray:
+    """A fixed-type array of numbers with element-wise operators."""
+    __slots__ = ('values', 'buffer')
+    __hash__ = None
+
+    def __init__(self, values):
+        self.values = values
+        # NumPy only: storage with room to append; values is then its start
+        self.buffer = None
+
+    @property
+    def is_mask(self):
+        """True for the result of a comparison (one true/false per element)."""
+        if numpy is not None:
+            return self.values.dtype == bool
+        return self.values.typecode == 'b'
+
+    def tolist(self):
+        if getattr(self.values, 'typecode', None) == 'b':
+            # array.array has no bool type; masks are stored as 0/1
+            return [bool(value) for value in self.values]
+        return self.values.tolist()
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        # NumPy arrays (no typecode) and masks iterate as Python numbers / bools
+        if getattr(self.values, 'typecode', 'b') == 'b':
+            return iter(self.tolist())
+        return iter(self.values)
+
+    def __contains__(self, item):
+        return item in self.values
+
+    def __bool__(self):
+        if self.is_mask:
+            raise ValueError("a comparison of arrays is not true or false on its own; "
+                             "use it to pick elements, as in data[data > 5]")
+        return len(self.values) > 0
+
+    def __str__(self):
+        return str(self.tolist())
+
+    __repr__ = __str__
+
+    def __getitem__(self, key):
+        values = self.values
+        if isinstance(key, NumberArray):
+            if not key.is_mask:
+                raise IndexError("arrays can only be indexed by numbers, slices or comparisons")
+            if len(key) != len(values):
+                raise IndexError(f"mask has {len(key)} elements, array has {len(values)}")
+            if numpy is not None:
+                return NumberArray(values[key.values])
+            return NumberArray(typed_array(values.typecode,
+                                           [x for x, keep in zip(values, key.values) if keep]))
+        if isinstance(key, slice):
+            return NumberArray(values[key])
+        item = values[key]
+        return item.item() if numpy is not None else item
+
+    def append(self, item):
+        """Add a number at the end (the add statement)."""
+        number_list([item])
+        if numpy is not None:
+            self.append_numpy(item)
+            return
+        values = self.values
+        if values.typecode == 'q' and isinstance(item, float):
+            values = self.values = typed_array('d', values)
+        try:
+            values.append(item)
+        except OverflowError:
+            self.values = typed_array('d', values)
+            self.values.append(item)
+
+    def append_numpy(self, item):
+        # NumPy arrays cannot grow, so keep spare room the way a list does
+        values = self.values
+        dtype = values.dtype if values.dtype != bool else numpy.dtype(int)
+        if dtype.kind != 'f' and (isinstance(item, float) or not INT_MIN <= item <= INT_MAX):
+            dtype = numpy.dtype(float)
+        size = len(values)
+        buffer = self.buffer
+        if (buffer is None or values.base is not buffer or buffer.dtype != dtype
+                or size == len(buffer)):
+            buffer = self.buffer = numpy.empty(max(8, 2 * size), dtype)
+            buffer[:size] = values
+        buffer[size] = item
+        self.values = buffer[:size + 1]
+
+    def remove(self, item):
+        """Remove the first element equal to item, if any (the remove statement)."""
+        values = self.values
+        if numpy is not None:
+            found = numpy.flatnonzero(values == item)
+            if len(found):
+                self.values = numpy.delete(values, found[0])
+            return
+        for index, value in enumerate(values):
+            if value == item:
+                del values[index]
+                return
+
+    # ---- element-wise operations ----
+
+    def apply(self, func, other, reflected=False):
+        values = self.values
+        if isinstance(other, (list, tuple)):
+            other = NumberArray(store(number_list(other)))
+        if isinstance(other, NumberArray):
+            if len(other) != len(values):
+                raise ValueError(f"arrays have different lengths: {len(values)} and {len(other)}")
+            other = other.values
+        elif not isinstance(other, (int, float)):
+            return NotImplemented
+        if numpy is not None:
+            left, right = (other, values) if reflected else (values, other)
+            if func is operator.pow and is_whole(left) and is_whole(right) and negative(right):
+                left = numpy.asarray(left, dtype=float)
+            if isinstance(other, int) and not INT_MIN <= other <= INT_MAX:
+                return NumberArray(store(exact(func, left, right)))
+            with numpy.errstate(divide='raise', invalid='raise'):
+                try:
+                    result = func(left, right)
+                except FloatingPointError:
+                    raise ZeroDivisionError("division by zero")
+            if result.dtype.kind == 'i' and func not in COMPARISONS and overflows(func, left, right):
+                return NumberArray(store(exact(func, left, right)))
+            return NumberArray(result)
+        right = other if isinstance(other, typed_array) else repeat(other, len(values))
+        results = list(map(func, right, values) if reflected else map(func, values, right))
+        if func in COMPARISONS:
+            return NumberArray(typed_array('b', results))
+        return NumberArray(store(results))
+
+    def __neg__(self):
+        return self.unary(operator.neg)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return self.unary(abs)
+
+    def unary(self, func):
+        if numpy is not None:
+            values = self.values
+            if values.dtype.kind == 'i' and len(values) and values.min() == INT_MIN:
+                return NumberArray(store([func(x) for x in values.tolist()]))
+            return NumberArray(func(values))
+        return NumberArray(store(list(map(func, self.values)), self.values.typecode))
+
+
+COMPARISONS = {operator.lt, operator.le, operator.gt, operator.ge, operator.eq, operator.ne}
+
+
+# ---- NumPy integer overflow ----
+
+def is_whole(values):
+    if isinstance(values, int):
+        return True
+    return not isinstance(values, float) and values.dtype.kind in 'iu'
+
+
+def negative(values):
+    if isinstance(values, int):
+        return values < 0
+    return len(values) > 0 and values.min() < 0
+
+
+def overflows(func, left, right):
+    """Whether a whole-number NumPy result may have wrapped around."""
+    with numpy.errstate(all='ignore'):
+        approx = func(numpy.asarray(left, dtype=float), numpy.asarray(right, dtype=float))
+    return not numpy.all(numpy.abs(approx) < INT_SAFE)
+
+
+def exact(func, left, right):
+    """Work out func element by element with Python integers."""
+    left = left.tolist() if not isinstance(left, int) else left
+    right = right.tolist() if not isinstance(right, int) else right
+    if isinstance(left, int):
+        return [func(left, y) for y in right]
+    if isinstance(right, int):
+        return [func(x, right) for x in left]
+    return list(map(func, left, right))
+
+
+def elementwise(func):
+    def forward(self, other):
+        return self.apply(func, other)
+
+    def backward(self, other):
+        return self.apply(func, other, reflected=True)
+    return forward, backward
+
+
+for _name, _func in [('add', operator.add), ('sub', operator.sub), ('mul', operator.mul),
+                     ('truediv', operator.truediv), ('floordiv', operator.floordiv),
+                     ('mod', operator.mod), ('pow', operator.pow)]:
+    _forward, _backward = elementwise(_func)
+    setattr(NumberArray, f'__{_name}__', _forward)
+    setattr(NumberArray, f'__r{_name}__', _backward)
+
+for _name, _func in [('lt', operator.lt), ('le', operator.le), ('gt', operator.gt),
+                     ('ge', operator.ge), ('eq', operator.eq), ('ne', operator.ne)]:
+    setattr(NumberArray, f'__{_name}__', elementwise(_func)[0])
+
+del _name, _func, _forward, _backward
+
+
+# ======== Bulk operations ========
+
+def make_array(values=()):
+    """array(values): a NumberArray holding a list (or range) of numbers."""
+    return NumberArray(store(number_list(values)))
+
+
+def total(values, start=0):
+    """sum(values): add up a list or array."""
+    if isinstance(values, NumberArray):
+        if numpy is not None:
+            data = values.values
+            if (data.dtype.kind == 'i' and len(data)
+                    and max(data.max().item(), -data.min().item()) >= INT_MAX // len(data)):
+                # the 64-bit sum could wrap around: add up Python integers
+                return sum(data.tolist(), start)
+            return data.sum().item() + start
+        return sum(values.values, start)
+    return sum(values, start)
+
+
+def average(values):
+    """average(values): the mean of a list or array."""
+    if not len(values):
+        raise ValueError("average() of an empty list")
+    if isinstance(values, NumberArray) and numpy is not None and values.values.dtype.kind == 'f':
+        return values.values.mean().item()
+    return total(values) / len(values)
+
+
+def smallest(*args, **kwargs):
+    """min(): the smallest element of an array, or Python's min() otherwise."""
+    if len(args) == 1 and isinstance(args[0], NumberArray) and not kwargs:
+        if not len(args[0]):
+            raise ValueError("min() of an empty array")
+        return args[0].values.min().item() if numpy is not None else min(args[0].values)
+    return min(*args, **kwargs)
+
+
+def largest(*args, **kwargs):
+    """max(): the largest element of an array, or Python's max() otherwise."""
+    if len(args) == 1 and isinstance(args[0], NumberArray) and not kwargs:
+        if not len(args[0]):
+            raise ValueError("max() of an empty array")
+        return args[0].values.max().item() if numpy is not None else max(args[0].values)
+    return max(*args, **kwargs)
+
+
+def sort_values(values, descending=False):
+    """sort(values): a sorted copy of a list or array."""
+    if isinstance(values, NumberArray):
+        if numpy is not None:
+            result = numpy.sort(values.values)
+            return NumberArray(result[::-1].copy() if descending else result)
+        return NumberArray(typed_array(values.values.typecode,
+                                       sorted(values.values, reverse=descending)))
+    return sorted(values, reverse=descending)
+
+
+def sort_in_place(values, descending=False):
+    """Sort a list or array where it is (the sort statement)."""
+    if isinstance(values, NumberArray):
+        values.values = sort_values(values, descending).values
+    elif isinstance(values, list):
+        values.sort(reverse=descending)
+    else:
+        raise TypeError(f"cannot sort {type(values).__name__}")
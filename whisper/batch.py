@@ -0,0 +1,263 @@
+"""
+Batch runner: `whisper run-many`.
+
+Runs many Whisper scripts on a pool of worker processes. Workers are
+started once and keep the interpreter imported, so each script costs a
+message round trip instead of a new Python process. Every script gets a
+fresh Interpreter with captured output and the timeout as its time
+limit; a script that still runs past the timeout (stuck in a builtin or
+waiting for input) has its worker stopped and replaced.
+
+Scripts can be given as files, directories (every .wsp / .whisper file
+in them), glob patterns, or a manifest file listing one path or pattern
+per line (relative to the manifest; blank lines and # comments ignored).
+"""
+
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing.connection import wait
+
+from .interpreter import Interpreter, LimitExceeded
+from .output import CaptureSink
+
+EXTENSIONS = ('.wsp', '.whisper')
+TIMEOUT = 30.0
+# Extra seconds a worker gets to report its own time limit before it is killed
+GRACE = 1.0
+
+
+def expand(pattern, base=None):
+    """Return the script paths a file, directory or glob pattern names."""
+    if base and not os.path.isabs(pattern):
+        pattern = os.path.join(base, pattern)
+    if os.path.isdir(pattern):
+        paths = []
+        for root, dirs, files in os.walk(pattern):
+            dirs.sort()
+            paths += [os.path.join(root, name) for name in sorted(files)
+                      if name.endswith(EXTENSIONS)]
+        return paths
+    if glob.has_magic(pattern):
+        return sorted(path for path in glob.glob(pattern, recursive=True)
+                      if os.path.isfile(path))
+    return [pattern]
+
+
+def read_manifest(filename):
+    """Return the script paths listed in a manifest file."""
+    base = os.path.dirname(os.path.abspath(filename))
+    paths = []
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                paths += expand(line, base)
+    return paths
+
+
+def run_script(path, timeout=None):
+    """Run one script in this process and return its result."""
+    start = time.perf_counter()
+    output = CaptureSink()
+    result = {"path": path, "status": "ok", "error": None}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            code = f.read()
+        Interpreter(output, timeout=timeout).run(code)
+    except LimitExceeded as e:
+        result["status"] = "timeout" if e.limit == "time" else "error"
+        result["error"] = str(e)
+    except FileNotFoundError:
+        result["status"] = "error"
+        result["error"] = f"File '{path}' not found"
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+    result["output"] = output.getvalue()
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def worker(connection, timeout):
+    """Worker process: run the paths sent over connection until told to stop."""
+    while True:
+        try:
+            path = connection.recv()
+        except EOFError:
+            return
+        if path is None:
+            return
+        connection.send(run_script(path, timeout))
+
+
+class Worker:
+    """One worker process and the script it is running."""
+
+    def __init__(self, context, timeout):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=worker, args=(child, timeout), daemon=True)
+        self.process.start()
+        child.close()
+        self.job = None
+        self.started = 0.0
+
+    def send(self, job, path):
+        self.job = job
+        self.started = time.perf_counter()
+        self.connection.send(path)
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join()
+        self.connection.close()
+
+
+def run_many(paths, workers=None, timeout=TIMEOUT):
+    """Run scripts on a pool of worker processes.
+
+    Returns one result dict per path, in order, with status ("ok",
+    "error" or "timeout"), output, error and seconds.
+    """
+    results = [None] * len(paths)
+    if not paths:
+        return results
+    timeout = timeout or None
+    context = multiprocessing.get_context()
+    count = max(1, min(workers or os.cpu_count() or 1, len(paths)))
+    pool = [Worker(context, timeout) for _ in range(count)]
+    pending = list(enumerate(paths))
+    pending.reverse()
+    try:
+        while pending or any(w.job is not None for w in pool):
+            for w in pool:
+                if w.job is None and pending:
+                    job, path = pending.pop()
+                    w.send(job, path)
+            busy = [w for w in pool if w.job is not None]
+            now = time.perf_counter()
+            wait_for = None
+            if timeout:
+                wait_for = max(0.0, min(w.started + timeout + GRACE for w in busy) - now)
+            ready = wait([w.connection for w in busy], wait_for)
+            for w in busy:
+                if w.connection in ready:
+                    try:
+                        results[w.job] = w.connection.recv()
+                    except EOFError:
+                        results[w.job] = failed(paths[w.job], "error", "worker process died",
+                                                time.perf_counter() - w.started)
+                        replace(pool, w, context, timeout)
+                        continue
+                    w.job = None
+                elif timeout and time.perf_counter() - w.started >= timeout + GRACE:
+                    results[w.job] = failed(paths[w.job], "timeout",
+                                            f"timed out after {timeout:g}s", timeout)
+                    replace(pool, w, context, timeout)
+    finally:
+        for w in pool:
+            w.stop()
+    return results
+
+
+def failed(path, status, error, seconds):
+    return {"path": path, "status": status, "error": error, "output": "", "seconds": seconds}
+
+
+def replace(pool, dead, context, timeout):
+    """Swap a stuck or dead worker for a fresh one."""
+    dead.kill()
+    pool[pool.index(dead)] = Worker(context, timeout)
+
+
+def summarize(results, wall):
+    """Return counts, wall time and throughput for a batch."""
+    counts = {"ok": 0, "error": 0, "timeout": 0}
+    for result in results:
+        counts[result["status"]] += 1
+    return {
+        "scripts": len(results),
+        "ok": counts["ok"],
+        "errors": counts["error"],
+        "timeouts": counts["timeout"],
+        "wall_seconds": wall,
+        "script_seconds": sum(result["seconds"] for result in results),
+        "scripts_per_second": len(results) / wall if wall > 0 else 0.0,
+    }
+
+
+def run_many_main(args):
+    """whisper run-many <paths, dirs or globs...> [--manifest FILE] [--workers N] [--timeout SEC] [--show-output] [--json FILE]"""
+    options = {"--manifest": None, "--workers": None, "--timeout": TIMEOUT, "--json": None}
+    show_output = False
+    patterns = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in options:
+            if i + 1 >= len(args):
+                print(f"Error: {arg} needs a value")
+                return 2
+            options[arg] = args[i + 1]
+            i += 2
+            continue
+        if arg == "--show-output":
+            show_output = True
+        elif arg.startswith("--"):
+            print(f"Error: unknown option {arg}")
+            print(run_many_main.__doc__)
+            return 2
+        else:
+            patterns.append(arg)
+        i += 1
+
+    try:
+        paths = []
+        for pattern in patterns:
+            paths += expand(pattern)
+        if options["--manifest"]:
+            paths += read_manifest(options["--manifest"])
+        workers = int(options["--workers"]) if options["--workers"] else None
+        timeout = float(options["--timeout"])
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        return 2
+    if not paths:
+        print("Error: no scripts to run")
+        print(run_many_main.__doc__)
+        return 2
+
+    start = time.perf_counter()
+    results = run_many(paths, workers, timeout)
+    summary = summarize(results, time.perf_counter() - start)
+
+    for result in results:
+        print(f"{result['status']:<8}{result['seconds']:>9.3f}s  {result['path']}")
+        if show_output and result["output"]:
+            for line in result["output"].splitlines():
+                print(f"    {line}")
+        if result["error"]:
+            print(f"    Error: {result['error']}")
+    print(f"\n{summary['scripts']} scripts: {summary['ok']} ok, {summary['errors']} errors, "
+          f"{summary['timeouts']} timeouts")
+    print(f"Wall time {summary['wall_seconds']:.3f}s, "
+          f"{summary['scripts_per_second']:.1f} scripts/sec")
+
+    if options["--json"]:
+        with open(options["--json"], 'w', encoding='utf-8') as f:
+            json.dump({"summary": summary, "results": results}, f, indent=2)
+    sys.stdout.flush()
+    return 0 if summary["ok"] == summary["scripts"] else 1
@@ -0,0 +1,166 @@
+"""
+Benchmark suite for the Whisper interpreter: `whisper bench`.
+
+The bundled programs in whisper/bench_programs exercise the interpreter's
+hot paths (while counters, for each over large lists, recursive calls,
+story object math, string concatenation, when chains). Each program is
+parsed once, run a few times to warm up, then timed over several
+repetitions; the best time is reported together with statements executed
+per second. Results can be saved as a JSON baseline and later runs
+compared against it to catch regressions.
+"""
+
+import glob
+import json
+import os
+import sys
+import time
+
+from .interpreter import Interpreter, __version__, compile_program
+from .output import CaptureSink
+from .profiler import profile
+
+PROGRAM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_programs")
+
+WARMUP = 1
+REPEAT = 5
+# Slowdown (in percent) against the baseline that counts as a regression
+THRESHOLD = 10.0
+
+
+def bundled_programs():
+    """Return {name: path} of the bundled benchmark programs."""
+    paths = sorted(glob.glob(os.path.join(PROGRAM_DIR, "*.wsp")))
+    return {os.path.splitext(os.path.basename(path))[0]: path for path in paths}
+
+
+def count_statements(code):
+    """Return how many statements one run of code executes."""
+    result = profile(code, CaptureSink())
+    return sum(stats.hits for stats in result.lines.values())
+
+
+def bench_program(code, warmup=WARMUP, repeat=REPEAT):
+    """Time code; return a dict with statements, best/mean seconds and statements/sec."""
+    program = compile_program(code)
+    for _ in range(warmup):
+        Interpreter(CaptureSink()).run(program)
+    times = []
+    for _ in range(repeat):
+        interpreter = Interpreter(CaptureSink())
+        start = time.perf_counter()
+        interpreter.run(program)
+        times.append(time.perf_counter() - start)
+    count = count_statements(code)
+    best = min(times)
+    return {
+        "statements": count,
+        "best": best,
+        "mean": sum(times) / len(times),
+        "statements_per_second": count / best if best > 0 else 0.0,
+    }
+
+
+def run_benchmarks(names=None, warmup=WARMUP, repeat=REPEAT):
+    """Run the bundled programs (or the named ones); return {name: result}."""
+    programs = bundled_programs()
+    if names:
+        unknown = [name for name in names if name not in programs]
+        if unknown:
+            raise ValueError(f"Unknown benchmark: {', '.join(unknown)}")
+        programs = {name: programs[name] for name in names}
+    results = {}
+    for name, path in programs.items():
+        with open(path, "r", encoding="utf-8") as f:
+            results[name] = bench_program(f.read(), warmup, repeat)
+    return results
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """Return {name: percent change in statements/sec} and the names that regressed."""
+    changes = {}
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before or not before.get("statements_per_second"):
+            continue
+        change = (result["statements_per_second"] / before["statements_per_second"] - 1) * 100
+        changes[name] = change
+        if change < -threshold:
+            regressions.append(name)
+    return changes, regressions
+
+
+def format_results(results, changes=None):
+    """Return the results as a text table."""
+    lines = [f"{'benchmark':<16}{'statements':>12}{'best (s)':>11}{'mean (s)':>11}{'stmts/sec':>13}"
+             + (f"{'vs baseline':>13}" if changes is not None else "")]
+    for name, result in results.items():
+        line = (f"{name:<16}{result['statements']:>12}{result['best']:>11.4f}"
+                f"{result['mean']:>11.4f}{result['statements_per_second']:>13.0f}")
+        if changes is not None:
+            line += f"{changes[name]:>+12.1f}%" if name in changes else f"{'-':>13}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def bench_main(args):
+    """whisper bench [names...] [--warmup N] [--repeat N] [--save FILE] [--baseline FILE] [--threshold PCT]"""
+    options = {"--warmup": WARMUP, "--repeat": REPEAT, "--save": None,
+               "--baseline": None, "--threshold": THRESHOLD}
+    names = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg in options:
+            if i + 1 >= len(args):
+                print(f"Error: {arg} needs a value")
+                return 2
+            options[arg] = args[i + 1]
+            i += 2
+            continue
+        if arg == "--list":
+            for name in bundled_programs():
+                print(name)
+            return 0
+        if arg.startswith("--"):
+            print(f"Error: unknown option {arg}")
+            print(bench_main.__doc__)
+            return 2
+        names.append(arg)
+        i += 1
+
+    try:
+        warmup = int(options["--warmup"])
+        repeat = max(int(options["--repeat"]), 1)
+        threshold = float(options["--threshold"])
+        results = run_benchmarks(names, warmup, repeat)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 2
+
+    changes = regressions = None
+    if options["--baseline"]:
+        try:
+            with open(options["--baseline"], "r", encoding="utf-8") as f:
+                baseline = json.load(f).get("results", {})
+        except (OSError, ValueError) as e:
+            print(f"Error: cannot read baseline: {e}")
+            return 2
+        changes, regressions = compare(results, baseline, threshold)
+
+    print(f"Whisper v{__version__} on Python {sys.version.split()[0]}"
+          f" (warmup {warmup}, repeat {repeat})\n")
+    print(format_results(results, changes))
+
+    if options["--save"]:
+        data = {"version": __version__, "python": sys.version.split()[0],
+                "warmup": warmup, "repeat": repeat, "results": results}
+        with open(options["--save"], "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        print(f"\nSaved results to {options['--save']}")
+
+    if regressions:
+        print(f"\nSlower than baseline by more than {threshold:g}%: {', '.join(regressions)}")
+        return 1
+    return 0
@@ -0,0 +1,142 @@
+"""
+On-disk cache of parsed programs (.wspc files).
+
+Works like __pycache__: the first run of a script stores its parsed
+Program in a __wspcache__ folder next to the script (or in a cache folder
+of your choice); later runs load it instead of parsing the source again.
+Each cache file starts with a header naming the interpreter build (a
+hash of the whisper package's own source files) and the SHA-256 of the
+script it was made from, so editing the script, upgrading Whisper or
+changing any of its modules makes old entries miss and get rewritten.
+
+Cache files are Python pickles; compiled expression runners are rebuilt
+from their trees on load. Only load cache folders you trust.
+"""
+
+import contextlib
+import gc
+import glob
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+from .interpreter import Program, __version__, compile_program
+
+CACHE_FOLDER = "__wspcache__"
+SUFFIX = ".wspc"
+MAGIC = b"WSPC"
+
+_tag = None
+
+
+def package_hash():
+    """SHA-256 of the whisper package's .py files, which decide what a parsed Program looks like."""
+    digest = hashlib.sha256()
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for path in sorted(glob.glob(os.path.join(folder, "*.py"))):
+        digest.update(os.path.basename(path).encode("utf-8") + b"\0")
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def interpreter_tag():
+    """Identify the interpreter build a cache file belongs to."""
+    global _tag
+    if _tag is None:
+        try:
+            build = package_hash()
+        except OSError:
+            # Sources not readable (e.g. a frozen install): the version is all we know
+            build = "nosource"
+        _tag = (f"whisper-{__version__}-{build}-{sys.implementation.name}"
+                f"-{sys.version_info[0]}.{sys.version_info[1]}")
+    return _tag
+
+
+def source_hash(code):
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+
+def cache_path(filename, cache_dir=None):
+    """Return where the cached Program for a script file is stored."""
+    filename = os.path.abspath(filename)
+    base = os.path.basename(filename)
+    if cache_dir is None:
+        return os.path.join(os.path.dirname(filename), CACHE_FOLDER, base + SUFFIX)
+    # One folder for every script: keep names apart by their directory
+    folder = hashlib.sha256(os.path.dirname(filename).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{base}.{folder}{SUFFIX}")
+
+
+@contextlib.contextmanager
+def paused_gc():
+    """Pause the cycle collector while building a large, acyclic tree.
+
+    Loading or parsing a big program allocates many objects that all stay
+    alive; letting the collector rescan them over and over is most of the
+    cost.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def header(code):
+    return MAGIC + f"{interpreter_tag()}\n{source_hash(code)}\n".encode("ascii")
+
+
+def read_cached(path, code):
+    """Return the Program cached at path for this source, or None."""
+    expected = header(code)
+    try:
+        with open(path, "rb") as f:
+            if f.read(len(expected)) != expected:
+                return None
+            with paused_gc():
+                program = pickle.load(f)
+    except Exception:
+        return None
+    if not isinstance(program, Program):
+        return None
+    return program
+
+
+def write_cached(path, code, program):
+    """Store program at path; failures (read-only folders, ...) are ignored."""
+    try:
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(header(code))
+                pickle.dump(program, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+    except (OSError, pickle.PicklingError, RecursionError):
+        pass
+
+
+def load_program(filename, cache_dir=None, use_cache=True):
+    """Read a script file and return its Program, using the cache if possible."""
+    with open(filename, "r", encoding="utf-8") as f:
+        code = f.read()
+    if not use_cache:
+        with paused_gc():
+            return compile_program(code)
+    path = cache_path(filename, cache_dir)
+    program = read_cached(path, code)
+    if program is None:
+        with paused_gc():
+            program = compile_program(code)
+        write_cached(path, code, program)
+    return program
@@ -0,0 +1,604 @@
+"""
+Whisper to Python compiler: `whisper --compile`.
+
+translate() turns a parsed program into the source of a Python module.
+Blocks become Python if / while / for / try statements, functions become
+Python functions, and expressions become Python expressions, so a
+compiled program runs without the interpreter's statement dispatch. The
+module imports its helpers from runtime.py, which reproduce the
+interpreter's behaviour one statement at a time: a compiled program prints
+exactly what the interpreted one does, including its error messages.
+
+compile_whisper() compiles that source to a code object ready to run;
+`whisper --compile program.wsp -o program.py` saves it to read or run
+with plain Python. Compiled programs have the recursion depth limit but
+no step or time limit.
+"""
+
+import math
+import os
+import re
+import sys
+
+from . import expressions as ex
+from . import nodes
+from .interpreter import MAX_DEPTH, compile_program
+from .memo import MEMO_SIZE
+from .optimizer import Invariant, optimize, passes_option
+from .runtime import Runtime
+
+INDENT = "    "
+
+
+def calls_inside(body):
+    """True if running body can call a function (nested definitions aside)."""
+    for stmt in body:
+        if isinstance(stmt, nodes.Call):
+            return True
+        if isinstance(stmt, nodes.FunctionDef):
+            continue
+        for child in child_bodies(stmt):
+            if calls_inside(child):
+                return True
+    return False
+
+
+def child_bodies(stmt):
+    """The statement lists nested in a statement."""
+    if isinstance(stmt, nodes.When):
+        return [body for cond, body in stmt.branches]
+    if isinstance(stmt, nodes.Question):
+        return [stmt.yes_body, stmt.no_body or []]
+    if isinstance(stmt, nodes.Attempt):
+        return [stmt.body, stmt.handler or []]
+    if isinstance(stmt, (nodes.While, nodes.ForEach, nodes.ForEachLine, nodes.ForRange,
+                         nodes.Repeat, nodes.FunctionDef, nodes.Scope)):
+        return [stmt.body]
+    return []
+
+
+def literal(value):
+    """Python source for a constant."""
+    if isinstance(value, float) and not math.isfinite(value):
+        return f"float({str(value)!r})"
+    text = repr(value)
+    return f"({text})" if text.startswith("-") else text
+
+
+class Translator:
+    """Builds the Python module for one program."""
+
+    def __init__(self):
+        self.header = []     # module level constants
+        self.constants = {}  # constant source -> its name
+        self.functions = []  # finished Python functions, as lists of lines
+        self.lines = None
+        self.depth = 0
+        self.loops = 0
+        self.in_function = False
+        self.temps = 0
+
+    # ---- output ----
+
+    def line(self, text):
+        self.lines.append(INDENT * self.depth + text)
+
+    def temp(self, prefix):
+        self.temps += 1
+        return f"{prefix}{self.temps}"
+
+    def constant(self, prefix, source):
+        """Name a module level constant, sharing identical ones."""
+        name = self.constants.get(source)
+        if name is None:
+            name = self.constants[source] = f"{prefix}{len(self.constants) + 1}"
+            self.header.append(f"{name} = {source}")
+        return name
+
+    def module(self, filename):
+        """Translate the program and return the module source."""
+        parts = [f"# Compiled from {filename} by whisper --compile",
+                 "from whisper.runtime import *", ""]
+        if self.header:
+            parts += self.header + [""]
+        for function in self.functions:
+            parts += [""] + function + [""]
+        parts += ["", 'if __name__ == "__main__":', INDENT + "run_standalone(main)", ""]
+        return "\n".join(parts)
+
+    def function(self, name, body, in_function):
+        """Translate a statement list into a Python function (R, V)."""
+        saved = self.lines, self.depth, self.loops, self.in_function
+        self.lines, self.depth, self.loops, self.in_function = [], 1, 0, in_function
+        self.line("write = R.write")
+        self.block(body)
+        lines = [f"def {name}(R, V):"] + self.lines
+        self.lines, self.depth, self.loops, self.in_function = saved
+        self.functions.append(lines)
+
+    def block(self, body):
+        if not body:
+            self.line("pass")
+        for stmt in body:
+            getattr(self, "stmt_" + type(stmt).__name__)(stmt)
+
+    def indented(self, body):
+        self.depth += 1
+        self.block(body)
+        self.depth -= 1
+
+    def report(self, prefix, body):
+        """body, printing errors after prefix (a when or question branch)."""
+        self.line("try:")
+        self.indented(body)
+        self.line("except LimitExceeded:")
+        self.line(INDENT + "raise")
+        self.line("except Exception as _e:")
+        self.line(INDENT + f'write({prefix!r} + f"{{_e}}\\n")')
+
+    # ---- expressions ----
+
+    def expr(self, expression, v="V"):
+        """Python source for a compiled Expression."""
+        if expression.tree is None:
+            return f"fail({expression.error!r})"
+        return self.node(expression.tree, v)
+
+    def node(self, node, v):
+        kind = type(node)
+        if kind is ex.Const:
+            return literal(node.value)
+        if kind is ex.Name:
+            name = repr(node.name)
+            return f"({v}[{name}] if {name} in {v} else load({v}, {name}))"
+        if kind in (ex.Property, ex.NameSeq):
+            # multi-word names are resolved by the expression engine
+            return f"{self.constant('N', repr(node) + '.compile()')}({v})"
+        if kind is ex.Unary:
+            op = "not " if node.op == "not" else node.op
+            return f"({op}{self.node(node.operand, v)})"
+        if kind is ex.Binary:
+            return f"({self.node(node.left, v)} {node.op} {self.node(node.right, v)})"
+        if kind is ex.Additive:
+            operands = [self.node(operand, v) for operand in node.operands]
+            if len(operands) == 2:
+                helper = "add" if node.ops[0] == "+" else "subtract"
+                return f"{helper}({operands[0]}, {operands[1]})"
+            return f"additive(({', '.join(operands)}), {tuple(node.ops)!r})"
+        if kind is ex.Compare:
+            parts = [self.node(node.operands[0], v)]
+            for op, operand in zip(node.ops, node.operands[1:]):
+                parts += [op, self.node(operand, v)]
+            if len(node.ops) == 1:
+                return f"({' '.join(parts)})"
+            return f"(True if {' '.join(parts)} else False)"
+        if kind is ex.BoolOp:
+            return "(" + f" {node.op} ".join(self.node(value, v) for value in node.values) + ")"
+        if kind is ex.IfExp:
+            return (f"({self.node(node.body, v)} if {self.node(node.test, v)} "
+                    f"else {self.node(node.orelse, v)})")
+        if kind is ex.Call:
+            if isinstance(node.func, ex.Name):
+                func = f"function({v}, {node.func.name!r})"
+            else:
+                func = self.node(node.func, v)
+            if isinstance(node.func, ex.Name) and node.func.name in ex.READ_ONLY_BUILTINS:
+                value = self.node
+            else:
+                value = self.kept
+            args = [value(arg, v) for arg in node.args]
+            args += [f"{key}={value(arg, v)}" for key, arg in node.kwargs]
+            return f"{func}({', '.join(args)})"
+        if kind is ex.Subscript:
+            return f"get_item({self.node(node.value, v)}, {self.node(node.index, v)})"
+        if kind is ex.Slice:
+            parts = [self.node(part, v) if part is not None else "None"
+                     for part in (node.lower, node.upper, node.step)]
+            return f"slice({', '.join(parts)})"
+        if kind is ex.Attribute:
+            return f"({self.node(node.value, v)}).{node.attr}"
+        if kind is ex.ListExpr:
+            return "[" + ", ".join(self.kept(item, v) for item in node.items) + "]"
+        if kind is ex.TupleExpr:
+            return "(" + "".join(self.kept(item, v) + ", " for item in node.items) + ")"
+        if kind is ex.DictExpr:
+            return "{" + ", ".join(f"{self.node(key, v)}: {self.kept(value, v)}"
+                                   for key, value in node.pairs) + "}"
+        if kind is Invariant:
+            key = repr(node.key)
+            return f"({v}[{key}] if {key} in {v} else remember({v}, {key}, {self.node(node.value, v)}))"
+        raise TypeError(f"cannot compile {kind.__name__} expressions")
+
+    def kept(self, node, v):
+        """Python source for a node whose value is kept (see Node.compile_kept)."""
+        if type(node) is ex.Name:
+            return f"share({self.node(node, v)})"
+        if type(node) is ex.IfExp:
+            return (f"({self.kept(node.body, v)} if {self.node(node.test, v)} "
+                    f"else {self.kept(node.orelse, v)})")
+        return self.node(node, v)
+
+    def kept_expr(self, expression):
+        """Python source for a compiled Expression whose value a statement keeps."""
+        if expression.tree is None:
+            return self.expr(expression)
+        return self.kept(expression.tree, "V")
+
+    # ---- loops ----
+
+    def loop(self, header, body, condition=None):
+        """A for loop; condition (Python source) skips items it rejects."""
+        catching = calls_inside(body)
+        if catching:
+            self.start_catching()
+        self.line(header)
+        self.depth += 1
+        if condition is not None:
+            self.line(f"if not {condition}:")
+            self.line(INDENT + "continue")
+        if catching:
+            self.line("try:")
+            self.depth += 1
+            self.loop_body(body)
+            self.depth -= 1
+            self.catch_signals()
+        else:
+            self.loop_body(body)
+        self.depth -= 1
+        if catching:
+            self.stop_catching()
+
+    def loop_body(self, body):
+        self.loops += 1
+        self.block(body)
+        self.loops -= 1
+
+    def start_catching(self):
+        # the loop's body calls functions, whose break / continue may reach it
+        self.line("R.loops += 1")
+        self.line("try:")
+        self.depth += 1
+
+    def stop_catching(self):
+        self.depth -= 1
+        self.line("finally:")
+        self.line(INDENT + "R.loops -= 1")
+
+    def catch_signals(self):
+        self.line("except BreakLoop:")
+        self.line(INDENT + "break")
+        self.line("except ContinueLoop:")
+        self.line(INDENT + "continue")
+
+    # ---- statements ----
+
+    def stmt_Break(self, stmt):
+        self.line("break" if self.loops else 'R.escape("break")')
+
+    def stmt_Continue(self, stmt):
+        self.line("continue" if self.loops else 'R.escape("continue")')
+
+    def stmt_Assign(self, stmt):
+        self.line(f"V[{stmt.name!r}] = {self.kept_expr(stmt.expr)}")
+
+    def stmt_Forget(self, stmt):
+        self.line(f"if {stmt.name!r} in V:")
+        self.line(INDENT + f"del V[{stmt.name!r}]")
+
+    def stmt_StoryObject(self, stmt):
+        record = self.constant("Record", f"record_type({stmt.fields!r})")
+        self.line(f"_r = {record}()")
+        for slot, value in stmt.props:
+            self.line(f"_r.{slot} = {self.kept_expr(value)}")
+        self.line(f"V[{stmt.name!r}] = _r")
+
+    def stmt_Loses(self, stmt):
+        self.line(f"lose(V, {stmt.obj!r}, {stmt.slot!r}, {self.expr(stmt.amount)})")
+
+    def stmt_Gains(self, stmt):
+        self.line(f"gain(V, {stmt.obj!r}, {stmt.slot!r}, {self.expr(stmt.amount)})")
+
+    def stmt_GainsFrom(self, stmt):
+        self.line(f"gain_from(V, {stmt.obj!r}, {stmt.slot!r}, {stmt.source!r}, {stmt.source_slot!r})")
+
+    def stmt_Question(self, stmt):
+        self.line("try:")
+        self.line(INDENT + f"_t = {self.expr(stmt.condition)}")
+        self.line("except Exception as _e:")
+        self.line(INDENT + 'write(f"Error: {_e}\\n")')
+        self.line("else:")
+        self.depth += 1
+        self.line("if _t:")
+        self.depth += 1
+        self.report("Error: ", stmt.yes_body)
+        self.depth -= 1
+        if stmt.no_body:
+            self.line("else:")
+            self.depth += 1
+            self.report("Error: ", stmt.no_body)
+            self.depth -= 1
+        self.depth -= 1
+
+    def stmt_When(self, stmt):
+        # Pick the branch first (0: none yet, -1: a condition failed), then run it
+        chosen = self.temp("_b")
+        self.line(f"{chosen} = 0")
+        for number, (cond, body) in enumerate(stmt.branches, 1):
+            if number > 1:
+                self.line(f"if {chosen} == 0:")
+                self.depth += 1
+            if cond is None:
+                self.line(f"{chosen} = {number}")
+            else:
+                self.line("try:")
+                self.line(INDENT + f"_t = {self.expr(cond)}")
+                self.line("except Exception as _e:")
+                self.line(INDENT + f"write({cond_prefix(cond)!r} + f\"{{_e}}\\n\")")
+                self.line(INDENT + f"{chosen} = -1")
+                self.line("else:")
+                self.line(INDENT + "if _t:")
+                self.line(INDENT * 2 + f"{chosen} = {number}")
+            if number > 1:
+                self.depth -= 1
+        for number, (cond, body) in enumerate(stmt.branches, 1):
+            self.line(f"{'if' if number == 1 else 'elif'} {chosen} == {number}:")
+            self.depth += 1
+            if cond is None:
+                self.block(body)
+            else:
+                self.report(cond_prefix(cond), body)
+            self.depth -= 1
+
+    def stmt_FunctionDef(self, stmt):
+        name = f"{self.temp('w')}_{re.sub(r'[^0-9A-Za-z_]', '_', stmt.name)}"
+        self.function(name, stmt.body, True)
+        self.line(f"R.define({stmt.name!r}, {tuple(stmt.params)!r}, {name}, {stmt.remembered!r})")
+
+    def stmt_Call(self, stmt):
+        args = ", ".join(self.expr(arg) for arg in stmt.args)
+        self.line(f"R.call({stmt.name!r}, [{args}], V)")
+
+    def stmt_Return(self, stmt):
+        if self.in_function:
+            self.line(f"return {self.expr(stmt.expr)}")
+        else:
+            # give back outside a function ends the program
+            self.line(self.expr(stmt.expr))
+            self.line("return")
+
+    def stmt_Attempt(self, stmt):
+        self.line("try:")
+        self.indented(stmt.body)
+        self.line("except LimitExceeded:")
+        self.line(INDENT + "raise")
+        self.line("except Exception as _e:")
+        self.depth += 1
+        if stmt.handler:
+            self.line("V['error'] = str(_e)")
+            self.block(stmt.handler)
+        else:
+            self.line("pass")
+        self.depth -= 1
+
+    def stmt_Scope(self, stmt):
+        for name in stmt.names:
+            self.line(f"V.pop({name!r}, None)")
+        self.line("try:")
+        self.indented(stmt.body)
+        self.line("finally:")
+        for name in stmt.names:
+            self.line(INDENT + f"V.pop({name!r}, None)")
+
+    def stmt_Increase(self, stmt):
+        self.change(stmt, "+", "increase")
+
+    def stmt_Decrease(self, stmt):
+        self.change(stmt, "-", "decrease")
+
+    def change(self, stmt, op, helper):
+        # the common case, a variable of this frame, without a call
+        name = repr(stmt.name)
+        amount = self.expr(stmt.expr)
+        self.line(f"if {name} in V:")
+        self.line(INDENT + f"V[{name}] = V[{name}] {op} {amount}")
+        self.line("else:")
+        self.line(INDENT + f"{helper}(V, {name}, {amount})")
+
+    def stmt_Ask(self, stmt):
+        self.line(f"V[{stmt.name!r}] = ask(R.output, {stmt.prompt!r})")
+
+    def stmt_Output(self, stmt):
+        self.line("try:")
+        self.line(INDENT + f"_r = {self.expr(stmt.expr)}")
+        self.line(INDENT + ('write(f"{_r}\\n")' if stmt.newline else "write(str(_r))"))
+        self.line("except NameError as _e:")
+        self.line(INDENT + 'write(f"Error: {_e}\\n")')
+
+    def stmt_Write(self, stmt):
+        self.line(f"write_file({self.expr(stmt.content)}, {self.expr(stmt.filename)})")
+
+    def stmt_Read(self, stmt):
+        self.line(f"V[{stmt.name!r}] = read_file({self.expr(stmt.filename)})")
+
+    def stmt_ChangeCase(self, stmt):
+        method = "upper" if stmt.upper else "lower"
+        self.line(f"V[{stmt.name!r}] = str({self.expr(stmt.expr)}).{method}()")
+
+    def stmt_While(self, stmt):
+        catching = calls_inside(stmt.body)
+        if catching:
+            self.start_catching()
+        self.line("while True:")
+        self.depth += 1
+        self.line("try:")
+        self.line(INDENT + f"if not {self.expr(stmt.condition)}:")
+        self.line(INDENT * 2 + "break")
+        self.line("except Exception as _e:")
+        self.line(INDENT + 'write(f"Error in while loop: {_e}\\n")')
+        self.line(INDENT + "break")
+        self.line("try:")
+        self.depth += 1
+        self.loop_body(stmt.body)
+        self.depth -= 1
+        if catching:
+            self.catch_signals()
+        self.line("except LimitExceeded:")
+        self.line(INDENT + "raise")
+        self.line("except Exception as _e:")
+        self.line(INDENT + 'write(f"Error in while loop: {_e}\\n")')
+        self.line(INDENT + "break")
+        self.depth -= 1
+        if catching:
+            self.stop_catching()
+
+    def stmt_ForEach(self, stmt):
+        # like the interpreter, a value that cannot be read is an empty list
+        self.line("try:")
+        self.line(INDENT + f"_items = items_of({self.expr(stmt.expr)})")
+        self.line("except:")
+        self.line(INDENT + "_items = []")
+        self.for_each(stmt, "_items")
+
+    def stmt_ForEachLine(self, stmt):
+        self.for_each(stmt, f"read_lines(str({self.expr(stmt.filename)}))")
+
+    def for_each(self, stmt, items):
+        condition = self.expr(stmt.condition) if stmt.condition is not None else None
+        self.loop(f"for V[{stmt.var!r}] in {items}:", stmt.body, condition)
+
+    def stmt_ForRange(self, stmt):
+        step = self.expr(stmt.step) if stmt.step is not None else "None"
+        items = (f"count_range(whole_number({self.expr(stmt.start)}, 'from'), "
+                 f"whole_number({self.expr(stmt.stop)}, 'to'), {step})")
+        self.loop(f"for V[{stmt.var!r}] in {items}:", stmt.body)
+
+    def stmt_Repeat(self, stmt):
+        self.loop(f"for _ in range(int({self.expr(stmt.count)})):", stmt.body)
+
+    def stmt_AddItem(self, stmt):
+        self.line(f"add_item(V, {stmt.name!r}, {self.expr(stmt.item)})")
+
+    def stmt_RemoveItem(self, stmt):
+        self.line(f"remove_item(V, {stmt.name!r}, {self.expr(stmt.item)})")
+
+    def stmt_Append(self, stmt):
+        self.line(f"append_to(V, {stmt.name!r}, {self.expr(stmt.item)})")
+
+    def stmt_SortList(self, stmt):
+        self.line(f"sort_list(V, {stmt.name!r}, {stmt.descending!r})")
+
+    def stmt_Keep(self, stmt):
+        condition = self.expr(stmt.condition, "S")
+        self.line(f"keep(V, {stmt.name!r}, {stmt.var!r}, lambda S: {condition})")
+
+    def stmt_Unknown(self, stmt):
+        self.line(f"write({'Unknown command: ' + stmt.text + chr(10)!r})")
+
+
+def cond_prefix(cond):
+    return f"Error evaluating condition '{cond.source}': "
+
+
+def translate(program, filename="<whisper>"):
+    """Return the Python source of a Program (or Whisper source text)."""
+    if isinstance(program, str):
+        program = compile_program(program)
+    translator = Translator()
+    # main comes last, after the functions it defines
+    translator.function("main", program.statements, False)
+    return translator.module(filename)
+
+
+class CompiledProgram:
+    """A Whisper program compiled to a Python code object.
+
+    Like a Program it never changes, so it can be run any number of times.
+    """
+    __slots__ = ('source', 'code')
+
+    def __init__(self, source, code):
+        self.source = source
+        self.code = code
+
+    def run(self, variables=None, output=None, max_depth=MAX_DEPTH, memo_size=MEMO_SIZE):
+        """Run the program and return the variable store used."""
+        if variables is None:
+            variables = {}
+        namespace = {'__name__': 'whisper.compiled'}
+        exec(self.code, namespace)
+        Runtime(variables, output, max_depth, memo_size).run(namespace['main'])
+        return variables
+
+
+def compile_whisper(program, filename="<whisper>"):
+    """Compile a Program (or Whisper source text) into a CompiledProgram."""
+    source = translate(program, filename)
+    return CompiledProgram(source, compile(source, f"{filename} (compiled)", 'exec'))
+
+
+def compile_main(args):
+    """whisper --compile [-o OUT.py] [--no-cache] [--optimize[=PASSES]] [--max-depth N] [--memo-size N] <filename>
+
+Compiles a Whisper program to Python and runs it, or with -o writes the
+Python module to OUT.py instead (run it with python OUT.py).
+    """
+    from .cache import load_program
+
+    use_cache = True
+    passes = ()
+    target = None
+    limits = {'--max-depth': MAX_DEPTH, '--memo-size': MEMO_SIZE}
+    filename = None
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--no-cache':
+            use_cache = False
+        elif arg in ('-o', '--output'):
+            if i + 1 >= len(args):
+                print(f"Error: {arg} needs a file name")
+                return
+            target = args[i + 1]
+            i += 1
+        elif arg == '--optimize' or arg.startswith('--optimize='):
+            try:
+                passes = passes_option(arg)
+            except ValueError as e:
+                print(f"Error: {e}")
+                return
+        elif arg in limits:
+            if i + 1 >= len(args):
+                print(f"Error: {arg} needs a number")
+                return
+            try:
+                limits[arg] = int(args[i + 1])
+            except ValueError:
+                print(f"Error: {arg} needs a number, got '{args[i + 1]}'")
+                return
+            i += 1
+        elif arg.startswith('-') or filename is not None:
+            print(f"Error: unexpected argument '{arg}'")
+            print(f"Usage: {compile_main.__doc__.splitlines()[0]}")
+            return
+        else:
+            filename = arg
+        i += 1
+    if filename is None:
+        print(f"Usage: {compile_main.__doc__.splitlines()[0]}")
+        return
+
+    try:
+        program = load_program(filename, os.environ.get("WHISPER_CACHE_DIR") or None, use_cache)
+        if passes:
+            program = optimize(program, passes)
+        if target is not None:
+            with open(target, 'w', encoding='utf-8') as f:
+                f.write(translate(program, filename))
+            print(f"Compiled {filename} to {target}", file=sys.stderr)
+            return
+        compile_whisper(program, filename).run(
+            max_depth=limits['--max-depth'], memo_size=limits['--memo-size'])
+    except FileNotFoundError:
+        print(f"Error: File '{filename}' not found")
+    except Exception as e:
+        print(f"Error: {e}")
@@ -0,0 +1,155 @@
+"""
+Condition cache: `whisper --cache-conditions`.
+
+A `while`, `when` or question condition (and the value of a `let`) that
+only reads variables holding numbers, text, True/False or None gives the
+same result as long as those variables keep the same values. The cache
+remembers, for each such expression, the values it read last time and
+its result; when every variable still holds the very same value the
+result is reused instead of evaluating the expression again.
+
+Each variable's current value acts as its version: numbers and text
+never change in place, so a variable that still holds the same object
+has not been assigned since. This needs no bookkeeping in the variable
+store, which stays a plain dict, and nothing is slowed down when the
+cache is off.
+
+Expressions whose inputs change on almost every evaluation (a loop
+counter) stop being cached after MIN_TRIES misses: their run becomes the
+plain expression's again, so they cost nothing more than without the
+cache.
+"""
+
+import weakref
+
+from .optimizer import LEAVES, SCALARS, free_names, rebuild
+from . import nodes
+
+# Misses after which a condition that rarely hits is no longer cached
+MIN_TRIES = 32
+
+MISSING = object()
+
+
+class CachedCondition:
+    """An Expression that reuses its last result while its inputs are unchanged.
+
+    Has the run(variables) and source of the Expression it wraps, so the
+    executors use it like any other expression.
+    """
+    __slots__ = ('expression', 'source', 'names', 'reads', 'result',
+                 'hits', 'misses', 'run')
+
+    def __init__(self, expression, names):
+        self.expression = expression
+        self.source = expression.source
+        self.names = names
+        self.reads = None
+        self.result = None
+        self.hits = 0
+        self.misses = 0
+        self.run = self.cached
+
+    def __repr__(self):
+        return f"CachedCondition({self.source!r})"
+
+    def cached(self, v):
+        reads = self.reads
+        if reads is not None:
+            for name, value in reads:
+                try:
+                    if v[name] is not value:
+                        break
+                except KeyError:
+                    if value is not MISSING:
+                        break
+            else:
+                self.hits += 1
+                return self.result
+        return self.refresh(v)
+
+    def refresh(self, v):
+        """Evaluate the expression, keeping the result if its inputs allow it."""
+        self.reads = None
+        self.misses += 1
+        if self.misses >= MIN_TRIES and self.hits < self.misses:
+            self.run = self.expression.run
+        snapshot = []
+        for name in self.names:
+            try:
+                value = v[name]
+            except KeyError:
+                value = MISSING
+            if value is not MISSING and type(value) not in SCALARS:
+                # a list or object can change without being assigned
+                return self.expression.run(v)
+            snapshot.append((name, value))
+        result = self.expression.run(v)
+        if type(result) in SCALARS:
+            self.reads = tuple(snapshot)
+            self.result = result
+        return result
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "cached": self.run is not self.expression.run}
+
+
+class ConditionCache:
+    """The cached conditions of one Interpreter."""
+
+    def __init__(self):
+        self.conditions = {}  # Expression -> CachedCondition
+        # Program -> rewritten statements, dropped with the Program
+        self.prepared = weakref.WeakKeyDictionary()
+
+    def prepare(self, program):
+        """Return the program's statements with their cacheable expressions wrapped."""
+        statements = self.prepared.get(program)
+        if statements is None:
+            statements = self.prepared[program] = self.rewrite(program.statements)
+        return statements
+
+    def rewrite(self, statements):
+        result = []
+        for stmt in statements:
+            if isinstance(stmt, (nodes.While, nodes.When, nodes.Question, nodes.Assign)):
+                stmt = rebuild(stmt, self.wrap, self.rewrite)
+            else:
+                stmt = rebuild(stmt, lambda expression: expression, self.rewrite)
+            result.append(stmt)
+        return result
+
+    def wrap(self, expression):
+        """The CachedCondition for an expression, or the expression if it cannot be cached."""
+        cached = self.conditions.get(expression)
+        if cached is not None:
+            return cached
+        tree = expression.tree
+        if tree is None or isinstance(tree, LEAVES):
+            return expression
+        names = free_names(tree)
+        if names is None:
+            return expression
+        cached = self.conditions[expression] = CachedCondition(expression, tuple(sorted(names)))
+        return cached
+
+    def stats(self):
+        """{expression source: hits, misses, cached} for every cached expression.
+
+        cached is False once an expression missed too often to stay cached.
+        """
+        return {cached.source: cached.stats() for cached in self.conditions.values()}
+
+
+def format_stats(stats):
+    """A text report of condition_stats(), most hits first."""
+    hits = sum(counts["hits"] for counts in stats.values())
+    misses = sum(counts["misses"] for counts in stats.values())
+    rate = 100.0 * hits / (hits + misses) if hits + misses else 0.0
+    out = [f"Condition cache: {hits} hits, {misses} misses ({rate:.1f}% hit rate)", "",
+           f"{'hits':>10} {'misses':>10} {'cached':>7}  condition"]
+    for source, counts in sorted(stats.items(), key=lambda item: -item[1]["hits"]):
+        cached = "yes" if counts["cached"] else "no"
+        out.append(f"{counts['hits']:>10} {counts['misses']:>10} {cached:>7}  {source}")
+    return "\n".join(out)
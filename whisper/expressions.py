@@ -0,0 +1,976 @@
+"""
+Whisper expression engine.
+
+Expressions are parsed once into a small syntax tree and compiled into
+nested Python closures. A compiled expression reads values straight from the
+variable store, so lists, dicts and strings are never turned back into text
+and re-parsed.
+
+The grammar is a Python-like subset:
+
+    or / and / not, comparisons (== != < > <= >= in, not in, is, is not),
+    | ^ & << >>, + -, * / // %, unary - + ~, **, calls, indexing, slicing,
+    attribute access, list / tuple / dict literals, x if cond else y
+
+plus two Whisper additions: "hero health" compiles to a direct read of
+property "health" of the story object "hero" (or of a variable literally
+named "hero health"), and a
+chain of + mixing text with numbers joins the numeric parts as text, so
+"Total: " + 1 + 2 gives "Total: 3".
+"""
+
+import math
+import operator
+import random
+
+from .arrays import NumberArray, average, largest, make_array, smallest, sort_values, total
+from .lazy import is_lazy, lazy_slice, lines
+from .story import StoryRecord, slot_name
+from .text import TextBuilder
+from .tokenizer import Token, describe_error, tokenize
+
+BUILTINS = {
+    "sqrt": math.sqrt,
+    "pow": math.pow,
+    "abs": abs,
+    "round": round,
+    "floor": math.floor,
+    "ceil": math.ceil,
+    "random": random.random,
+    "randint": random.randint,
+    "min": smallest,
+    "max": largest,
+    "sum": total,
+    "average": average,
+    "array": make_array,
+    "sort": sort_values,
+    "len": len,
+    "str": str,
+    "list": list,
+    "range": range,
+    "lines": lines,
+}
+
+# Builtins that never keep or give back their arguments, so passing them a
+# text builder leaves it unshared
+READ_ONLY_BUILTINS = {"sqrt", "pow", "abs", "round", "floor", "ceil", "len", "str"}
+
+CONSTANTS = {"True": True, "False": False, "None": None}
+
+KEYWORDS = {"and", "or", "not", "in", "is", "if", "else"}
+
+# Attributes that could be used to reach interpreter internals
+BLOCKED_ATTRIBUTES = {"format", "format_map"}
+
+
+# ======== Syntax tree ========
+
+def undefined(name):
+    """Resolve a name that is not a variable."""
+    if name in BUILTINS:
+        return BUILTINS[name]
+    raise NameError(f"Variable '{name}' is not defined")
+
+
+class Node:
+    """Base class for expression nodes."""
+    __slots__ = ()
+
+    def compile_kept(self):
+        """Compile this node where its value is kept (a list item, a call
+        argument): a text builder read there is marked shared (text.py)."""
+        return self.compile()
+
+    def __repr__(self):
+        fields = ', '.join(f"{getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class Const(Node):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def compile(self):
+        value = self.value
+        return lambda v: value
+
+
+class Name(Node):
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def compile(self):
+        name = self.name
+
+        def load(v):
+            try:
+                return v[name]
+            except KeyError:
+                return undefined(name)
+        return load
+
+    def compile_kept(self):
+        name = self.name
+
+        def load(v):
+            try:
+                value = v[name]
+            except KeyError:
+                return undefined(name)
+            if type(value) is TextBuilder:
+                value.shared = True
+            return value
+        return load
+
+
+class Property(Node):
+    """obj prop: a property of a story object, resolved when compiled.
+
+    The object and property names are fixed at compile time, so reading
+    "hero health" is a variable lookup and a slot read however many
+    objects exist.
+    A variable literally named "hero health" is used when hero has no
+    such property.
+    """
+    __slots__ = ('obj', 'prop')
+
+    def __init__(self, obj, prop):
+        self.obj = obj
+        self.prop = prop
+
+    def compile(self):
+        obj_name = self.obj
+        prop = self.prop
+        slot = slot_name(prop)
+        full_name = f"{obj_name} {prop}"
+
+        def load(v):
+            try:
+                obj = v[obj_name]
+            except KeyError:
+                obj = None
+            if isinstance(obj, StoryRecord):
+                try:
+                    return getattr(obj, slot)
+                except AttributeError:
+                    pass
+            elif isinstance(obj, dict):
+                try:
+                    return obj[prop]
+                except KeyError:
+                    pass
+            try:
+                return v[full_name]
+            except KeyError:
+                raise NameError(f"Variable '{full_name}' is not defined")
+        return load
+
+
+class NameSeq(Node):
+    """Three or more space separated names: a property of a multi-word
+    object, a multi-word property, or a multi-word variable."""
+    __slots__ = ('parts',)
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def compile(self):
+        parts = self.parts
+        full_name = ' '.join(parts)
+        # (object, property) splits, longest object name first
+        splits = [(' '.join(parts[:k]), ' '.join(parts[k:])) for k in range(len(parts) - 1, 0, -1)]
+
+        def load(v):
+            for obj_name, prop in splits:
+                try:
+                    obj = v[obj_name]
+                except KeyError:
+                    continue
+                if isinstance(obj, (dict, StoryRecord)) and prop in obj:
+                    return obj[prop]
+            try:
+                return v[full_name]
+            except KeyError:
+                raise NameError(f"Variable '{full_name}' is not defined")
+        return load
+
+
+UNARY_OPS = {'-': operator.neg, '+': operator.pos, '~': operator.invert, 'not': operator.not_}
+
+
+class Unary(Node):
+    __slots__ = ('op', 'operand')
+
+    def __init__(self, op, operand):
+        self.op = op
+        self.operand = operand
+
+    def compile(self):
+        func = UNARY_OPS[self.op]
+        operand = self.operand.compile()
+        return lambda v: func(operand(v))
+
+
+BINARY_OPS = {
+    '+': operator.add, '-': operator.sub, '*': operator.mul, '/': operator.truediv,
+    '//': operator.floordiv, '%': operator.mod, '**': operator.pow,
+    '<<': operator.lshift, '>>': operator.rshift,
+    '&': operator.and_, '|': operator.or_, '^': operator.xor,
+}
+
+
+class Binary(Node):
+    __slots__ = ('op', 'left', 'right')
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def compile(self):
+        func = BINARY_OPS[self.op]
+        left = self.left.compile()
+        right = self.right.compile()
+        return lambda v: func(left(v), right(v))
+
+
+NOTHING = object()
+
+# Values that + joins as text
+TEXT = (str, TextBuilder)
+
+
+def join_text(values, ops):
+    """Fold a + / - chain that mixes text with other values.
+
+    Runs of non-text operands are combined first and then joined to the
+    surrounding text, so "Total: " + 1 + 2 gives "Total: 3".
+    """
+    pieces = []
+    run = NOTHING
+    for index, value in enumerate(values):
+        op = ops[index - 1] if index else '+'
+        if isinstance(value, TEXT):
+            value = str(value)
+            if op != '+':
+                raise TypeError(f"unsupported operand type(s) for {op}: text")
+            if run is not NOTHING:
+                pieces.append(str(run))
+                run = NOTHING
+            pieces.append(value)
+        elif run is NOTHING:
+            if op != '+':
+                raise TypeError(f"unsupported operand type(s) for {op}: text")
+            run = value
+        else:
+            run = BINARY_OPS[op](run, value)
+    if run is not NOTHING:
+        pieces.append(str(run))
+    return ''.join(pieces)
+
+
+class Additive(Node):
+    """A chain of + and - operations."""
+    __slots__ = ('operands', 'ops')
+
+    def __init__(self, operands, ops):
+        self.operands = operands
+        self.ops = ops
+
+    def compile(self):
+        operands = [operand.compile() for operand in self.operands]
+        ops = self.ops
+        funcs = [BINARY_OPS[op] for op in ops]
+
+        if len(operands) == 2:
+            left, right = operands
+            func = funcs[0]
+
+            def binary(v):
+                a = left(v)
+                b = right(v)
+                try:
+                    return func(a, b)
+                except TypeError:
+                    if isinstance(a, TEXT) or isinstance(b, TEXT):
+                        return join_text([a, b], ops)
+                    raise
+            return binary
+
+        steps = list(zip(funcs, operands[1:]))
+        first = operands[0]
+
+        def chain(v):
+            values = [first(v)]
+            result = values[0]
+            failed = False
+            for func, operand in steps:
+                value = operand(v)
+                values.append(value)
+                if not failed:
+                    try:
+                        result = func(result, value)
+                    except TypeError:
+                        failed = True
+            if not failed:
+                return result
+            if any(isinstance(value, TEXT) for value in values):
+                return join_text(values, ops)
+            # re-raise the original error
+            result = values[0]
+            for func, value in zip(funcs, values[1:]):
+                result = func(result, value)
+            return result
+        return chain
+
+
+def contains(a, b):
+    return a in b
+
+
+def not_contains(a, b):
+    return a not in b
+
+
+COMPARE_OPS = {
+    '==': operator.eq, '!=': operator.ne, '<': operator.lt, '>': operator.gt,
+    '<=': operator.le, '>=': operator.ge, 'in': contains, 'not in': not_contains,
+    'is': operator.is_, 'is not': operator.is_not,
+}
+
+
+class Compare(Node):
+    __slots__ = ('operands', 'ops')
+
+    def __init__(self, operands, ops):
+        self.operands = operands
+        self.ops = ops
+
+    def compile(self):
+        operands = [operand.compile() for operand in self.operands]
+        funcs = [COMPARE_OPS[op] for op in self.ops]
+
+        if len(funcs) == 1:
+            left, right = operands
+            func = funcs[0]
+            return lambda v: func(left(v), right(v))
+
+        first = operands[0]
+        steps = list(zip(funcs, operands[1:]))
+
+        def chained(v):
+            a = first(v)
+            for func, operand in steps:
+                b = operand(v)
+                if not func(a, b):
+                    return False
+                a = b
+            return True
+        return chained
+
+
+class BoolOp(Node):
+    __slots__ = ('op', 'values')
+
+    def __init__(self, op, values):
+        self.op = op
+        self.values = values
+
+    def compile(self):
+        values = [value.compile() for value in self.values]
+        first, rest = values[0], values[1:]
+
+        if self.op == 'and':
+            def and_(v):
+                result = first(v)
+                for value in rest:
+                    if not result:
+                        return result
+                    result = value(v)
+                return result
+            return and_
+
+        def or_(v):
+            result = first(v)
+            for value in rest:
+                if result:
+                    return result
+                result = value(v)
+            return result
+        return or_
+
+
+class IfExp(Node):
+    __slots__ = ('test', 'body', 'orelse')
+
+    def __init__(self, test, body, orelse):
+        self.test = test
+        self.body = body
+        self.orelse = orelse
+
+    def compile(self):
+        test = self.test.compile()
+        body = self.body.compile()
+        orelse = self.orelse.compile()
+        return lambda v: body(v) if test(v) else orelse(v)
+
+    def compile_kept(self):
+        test = self.test.compile()
+        body = self.body.compile_kept()
+        orelse = self.orelse.compile_kept()
+        return lambda v: body(v) if test(v) else orelse(v)
+
+
+class Call(Node):
+    __slots__ = ('func', 'args', 'kwargs')
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def compile(self):
+        if isinstance(self.func, Name) and self.func.name in READ_ONLY_BUILTINS:
+            args = [arg.compile() for arg in self.args]
+            kwargs = [(key, value.compile()) for key, value in self.kwargs]
+        else:
+            args = [arg.compile_kept() for arg in self.args]
+            kwargs = [(key, value.compile_kept()) for key, value in self.kwargs]
+
+        if isinstance(self.func, Name):
+            # Variables shadow builtins only when they hold something callable
+            name = self.func.name
+
+            def resolve(v):
+                try:
+                    value = v[name]
+                except KeyError:
+                    return undefined(name)
+                if callable(value):
+                    return value
+                if name in BUILTINS:
+                    return BUILTINS[name]
+                raise TypeError(f"'{type(value).__name__}' object is not callable")
+        else:
+            resolve = self.func.compile()
+
+        if kwargs:
+            return lambda v: resolve(v)(*[arg(v) for arg in args], **{k: f(v) for k, f in kwargs})
+        if len(args) == 1:
+            arg = args[0]
+            return lambda v: resolve(v)(arg(v))
+        return lambda v: resolve(v)(*[arg(v) for arg in args])
+
+
+def get_item(container, key):
+    """Index a list, text or dict the way Whisper always has."""
+    if isinstance(container, (dict, StoryRecord)):
+        return container.get(key)
+    if isinstance(key, slice) and is_lazy(container):
+        return lazy_slice(container, key)
+    if isinstance(key, (slice, NumberArray)):
+        return container[key]
+    try:
+        return container[int(key)]
+    except (IndexError, ValueError, TypeError):
+        raise IndexError(f"Index out of range or invalid: {key}")
+
+
+class Subscript(Node):
+    __slots__ = ('value', 'index')
+
+    def __init__(self, value, index):
+        self.value = value
+        self.index = index
+
+    def compile(self):
+        value = self.value.compile()
+        index = self.index.compile()
+        return lambda v: get_item(value(v), index(v))
+
+
+class Slice(Node):
+    __slots__ = ('lower', 'upper', 'step')
+
+    def __init__(self, lower, upper, step):
+        self.lower = lower
+        self.upper = upper
+        self.step = step
+
+    def compile(self):
+        parts = [part.compile() if part is not None else (lambda v: None)
+                 for part in (self.lower, self.upper, self.step)]
+        lower, upper, step = parts
+        return lambda v: slice(lower(v), upper(v), step(v))
+
+
+class Attribute(Node):
+    __slots__ = ('value', 'attr')
+
+    def __init__(self, value, attr):
+        self.value = value
+        self.attr = attr
+
+    def compile(self):
+        value = self.value.compile()
+        attr = self.attr
+        return lambda v: getattr(value(v), attr)
+
+
+class ListExpr(Node):
+    __slots__ = ('items',)
+
+    def __init__(self, items):
+        self.items = items
+
+    def compile(self):
+        items = [item.compile_kept() for item in self.items]
+        return lambda v: [item(v) for item in items]
+
+
+class TupleExpr(Node):
+    __slots__ = ('items',)
+
+    def __init__(self, items):
+        self.items = items
+
+    def compile(self):
+        items = [item.compile_kept() for item in self.items]
+        return lambda v: tuple(item(v) for item in items)
+
+
+class DictExpr(Node):
+    __slots__ = ('pairs',)
+
+    def __init__(self, pairs):
+        self.pairs = pairs
+
+    def compile(self):
+        pairs = [(key.compile(), value.compile_kept()) for key, value in self.pairs]
+        return lambda v: {key(v): value(v) for key, value in pairs}
+
+
+# ======== Parser ========
+
+class ExpressionParser:
+    """Recursive descent parser producing expression nodes from tokens."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.index = 0
+
+    @property
+    def current(self):
+        return self.tokens[self.index]
+
+    def advance(self):
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def at(self, *values):
+        """Is the current token one of these operators or keywords?"""
+        token = self.tokens[self.index]
+        return (token.kind == 'op' or token.kind == 'name') and token.value in values
+
+    def expect(self, value):
+        if not self.at(value):
+            self.error()
+        return self.advance()
+
+    def error(self, token=None):
+        token = token or self.current
+        if token.kind == 'end':
+            raise SyntaxError("unexpected end of expression")
+        if token.kind == 'error':
+            raise SyntaxError(describe_error(token))
+        raise SyntaxError(f"unexpected '{token.text}' at column {token.pos + 1}")
+
+    def parse(self):
+        if self.current.kind == 'end':
+            raise SyntaxError("empty expression")
+        node = self.parse_expression()
+        if self.current.kind != 'end':
+            self.error()
+        return node
+
+    def parse_expression(self):
+        node = self.parse_or()
+        if self.at('if'):
+            self.advance()
+            test = self.parse_or()
+            self.expect('else')
+            orelse = self.parse_expression()
+            return IfExp(test, node, orelse)
+        return node
+
+    def parse_or(self):
+        values = [self.parse_and()]
+        while self.at('or'):
+            self.advance()
+            values.append(self.parse_and())
+        return values[0] if len(values) == 1 else BoolOp('or', values)
+
+    def parse_and(self):
+        values = [self.parse_not()]
+        while self.at('and'):
+            self.advance()
+            values.append(self.parse_not())
+        return values[0] if len(values) == 1 else BoolOp('and', values)
+
+    def parse_not(self):
+        if self.at('not'):
+            self.advance()
+            return Unary('not', self.parse_not())
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        operands = [self.parse_bitor()]
+        ops = []
+        while True:
+            if self.at('==', '!=', '<', '>', '<=', '>=', 'in'):
+                op = self.advance().value
+            elif self.at('not') and self.tokens[self.index + 1].is_word('in'):
+                self.index += 2
+                op = 'not in'
+            elif self.at('is'):
+                self.advance()
+                if self.at('not'):
+                    self.advance()
+                    op = 'is not'
+                else:
+                    op = 'is'
+            else:
+                break
+            ops.append(op)
+            operands.append(self.parse_bitor())
+        return operands[0] if not ops else Compare(operands, ops)
+
+    def parse_binary(self, ops, parse_operand):
+        node = parse_operand()
+        while self.at(*ops):
+            op = self.advance().value
+            node = Binary(op, node, parse_operand())
+        return node
+
+    def parse_bitor(self):
+        return self.parse_binary(('|',), self.parse_bitxor)
+
+    def parse_bitxor(self):
+        return self.parse_binary(('^',), self.parse_bitand)
+
+    def parse_bitand(self):
+        return self.parse_binary(('&',), self.parse_shift)
+
+    def parse_shift(self):
+        return self.parse_binary(('<<', '>>'), self.parse_additive)
+
+    def parse_additive(self):
+        operands = [self.parse_term()]
+        ops = []
+        while self.at('+', '-'):
+            ops.append(self.advance().value)
+            operands.append(self.parse_term())
+        return operands[0] if not ops else Additive(operands, ops)
+
+    def parse_term(self):
+        return self.parse_binary(('*', '/', '//', '%'), self.parse_factor)
+
+    def parse_factor(self):
+        if self.at('-', '+', '~'):
+            op = self.advance().value
+            operand = self.parse_factor()
+            if isinstance(operand, Const) and op == '-' and isinstance(operand.value, (int, float)):
+                return Const(-operand.value)
+            return Unary(op, operand)
+        return self.parse_power()
+
+    def parse_power(self):
+        node = self.parse_postfix()
+        if self.at('**'):
+            self.advance()
+            return Binary('**', node, self.parse_factor())
+        return node
+
+    def parse_postfix(self):
+        node = self.parse_atom()
+        while True:
+            if self.at('('):
+                self.advance()
+                node = self.parse_call(node)
+            elif self.at('['):
+                self.advance()
+                index = self.parse_subscript()
+                self.expect(']')
+                node = Subscript(node, index)
+            elif self.at('.'):
+                self.advance()
+                token = self.advance()
+                if token.kind != 'name' or token.value.startswith('_') or token.value in BLOCKED_ATTRIBUTES:
+                    self.error(token)
+                node = Attribute(node, token.value)
+            else:
+                return node
+
+    def parse_call(self, func):
+        args = []
+        kwargs = []
+        while not self.at(')'):
+            token = self.current
+            if token.kind == 'name' and self.tokens[self.index + 1].is_op('='):
+                self.index += 2
+                kwargs.append((token.value, self.parse_expression()))
+            elif kwargs:
+                self.error()
+            else:
+                args.append(self.parse_expression())
+            if not self.at(','):
+                break
+            self.advance()
+        self.expect(')')
+        return Call(func, args, kwargs)
+
+    def parse_subscript(self):
+        lower = upper = step = None
+        if not self.at(':'):
+            lower = self.parse_expression()
+            if not self.at(':'):
+                return lower
+        self.advance()
+        if not self.at(':', ']'):
+            upper = self.parse_expression()
+        if self.at(':'):
+            self.advance()
+            if not self.at(']'):
+                step = self.parse_expression()
+        return Slice(lower, upper, step)
+
+    def parse_atom(self):
+        token = self.advance()
+        if token.kind == 'number':
+            return Const(token.value)
+        if token.kind == 'string':
+            # Adjacent string literals are joined, as in Python
+            value = token.value
+            while self.current.kind == 'string':
+                value += self.advance().value
+            return Const(value)
+        if token.kind == 'name' and token.value not in KEYWORDS:
+            if token.value in CONSTANTS:
+                return Const(CONSTANTS[token.value])
+            parts = [token.value]
+            while self.current.kind == 'name' and self.current.value not in CONSTANTS \
+                    and self.current.value not in KEYWORDS:
+                parts.append(self.advance().value)
+            if len(parts) == 1:
+                return Name(parts[0])
+            if len(parts) == 2:
+                return Property(parts[0], parts[1])
+            return NameSeq(parts)
+        if token.kind == 'op':
+            if token.value == '(':
+                if self.at(')'):
+                    self.advance()
+                    return TupleExpr([])
+                node = self.parse_expression()
+                if self.at(','):
+                    items = [node]
+                    while self.at(','):
+                        self.advance()
+                        if self.at(')'):
+                            break
+                        items.append(self.parse_expression())
+                    node = TupleExpr(items)
+                self.expect(')')
+                return node
+            if token.value == '[':
+                items = self.parse_items(']')
+                return ListExpr(items)
+            if token.value == '{':
+                pairs = []
+                while not self.at('}'):
+                    key = self.parse_expression()
+                    self.expect(':')
+                    pairs.append((key, self.parse_expression()))
+                    if not self.at(','):
+                        break
+                    self.advance()
+                self.expect('}')
+                return DictExpr(pairs)
+        self.error(token)
+
+    def parse_items(self, closing):
+        items = []
+        while not self.at(closing):
+            items.append(self.parse_expression())
+            if not self.at(','):
+                break
+            self.advance()
+        self.expect(closing)
+        return items
+
+
+# ======== Conditions ========
+
+# Natural comparison words accepted in conditions, longest first. Each phrase
+# is read as the operator tokens on the right when it follows an operand.
+COMPARISON_PHRASES = [
+    (("is", "greater", "than"), (">",)),
+    (("is", "bigger", "than"), (">",)),
+    (("is", "less", "than"), ("<",)),
+    (("is", "smaller", "than"), ("<",)),
+    (("is", "not", "in"), ("not", "in")),
+    (("greater", "than"), (">",)),
+    (("bigger", "than"), (">",)),
+    (("less", "than"), ("<",)),
+    (("smaller", "than"), ("<",)),
+    (("is", "not"), ("!=",)),
+    (("is", "in"), ("in",)),
+    (("not", "in"), ("not", "in")),
+    (("equals",), ("==",)),
+    (("is",), ("==",)),
+    (("not",), ("!=",)),
+]
+
+
+def ends_operand(token):
+    """Can token be the last token of an operand?"""
+    if token.kind == 'name':
+        return token.value not in KEYWORDS
+    if token.kind == 'op':
+        return token.value in (')', ']', '}')
+    return token.kind in ('number', 'string')
+
+
+def condition_tokens(tokens):
+    """Rewrite natural comparison words in condition tokens as operators.
+
+    "x is 5", "x equals 5", "x greater than 5", "x is not 5" and "x not 5"
+    become x == 5, x == 5, x > 5, x != 5 and x != 5. Words are only rewritten
+    right after an operand, so "not ready" and "a and not b" keep their
+    meaning and words inside strings are never touched.
+    """
+    result = []
+    i = 0
+    count = len(tokens)
+    while i < count:
+        token = tokens[i]
+        if token.kind == 'name' and result and ends_operand(result[-1]):
+            for phrase, replacement in COMPARISON_PHRASES:
+                size = len(phrase)
+                words = tokens[i:i + size]
+                if len(words) == size and all(w.is_word(p) for w, p in zip(words, phrase)):
+                    text = ' '.join(w.text for w in words)
+                    for value in replacement:
+                        kind = 'name' if value.isalpha() else 'op'
+                        result.append(Token(kind, value, text, token.pos))
+                    i += size
+                    break
+            else:
+                result.append(token)
+                i += 1
+            continue
+        result.append(token)
+        i += 1
+    return result
+
+
+# ======== Compiled expressions ========
+
+class Expression:
+    """A compiled expression: call run(variables) to evaluate it.
+
+    source is the text as the program wrote it. A condition is compiled
+    from tokens with its comparison words read as operators (see
+    condition_tokens), but source keeps the words, so error messages quote
+    `x is greater than y`, never `x > y`.
+
+    error holds the syntax error message of an expression that failed to
+    parse (tree is then None). Pickling keeps the source and tree only; the
+    runner is compiled again from the tree when the expression is loaded.
+    """
+    __slots__ = ('source', 'tree', 'run', 'error')
+
+    def __init__(self, source, tree, run, error=None):
+        self.source = source
+        self.tree = tree
+        self.run = run
+        self.error = error
+
+    def __repr__(self):
+        return f"Expression({self.source!r})"
+
+    def __reduce__(self):
+        return (restore_expression, (self.source, self.tree, self.error))
+
+
+def restore_expression(source, tree, error):
+    """Rebuild a pickled Expression, compiling its runner from the tree."""
+    if tree is None:
+        return Expression(source, None, failing(SyntaxError(error)), error)
+    return Expression(source, tree, tree.compile())
+
+
+def failing(error):
+    """Return a runner that raises a copy of a compile error when evaluated."""
+    error_type = type(error)
+    message = str(error)
+
+    def run(v):
+        raise error_type(message)
+    return run
+
+
+# Compiled expressions by source text
+_cache = {}
+CACHE_SIZE = 4096
+
+
+def compile_expression(source, tokens=None, line=None):
+    """Compile expression text into an Expression.
+
+    tokens may be the already lexed tokens of source (the statement parser
+    passes the slice of its line); otherwise the text is tokenized here.
+    Syntax errors are reported when the expression is evaluated, so a bad
+    expression only fails if the line holding it actually runs.
+    """
+    return _compile(source, tokens, line, False)
+
+
+def compile_condition(source, tokens=None, line=None):
+    """Compile the condition of a when / while / is ...? statement.
+
+    Same as compile_expression, but natural comparison words are read as
+    operators first (see condition_tokens).
+    """
+    return _compile(source, tokens, line, True)
+
+
+def _compile(source, tokens, line, condition):
+    source = source.strip()
+    key = ('condition', source) if condition else source
+    compiled = _cache.get(key)
+    if compiled is not None:
+        return compiled
+    if tokens is None:
+        tokens = tokenize(source)
+    elif not tokens or tokens[-1].kind != 'end':
+        end = tokens[-1].end if tokens else 0
+        tokens = list(tokens) + [Token('end', None, '', end)]
+    if condition:
+        tokens = condition_tokens(tokens)
+    try:
+        tree = ExpressionParser(tokens).parse()
+    except SyntaxError as e:
+        if line is not None:
+            e = SyntaxError(f"{e} on line {line}")
+        return Expression(source, None, failing(e), str(e))
+    compiled = Expression(source, tree, tree.compile())
+    if len(_cache) >= CACHE_SIZE:
+        _cache.clear()
+    _cache[key] = compiled
+    return compiled
@@ -1,1057 +1,710 @@
+import os
 import sys
-import re
-import math
-import random
+import threading
+import time
+
+from . import nodes
+from .expressions import Expression, compile_expression
+from .lazy import read_lines
+from .story import record_type
+from .text import TextBuilder, share
+from .memo import MEMO_SIZE, Memo
+from .output import OutputSink
+from .parser import parse, parse_lines
+from .runtime import (MAX_DEPTH, Frame, LimitExceeded, add_item, append_to, ask, count_range,
+                      decrease, gain, gain_from, increase, items_of, keep, lose,
+                      read_file, remove_item, sort_list, whole_number, write_file)
 
 __version__ = "1.0.0"
 
 # ======== Whisper Language Interpreter (Truly Unique Edition) ========
 # A revolutionary language with conversational, natural, and fun syntax
 
-# Global storage
-functions = {}
-story_objects = {}
-
 def evaluate(expr, variables):
     """Safely evaluate math or variable expressions."""
-    safe_dict = {
-        "sqrt": math.sqrt,
-        "pow": math.pow,
-        "abs": abs,
-        "round": round,
-        "floor": math.floor,
-        "ceil": math.ceil,
-        "random": random.random,
-        "randint": random.randint,
-        "min": min,
-        "max": max,
-        "sum": sum,
-        "len": len,
-        "str": str,
-        "list": list,
-    }
-
     # If expr is already a list or dict, just return it
     if isinstance(expr, (list, dict)):
         return expr
-    
-    expr_str = str(expr).strip()
-    
-    # Check if this is a list literal like [1, 2, 3] or ["a", "b"]
-    # Just evaluate it directly without variable replacement
-    if expr_str.startswith('[') and expr_str.endswith(']'):
+    if not isinstance(expr, Expression):
+        expr = compile_expression(str(expr))
+    return expr.run(variables)
+
+# ======== Activations ========
+# The executor keeps an explicit stack of the statement lists it is running,
+# so nested blocks and function calls never recurse in Python.
+
+class Activation:
+    """A statement list being executed."""
+    __slots__ = ('body', 'pos')
+    is_loop = False
+
+    def __init__(self, body):
+        self.body = body
+        self.pos = 0
+
+    def finish(self, machine):
+        """The last statement ran: leave the block."""
+        machine.stack.pop()
+
+    def handle(self, error, machine):
+        """Return True if this block deals with an error raised inside it."""
+        return False
+
+class BranchActivation(Activation):
+    """A when / question branch; errors inside it are reported, not raised."""
+    __slots__ = ('prefix',)
+
+    def __init__(self, body, prefix):
+        Activation.__init__(self, body)
+        self.prefix = prefix
+
+    def handle(self, error, machine):
+        machine.output.write(f"{self.prefix}{error}\n")
+        return True
+
+class AttemptActivation(Activation):
+    """attempt: body whose errors switch to the handle: block."""
+    __slots__ = ('handler',)
+
+    def __init__(self, body, handler):
+        Activation.__init__(self, body)
+        self.handler = handler
+
+    def handle(self, error, machine):
+        if self.handler:
+            machine.frame['error'] = str(error)
+            machine.stack.append(Activation(self.handler))
+        return True
+
+class WhileActivation(Activation):
+    __slots__ = ('condition',)
+    is_loop = True
+
+    def __init__(self, body, condition):
+        Activation.__init__(self, body)
+        self.condition = condition
+
+    def finish(self, machine):
+        self.next_iteration(machine)
+
+    def next_iteration(self, machine):
         try:
-            result = eval(expr_str, {"__builtins__": {}}, safe_dict)
-            return result
-        except:
-            pass  # If it fails, continue with normal processing
-    
-    # Check if this is just a simple variable name - return it immediately
-    if re.match(r"^[a-zA-Z_][a-zA-Z0-9_]*$", expr_str):
-        var_name = expr_str
-        if var_name in variables:
-            # Return the variable value directly without any processing
-            return variables[var_name]
-        elif var_name in safe_dict:
-            # It's a function, continue to eval
-            pass
+            if self.condition.run(machine.frame):
+                self.pos = 0
+                return
+        except Exception as e:
+            machine.output.write(f"Error in while loop: {e}\n")
+        machine.stack.pop()
+
+    def handle(self, error, machine):
+        machine.output.write(f"Error in while loop: {error}\n")
+        return True
+
+class RepeatActivation(Activation):
+    __slots__ = ('remaining',)
+    is_loop = True
+
+    def __init__(self, body, remaining):
+        Activation.__init__(self, body)
+        self.remaining = remaining
+
+    def finish(self, machine):
+        self.next_iteration(machine)
+
+    def next_iteration(self, machine):
+        if self.remaining > 0:
+            self.remaining -= 1
+            self.pos = 0
         else:
-            raise NameError(f"Variable '{var_name}' is not defined")
-    
-    # Handle array/list indexing: variable[index]
-    array_index_match = re.match(r"^([a-zA-Z_][a-zA-Z0-9_]*)\[(.+)\]$", expr_str)
-    if array_index_match:
-        var_name = array_index_match.group(1)
-        index_expr = array_index_match.group(2)
-        
-        if var_name in variables:
-            # Get the array/list
-            array = variables[var_name]
-            # Evaluate the index expression
-            index = evaluate(index_expr, variables)
-            
-            # Return the indexed value
-            if isinstance(array, (list, tuple, str)):
-                try:
-                    return array[int(index)]
-                except (IndexError, ValueError, TypeError) as e:
-                    raise IndexError(f"Index out of range or invalid: {index}")
-            elif isinstance(array, dict):
-                return array.get(index)
-        else:
-            raise NameError(f"Variable '{var_name}' is not defined")
-    
-    # Handle simple dictionary property access: "hero health" (entire expression)
-    for var_name in sorted(variables.keys(), key=len, reverse=True):
-        if isinstance(variables[var_name], dict):
-            for prop_name in variables[var_name]:
-                pattern = r'^' + re.escape(var_name) + r'\s+' + re.escape(prop_name) + r'$'
-                if re.match(pattern, expr_str):
-                    return variables[var_name][prop_name]
-        
-    # Helper functions for string detection
-    def get_string_regions(text):
-        """Build a list of (start, end) tuples for string regions."""
-        regions = []
-        i = 0
-        while i < len(text):
-            if text[i] == '"':
-                j = i + 1
-                while j < len(text):
-                    if text[j] == '\\' and j + 1 < len(text):
-                        j += 2
-                        continue
-                    if text[j] == '"':
-                        regions.append((i, j + 1))
-                        i = j + 1
-                        break
-                    j += 1
-                else:
-                    i += 1
-            elif text[i] == "'":
-                j = i + 1
-                while j < len(text):
-                    if text[j] == '\\' and j + 1 < len(text):
-                        j += 2
-                        continue
-                    if text[j] == "'":
-                        regions.append((i, j + 1))
-                        i = j + 1
-                        break
-                    j += 1
-                else:
-                    i += 1
-            else:
-                i += 1
-        return regions
-    
-    def is_inside_string(pos, regions):
-        """Check if position is inside a string literal."""
-        for start, end in regions:
-            if start < pos < end - 1:
-                return True
+            machine.stack.pop()
+
+class ForEachActivation(Activation):
+    __slots__ = ('var', 'items')
+    is_loop = True
+
+    def __init__(self, body, var, items):
+        Activation.__init__(self, body)
+        self.var = var
+        self.items = items
+
+    def finish(self, machine):
+        self.next_iteration(machine)
+
+    def next_iteration(self, machine):
+        for item in self.items:
+            machine.frame[self.var] = item
+            self.pos = 0
+            return
+        machine.stack.pop()
+
+class FilteredForEachActivation(ForEachActivation):
+    """for each ... where condition: skips items the condition rejects."""
+    __slots__ = ('condition',)
+
+    def __init__(self, body, var, items, condition):
+        ForEachActivation.__init__(self, body, var, items)
+        self.condition = condition
+
+    def next_iteration(self, machine):
+        frame = machine.frame
+        var = self.var
+        condition = self.condition
+        for item in self.items:
+            frame[var] = item
+            if condition.run(frame):
+                self.pos = 0
+                return
+        machine.stack.pop()
+
+class ScopeActivation(Activation):
+    """A Scope block; forgets its hidden variables when it ends or an error leaves it."""
+    __slots__ = ('names', 'frame')
+
+    def __init__(self, body, names, frame):
+        Activation.__init__(self, body)
+        self.names = names
+        self.frame = frame
+
+    def finish(self, machine):
+        machine.stack.pop()
+        self.forget()
+
+    def handle(self, error, machine):
+        self.forget()
         return False
-    
-    # Replace dictionary property access
-    for var_name in sorted(variables.keys(), key=len, reverse=True):
-        if isinstance(variables[var_name], dict):
-            for prop_name in variables[var_name]:
-                pattern = r'\b' + re.escape(var_name) + r'\s+' + re.escape(prop_name) + r'\b'
-                
-                while True:
-                    string_regions = get_string_regions(expr_str)
-                    match = re.search(pattern, expr_str)
-                    if not match:
-                        break
-                    
-                    if is_inside_string(match.start(), string_regions):
-                        marker = f"__SKIP_{var_name}_{prop_name}__"
-                        expr_str = expr_str[:match.start()] + marker + expr_str[match.end():]
-                        continue
-                    
-                    prop_value = variables[var_name][prop_name]
-                    if isinstance(prop_value, str):
-                        replacement = f'"{prop_value}"'
+
+    def forget(self):
+        for name in self.names:
+            dict.pop(self.frame, name, None)
+
+class CallActivation(Activation):
+    """The body of a user-defined function."""
+    __slots__ = ('caller', 'result')
+
+    def __init__(self, body, caller):
+        Activation.__init__(self, body)
+        self.caller = caller
+        self.result = None
+
+    def finish(self, machine):
+        machine.stack.pop()
+        machine.frame = self.caller
+        machine.depth -= 1
+        if self.result is not None:
+            self.caller['__last_result__'] = self.result
+
+class RememberedCall(CallActivation):
+    """A call to a remembered function; stores its result when it returns."""
+    __slots__ = ('memo', 'key')
+
+    def __init__(self, body, caller, memo, key):
+        CallActivation.__init__(self, body, caller)
+        self.memo = memo
+        self.key = key
+
+    def finish(self, machine):
+        CallActivation.finish(self, machine)
+        self.memo.store(self.key, self.result)
+
+# Steps between checks of the step budget and the deadline
+CHECK_INTERVAL = 1000
+
+class Machine:
+    """Runs statement lists on an explicit activation stack."""
+
+    def __init__(self, interpreter, variables):
+        self.globals = variables
+        self.frame = variables
+        self.stack = []
+        self.functions = interpreter.functions
+        self.memos = interpreter.memos
+        self.memo_size = interpreter.memo_size
+        output = interpreter.output
+        self.output = output if output is not None else OutputSink()
+        # stack depth below which the current resume() must not unwind
+        self.base = 0
+
+        # Budget: steps are counted down in resume() and only added up in
+        # check_limits() every CHECK_INTERVAL steps (or when the budget runs out)
+        self.max_steps = interpreter.max_steps
+        self.timeout = interpreter.timeout
+        self.deadline = time.monotonic() + self.timeout if self.timeout is not None else None
+        self.max_depth = interpreter.max_depth
+        self.depth = 0
+        self.steps = 0
+        self.grant = self.next_grant()
+        self.countdown = self.grant
+
+    def next_grant(self):
+        """How many steps may run before the limits are checked again."""
+        if self.max_steps is None:
+            return CHECK_INTERVAL if self.deadline is not None else sys.maxsize
+        return min(CHECK_INTERVAL, self.max_steps - self.steps)
+
+    def check_limits(self):
+        """Account for the steps run since the last check; return the new countdown."""
+        self.steps += self.grant
+        if self.max_steps is not None and self.steps >= self.max_steps:
+            raise LimitExceeded(f"Step limit of {self.max_steps} reached", "steps")
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise LimitExceeded(f"Time limit of {self.timeout:g}s reached", "time")
+        self.grant = self.next_grant()
+        return self.grant - 1
+
+    def run(self, statements):
+        """Execute a statement list to completion, then flush the output."""
+        self.stack.append(Activation(statements))
+        try:
+            self.resume(len(self.stack) - 1)
+        except LimitExceeded:
+            # the stack is left as it was; still take hidden variables back out
+            for record in self.stack:
+                if isinstance(record, ScopeActivation):
+                    record.forget()
+            raise
+        finally:
+            self.output.flush()
+
+    def resume(self, base):
+        """Run until the stack shrinks back to base entries."""
+        stack = self.stack
+        executors = EXECUTORS
+        outer, self.base = self.base, base
+        countdown = self.countdown
+        try:
+            while len(stack) > base:
+                countdown -= 1
+                if countdown < 0:
+                    countdown = self.check_limits()
+                top = stack[-1]
+                pos = top.pos
+                try:
+                    if pos < len(top.body):
+                        stmt = top.body[pos]
+                        top.pos = pos + 1
+                        executors[stmt.__class__](stmt, self.frame, self)
                     else:
-                        replacement = str(prop_value)
-                    
-                    expr_str = expr_str[:match.start()] + replacement + expr_str[match.end():]
-    
-    # Restore any skipped property accesses
-    for var_name in variables:
-        if isinstance(variables[var_name], dict):
-            for prop_name in variables[var_name]:
-                marker = f"__SKIP_{var_name}_{prop_name}__"
-                expr_str = expr_str.replace(marker, f"{var_name} {prop_name}")
-    
-    # Handle regular variables (including dicts that aren't property accesses)
-    for var_name in sorted(variables.keys(), key=len, reverse=True):
-        # Skip if this is a dict and we're accessing its properties
-        is_property_access = False
-        if isinstance(variables[var_name], dict):
-            for prop_name in variables[var_name]:
-                if re.search(rf'\b{re.escape(var_name)}\s+{re.escape(prop_name)}\b', expr_str):
-                    is_property_access = True
-                    break
-        
-        if is_property_access:
-            continue
-            
-        pattern = r'\b' + re.escape(var_name) + r'\b'
-        
-        while True:
-            string_regions = get_string_regions(expr_str)
-            match = re.search(pattern, expr_str)
-            if not match:
+                        top.finish(self)
+                except LimitExceeded:
+                    raise
+                except Exception as e:
+                    self.unwind_error(e, base)
+        finally:
+            self.countdown = countdown
+            self.base = outer
+
+    def pop(self):
+        """Remove the innermost activation, leaving any call it belongs to."""
+        record = self.stack.pop()
+        if isinstance(record, CallActivation):
+            self.frame = record.caller
+            self.depth -= 1
+        return record
+
+    def innermost_loop(self, word):
+        """Leave blocks up to the innermost running loop and return it."""
+        stack = self.stack
+        for record in reversed(stack[self.base:]):
+            if record.is_loop:
                 break
-            
-            if is_inside_string(match.start(), string_regions):
-                marker = f"__SKIP_{var_name}__"
-                expr_str = expr_str[:match.start()] + marker + expr_str[match.end():]
-                continue
-            
-            var_value = variables[var_name]
-            if isinstance(var_value, str):
-                # Escape special characters in strings
-                escaped_value = var_value.replace('\\', '\\\\').replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t').replace('"', '\\"')
-                replacement = f'"{escaped_value}"'
-            elif isinstance(var_value, dict):
-                replacement = f'"{str(var_value)}"'
-            elif isinstance(var_value, list):
-                # Handle lists/arrays properly
-                def format_list_item(item):
-                    if isinstance(item, str):
-                        return f'"{item}"'
-                    else:
-                        return str(item)
-                formatted_items = [format_list_item(item) for item in var_value]
-                replacement = '[' + ', '.join(formatted_items) + ']'
-            else:
-                replacement = str(var_value)
-            
-            expr_str = expr_str[:match.start()] + replacement + expr_str[match.end():]
-    
-    # Restore any skipped variables
-    for var_name in variables:
-        marker = f"__SKIP_{var_name}__"
-        expr_str = expr_str.replace(marker, var_name)
-    
-    # Handle string concatenation - but ONLY when there's actual concatenation
-    # Check if there are comparison operators - if so, skip concatenation logic
-    has_comparison = bool(re.search(r'(==|!=|<=|>=|<|>|\band\b|\bor\b|\bnot\b|\bin\b)', expr_str))
-    
-    if not has_comparison and ('"' in expr_str or "'" in expr_str):
-        parts = re.split(r'("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')', expr_str)
-        
-        result = []
-        i = 0
-        while i < len(parts):
-            if i % 2 == 1:
-                # String literal
-                if result and not result[-1].endswith(' + '):
-                    result.append(' + ')
-                result.append(parts[i])
-                i += 1
+        else:
+            raise RuntimeError(f"'{word}' used outside of a loop")
+        while stack[-1] is not record:
+            self.pop()
+        return record
+
+    def break_loop(self):
+        """break: leave the innermost loop."""
+        self.innermost_loop("break")
+        self.stack.pop()
+
+    def continue_loop(self):
+        """continue: start the next iteration of the innermost loop."""
+        self.innermost_loop("continue").next_iteration(self)
+
+    def unwind_error(self, error, base):
+        """Leave blocks until one of them handles the error."""
+        stack = self.stack
+        while len(stack) > base:
+            record = self.pop()
+            if record.handle(error, self):
+                return
+        raise error
+
+    def call_function(self, name, args, caller):
+        """Start a call to a user-defined function and return its activation.
+
+        A remembered function called with arguments it has seen before does
+        not run; its activation comes back already holding the result.
+        """
+        functions = self.functions
+        if name not in functions:
+            raise RuntimeError(f"Function '{name}' not defined")
+        params, body = functions[name]
+        memo = self.memos.get(name)
+        if memo is not None:
+            key = memo.key(args)
+            if key is not None:
+                found, result = memo.lookup(key)
+                if found:
+                    call = CallActivation(body, caller)
+                    call.result = result
+                    if result is not None:
+                        caller['__last_result__'] = result
+                    return call
+                call = RememberedCall(body, caller, memo, key)
             else:
-                # Non-string segment
-                segment = parts[i].strip()
-                if not segment:
-                    i += 1
-                    continue
-                
-                # Remove leading/trailing + from segment
-                segment = re.sub(r'^\+\s*', '', segment)
-                segment = re.sub(r'\s*\+$', '', segment)
-                segment = segment.strip()
-                
-                if not segment:
-                    i += 1
-                    continue
-                
-                # Collect consecutive non-string parts
-                numeric_parts = [segment]
-                j = i + 1
-                
-                while j < len(parts):
-                    if j % 2 == 1:
-                        break
-                    next_seg = parts[j].strip()
-                    next_seg = re.sub(r'^\+\s*', '', next_seg)
-                    next_seg = re.sub(r'\s*\+$', '', next_seg)
-                    next_seg = next_seg.strip()
-                    if next_seg:
-                        numeric_parts.append(next_seg)
-                    j += 1
-                
-                if numeric_parts:
-                    numeric_expr = ' + '.join(numeric_parts)
-                    if result and not result[-1].endswith(' + '):
-                        result.append(' + ')
-                    result.append(f'str({numeric_expr})')
-                
-                i = j
-        
-        expr_str = ''.join(result)
-        expr_str = expr_str.strip()
-    
-    # Check if this is a simple identifier that doesn't exist
-    simple_id = re.match(r"^[a-zA-Z_][a-zA-Z0-9_]*$", expr_str.strip())
-    if simple_id:
-        var_name = expr_str.strip()
-        if var_name not in variables and var_name not in safe_dict:
-            raise NameError(f"Variable '{var_name}' is not defined")
-    
+                call = CallActivation(body, caller)
+        else:
+            call = CallActivation(body, caller)
+        if self.depth == self.max_depth:
+            raise LimitExceeded(f"Recursion depth limit of {self.max_depth} reached in '{name}'", "depth")
+        self.depth += 1
+        self.stack.append(call)
+        self.frame = Frame(self.globals, params, args)
+        return call
+
+    def give_back(self, value):
+        """Return from the innermost function call (or stop the program)."""
+        stack = self.stack
+        while stack:
+            record = stack[-1]
+            if isinstance(record, CallActivation):
+                record.result = share(value)
+                record.finish(self)
+                return
+            stack.pop()
+            if isinstance(record, ScopeActivation):
+                record.forget()
+
+# ======== Statement execution ========
+
+def exec_break(stmt, variables, machine):
+    machine.break_loop()
+
+def exec_continue(stmt, variables, machine):
+    machine.continue_loop()
+
+def exec_assign(stmt, variables, machine):
+    value = stmt.expr.run(variables)
+    if type(value) is TextBuilder:
+        value.shared = True
+    variables[stmt.name] = value
+
+def exec_forget(stmt, variables, machine):
+    if stmt.name in variables:
+        del variables[stmt.name]
+
+def exec_story_object(stmt, variables, machine):
+    record = record_type(stmt.fields)()
+    for slot, value in stmt.props:
+        setattr(record, slot, share(value.run(variables)))
+    variables[stmt.name] = record
+
+# The work of most statements is done by helpers in runtime.py, which
+# compiled programs call too, so both ways of running agree.
+
+def exec_loses(stmt, variables, machine):
+    lose(variables, stmt.obj, stmt.slot, stmt.amount.run(variables))
+
+def exec_gains(stmt, variables, machine):
+    gain(variables, stmt.obj, stmt.slot, stmt.amount.run(variables))
+
+def exec_gains_from(stmt, variables, machine):
+    gain_from(variables, stmt.obj, stmt.slot, stmt.source, stmt.source_slot)
+
+def exec_question(stmt, variables, machine):
     try:
-        result = eval(expr_str, {"__builtins__": {}}, safe_dict)
-        return result
-    except NameError as e:
-        match = re.search(r"name '(\w+)' is not defined", str(e))
-        if match:
-            var_name = match.group(1)
-            raise NameError(f"Variable '{var_name}' is not defined")
-        raise NameError(f"Variable '{expr}' is not defined")
-    except ZeroDivisionError:
-        raise
-    except SyntaxError:
-        raise
+        res = stmt.condition.run(variables)
     except Exception as e:
-        if isinstance(expr_str, str):
-            if (expr_str.startswith('"') and expr_str.endswith('"')) or \
-               (expr_str.startswith("'") and expr_str.endswith("'")):
-                return expr_str[1:-1]
-        raise
-
-def indent_level(line):
-    """Return the indentation level of a line."""
-    return len(line) - len(line.lstrip('\t '))
-
-def collect_block(lines, start_index, base_indent):
-    """Collect consecutive lines that belong to a block."""
-    block = []
-    i = start_index
-    while i < len(lines):
-        line = lines[i]
-        if not line.strip():
-            i += 1
-            continue
-        ni = indent_level(line)
-        if ni <= base_indent:
-            break
-        block.append(line)
-        i += 1
-    return block, i
-
-def parse_when_group(lines, start_index):
-    """Parse when/or when/otherwise group."""
-    branches = []
-    i = start_index
-    base_indent = indent_level(lines[start_index])
-
-    def parse_branch(idx):
-        header_line = lines[idx]
-        header_indent = indent_level(header_line)
-        stripped = header_line.lstrip()
-        
-        if stripped.startswith("when "):
-            rest = stripped[5:].strip()
-        elif stripped.startswith("or when "):
-            rest = stripped[8:].strip()
-        elif stripped.startswith("otherwise"):
-            rest = ""
-        else:
-            raise RuntimeError(f"Expected when/or when/otherwise")
-        
-        if rest.endswith(":"):
-            rest = rest[:-1].strip()
-        
-        condition = None if not rest else rest
-        block, next_idx = collect_block(lines, idx + 1, header_indent)
-        
-        return condition, block, next_idx
-    
-    cond, block, i = parse_branch(i)
-    branches.append((cond, block))
-    
-    while i < len(lines):
-        line = lines[i]
-        if not line.strip():
-            i += 1
-            continue
-        
-        current_indent = indent_level(line)
-        if current_indent != base_indent:
-            break
-        
-        stripped = line.lstrip()
-        
-        if stripped.startswith("or when ") and stripped.rstrip().endswith(":"):
-            cond, block, i = parse_branch(i)
-            branches.append((cond, block))
-        elif stripped.startswith("otherwise") and stripped.rstrip().endswith(":"):
-            cond, block, i = parse_branch(i)
-            branches.append((cond, block))
-            break
-        else:
-            break
-    
-    return branches, i
+        machine.output.write(f"Error: {e}\n")
+        return
+    if res:
+        machine.stack.append(BranchActivation(stmt.yes_body, "Error: "))
+    elif stmt.no_body:
+        machine.stack.append(BranchActivation(stmt.no_body, "Error: "))
+
+def exec_function_def(stmt, variables, machine):
+    machine.functions[stmt.name] = (stmt.params, stmt.body)
+    # A new definition never reuses results of the old one
+    if stmt.remembered:
+        machine.memos[stmt.name] = Memo(machine.memo_size)
+    else:
+        machine.memos.pop(stmt.name, None)
 
-def parse_question_group(lines, start_index):
-    """Parse is/are question format with yes/no branches."""
-    branches = []
-    i = start_index
-    base_indent = indent_level(lines[start_index])
-    
-    # Extract question (condition)
-    question_line = lines[i].lstrip()
-    condition = question_line.strip().rstrip("?").strip()
-    
-    # Remove "is" or "are" from beginning if present
-    if condition.startswith("is "):
-        condition = condition[3:].strip()
-    elif condition.startswith("are "):
-        condition = condition[4:].strip()
-    
-    i += 1
-    
-    # Look for yes: and no: branches
-    yes_block = []
-    no_block = []
-    
-    while i < len(lines):
-        line = lines[i]
-        if not line.strip():
-            i += 1
-            continue
-        
-        current_indent = indent_level(line)
-        if current_indent <= base_indent:
-            break
-        
-        stripped = line.lstrip()
-        
-        if stripped.startswith("yes:"):
-            # Collect yes block
-            yes_block, i = collect_block(lines, i + 1, current_indent)
-        elif stripped.startswith("no:"):
-            # Collect no block
-            no_block, i = collect_block(lines, i + 1, current_indent)
-        else:
-            i += 1
-    
-    # Create branches: yes = condition true, no = condition false
-    branches.append((condition, yes_block))
-    if no_block:
-        branches.append((None, no_block))  # None means else/no
-    
-    return branches, i
+def exec_call(stmt, variables, machine):
+    machine.call_function(stmt.name, [arg.run(variables) for arg in stmt.args], variables)
 
-def parse_function_definition(lines, start_index):
-    """Parse function definition."""
-    header_line = lines[start_index]
-    stripped = header_line.lstrip()
-    header_indent = indent_level(header_line)
-    
-    if " with " in stripped:
-        parts = stripped[7:].split(" with ", 1)
-        func_name = parts[0].strip()
-        params_str = parts[1].strip().rstrip(":")
-        params = [p.strip() for p in params_str.split(",")]
-    else:
-        func_name = stripped[7:].strip().rstrip(":")
-        params = []
-    
-    block, next_idx = collect_block(lines, start_index + 1, header_indent)
-    
-    return func_name, params, block, next_idx
+def exec_return(stmt, variables, machine):
+    machine.give_back(stmt.expr.run(variables))
 
-def call_function(func_name, args, variables):
-    """Call a user-defined function."""
-    if func_name not in functions:
-        raise RuntimeError(f"Function '{func_name}' not defined")
-    
-    params, block = functions[func_name]
-    
-    func_vars = variables.copy()
-    for i, param in enumerate(params):
-        if i < len(args):
-            func_vars[param] = args[i]
-    
-    result = None
-    func_vars['__return__'] = None
-    run_lines(block, func_vars)
-    
-    return func_vars.get('__return__')
+def exec_scope(stmt, variables, machine):
+    for name in stmt.names:
+        dict.pop(variables, name, None)
+    machine.stack.append(ScopeActivation(stmt.body, stmt.names, variables))
 
-def run_lines(lines, variables):
-    """Execute Whisper code lines."""
-    i = 0
-    length = len(lines)
-    
-    while i < length:
-        raw = lines[i]
-        line = raw.rstrip("\n")
-        stripped = line.lstrip()
-    
-        if not stripped or stripped.startswith("#"):
-            i += 1
-            continue
-        
-        # Remove inline comments (but not # inside strings)
-        if '#' in stripped:
-            in_string = False
-            quote_char = None
-            for idx, char in enumerate(stripped):
-                if char in ('"', "'") and (idx == 0 or stripped[idx-1] != '\\'):
-                    if not in_string:
-                        in_string = True
-                        quote_char = char
-                    elif char == quote_char:
-                        in_string = False
-                elif char == '#' and not in_string:
-                    stripped = stripped[:idx].rstrip()
-                    break
-        
-        # Break and Continue
-        if stripped in ("break", "end while", "end loop", "end for", "stop"):
-            raise StopIteration("break")
-        
-        if stripped in ("continue", "resume while", "resume loop", "resume for", "next", "skip"):
-            raise StopIteration("continue")
-        
-        indent = indent_level(line)
-
-        # Conversational: hey whisper, remember that x is 5
-        if stripped.startswith("hey whisper,") or stripped.startswith("whisper,"):
-            rest = stripped.split(",", 1)[1].strip()
-            # Check if this is just a comment/statement, not a command
-            if not any(rest.startswith(cmd) for cmd in ["remember that", "let ", "set ", "so ", "whisper ", "show ", "tell me", "ask ", "when ", "if ", "while ", "do ", "repeat ", "for each", "call ", "define ", "make ", "add ", "remove ", "write ", "read ", "uppercase ", "lowercase ", "there is", "the ", "is ", "are ", "forget about"]):
-                # It's just a conversational comment, skip it
-                i += 1
-                continue
-            # Process the rest as a normal command
-            stripped = rest
-
-        # Remember (variable assignment): remember that x is 5
-        if stripped.startswith("remember that "):
-            rest = stripped[14:].strip()
-            if " is " in rest:
-                parts = rest.split(" is ", 1)
-                name = parts[0].strip()
-                value = parts[1].strip()
-                variables[name] = evaluate(value, variables)
-                i += 1
-                continue
-
-        # Forget (delete variable): forget about x
-        if stripped.startswith("forget about "):
-            var_name = stripped[13:].strip()
-            if var_name in variables:
-                del variables[var_name]
-            i += 1
-            continue
-
-        # Story objects: there is a hero with health 100
-        if stripped.startswith("there is a ") or stripped.startswith("there is an "):
-            rest = stripped[11:].strip() if stripped.startswith("there is a ") else stripped[12:].strip()
-            if " with " in rest:
-                parts = rest.split(" with ", 1)
-                obj_name = parts[0].strip()
-                # Parse properties
-                props_str = parts[1].strip()
-                props = {}
-                for prop in props_str.split(","):
-                    if " " in prop:
-                        prop_parts = prop.strip().split(" ", 1)
-                        prop_name = prop_parts[0].strip()
-                        prop_value = prop_parts[1].strip() if len(prop_parts) > 1 else ""
-                        props[prop_name] = evaluate(prop_value, variables)
-                story_objects[obj_name] = props
-                variables[obj_name] = props
-            i += 1
-            continue
-
-        # Story action: the hero loses 20 health
-        if stripped.startswith("the ") and " loses " in stripped:
-            parts = stripped[4:].split(" loses ", 1)
-            obj_name = parts[0].strip()
-            rest = parts[1].strip()
-            # Parse: "20 health"
-            amount_prop = rest.rsplit(" ", 1)
-            amount = evaluate(amount_prop[0].strip(), variables)
-            prop = amount_prop[1].strip() if len(amount_prop) > 1 else "value"
-            
-            if obj_name in story_objects and prop in story_objects[obj_name]:
-                story_objects[obj_name][prop] -= amount
-                variables[obj_name] = story_objects[obj_name]
-            i += 1
-            continue
-
-        # Story action: the hero gains 10 health OR the hero gains dragon treasure gold
-        if stripped.startswith("the ") and " gains " in stripped:
-            parts = stripped[4:].split(" gains ", 1)
-            obj_name = parts[0].strip()
-            rest = parts[1].strip()
-            
-            # Check if it's "object property property" format
-            rest_parts = rest.split(" ")
-            if len(rest_parts) == 3:
-                # Format: "dragon treasure gold" -> gain dragon's treasure and add to gold
-                source_obj = rest_parts[0]
-                source_prop = rest_parts[1]
-                target_prop = rest_parts[2]
-                if source_obj in story_objects and source_prop in story_objects[source_obj]:
-                    amount = story_objects[source_obj][source_prop]
-                    if obj_name in story_objects and target_prop in story_objects[obj_name]:
-                        story_objects[obj_name][target_prop] += amount
-                        variables[obj_name] = story_objects[obj_name]
-            else:
-                # Format: "10 health" -> regular gains
-                amount_prop = rest.split(" ", 1)
-                amount = evaluate(amount_prop[0].strip(), variables)
-                prop = amount_prop[1].strip() if len(amount_prop) > 1 else "value"
-                
-                if obj_name in story_objects and prop in story_objects[obj_name]:
-                    story_objects[obj_name][prop] += amount
-                    variables[obj_name] = story_objects[obj_name]
-            i += 1
-            continue
-
-        # Question-based condition: is x greater than 5?
-        if (stripped.startswith("is ") or stripped.startswith("are ")) and stripped.endswith("?"):
-            branches, nxt = parse_question_group(lines, i)
-            
-            # branches[0] is the yes branch (condition, block)
-            # branches[1] is the no branch (None, block) if it exists
-            
-            if len(branches) > 0:
-                cond, yes_block = branches[0]
-                no_block = branches[1][1] if len(branches) > 1 else []
-                
-                try:
-                    # Process condition
-                    cond = cond.replace(" is ", " == ")
-                    cond = cond.replace(" equals ", " == ")
-                    cond = cond.replace(" greater than ", " > ")
-                    cond = cond.replace(" less than ", " < ")
-                    cond = cond.replace(" bigger than ", " > ")
-                    cond = cond.replace(" smaller than ", " < ")
-                    cond = cond.replace(" not ", " != ")
-                    
-                    res = evaluate(cond, variables)
-                    
-                    if res:
-                        # Execute yes branch
-                        run_lines(yes_block, variables)
-                    else:
-                        # Execute no branch if it exists
-                        if no_block:
-                            run_lines(no_block, variables)
-                            
-                except StopIteration:
-                    raise
-                except Exception as e:
-                    print(f"Error: {e}")
-            
-            i = nxt
-            continue
-
-        # Function definition
-        if stripped.startswith("define ") and stripped.endswith(":"):
-            func_name, params, block, nxt = parse_function_definition(lines, i)
-            functions[func_name] = (params, block)
-            i = nxt
-            continue
-        
-        # Function call
-        if stripped.startswith("call "):
-            rest = stripped[5:].strip()
-            if " with " in rest:
-                parts = rest.split(" with ", 1)
-                func_name = parts[0].strip()
-                args_str = parts[1].strip()
-                args = [evaluate(arg.strip(), variables) for arg in args_str.split(",")]
-            else:
-                func_name = rest
-                args = []
-            
-            result = call_function(func_name, args, variables)
-            if result is not None:
-                variables['__last_result__'] = result
-            i += 1
-            continue
-        
-        # Return statement
-        if stripped.startswith("give back "):
-            value_expr = stripped[10:].strip()
-            variables['__return__'] = evaluate(value_expr, variables)
+def exec_attempt(stmt, variables, machine):
+    machine.stack.append(AttemptActivation(stmt.body, stmt.handler))
+
+def exec_increase(stmt, variables, machine):
+    increase(variables, stmt.name, stmt.expr.run(variables))
+
+def exec_decrease(stmt, variables, machine):
+    decrease(variables, stmt.name, stmt.expr.run(variables))
+
+def exec_ask(stmt, variables, machine):
+    variables[stmt.name] = ask(machine.output, stmt.prompt)
+
+def exec_output(stmt, variables, machine):
+    try:
+        result = stmt.expr.run(variables)
+        # Format dictionaries nicely, but keep lists as-is
+        if isinstance(result, dict):
+            result = str(result)
+        machine.output.write(f"{result}\n" if stmt.newline else str(result))
+    except NameError as e:
+        machine.output.write(f"Error: {e}\n")
+
+def exec_write(stmt, variables, machine):
+    write_file(stmt.content.run(variables), stmt.filename.run(variables))
+
+def exec_read(stmt, variables, machine):
+    variables[stmt.name] = read_file(stmt.filename.run(variables))
+
+def exec_change_case(stmt, variables, machine):
+    text = str(stmt.expr.run(variables))
+    variables[stmt.name] = text.upper() if stmt.upper else text.lower()
+
+def exec_while(stmt, variables, machine):
+    loop = WhileActivation(stmt.body, stmt.condition)
+    machine.stack.append(loop)
+    loop.next_iteration(machine)
+
+def start_for_each(stmt, items, machine):
+    """Push a for-each loop over an iterator and start its first pass."""
+    if stmt.condition is None:
+        loop = ForEachActivation(stmt.body, stmt.var, items)
+    else:
+        loop = FilteredForEachActivation(stmt.body, stmt.var, items, stmt.condition)
+    machine.stack.append(loop)
+    loop.next_iteration(machine)
+
+def exec_for_each(stmt, variables, machine):
+    # Everything is walked one item at a time; a value that cannot be read is an empty list
+    try:
+        items = items_of(stmt.expr.run(variables))
+    except:
+        items = []
+    start_for_each(stmt, iter(items), machine)
+
+def exec_for_each_line(stmt, variables, machine):
+    filename = str(stmt.filename.run(variables))
+    start_for_each(stmt, read_lines(filename), machine)
+
+def exec_for_range(stmt, variables, machine):
+    start = whole_number(stmt.start.run(variables), "from")
+    stop = whole_number(stmt.stop.run(variables), "to")
+    step = stmt.step.run(variables) if stmt.step is not None else None
+    loop = ForEachActivation(stmt.body, stmt.var, iter(count_range(start, stop, step)))
+    machine.stack.append(loop)
+    loop.next_iteration(machine)
+
+def exec_repeat(stmt, variables, machine):
+    count = int(stmt.count.run(variables))
+    loop = RepeatActivation(stmt.body, count)
+    machine.stack.append(loop)
+    loop.next_iteration(machine)
+
+def exec_add_item(stmt, variables, machine):
+    add_item(variables, stmt.name, stmt.item.run(variables))
+
+def exec_remove_item(stmt, variables, machine):
+    remove_item(variables, stmt.name, stmt.item.run(variables))
+
+def exec_append(stmt, variables, machine):
+    append_to(variables, stmt.name, stmt.item.run(variables))
+
+def exec_sort(stmt, variables, machine):
+    sort_list(variables, stmt.name, stmt.descending)
+
+def exec_keep(stmt, variables, machine):
+    keep(variables, stmt.name, stmt.var, stmt.condition.run)
+
+def exec_when(stmt, variables, machine):
+    for cond, body in stmt.branches:
+        if cond is None:
+            machine.stack.append(Activation(body))
+            return
+        try:
+            res = cond.run(variables)
+        except Exception as e:
+            machine.output.write(f"Error evaluating condition '{cond.source}': {e}\n")
+            return
+        if res:
+            prefix = f"Error evaluating condition '{cond.source}': "
+            machine.stack.append(BranchActivation(body, prefix))
             return
 
-        # Try-catch
-        if stripped.startswith("attempt:"):
-            attempt_block, next_i = collect_block(lines, i + 1, indent)
-            handle_block = []
-            if next_i < length:
-                next_line = lines[next_i].lstrip()
-                if next_line.startswith("handle:"):
-                    handle_block, next_i = collect_block(lines, next_i + 1, indent)
-            
+def exec_unknown(stmt, variables, machine):
+    machine.output.write(f"Unknown command: {stmt.text}\n")
+
+EXECUTORS = {
+    nodes.Break: exec_break,
+    nodes.Continue: exec_continue,
+    nodes.Assign: exec_assign,
+    nodes.Forget: exec_forget,
+    nodes.StoryObject: exec_story_object,
+    nodes.Loses: exec_loses,
+    nodes.Gains: exec_gains,
+    nodes.GainsFrom: exec_gains_from,
+    nodes.Question: exec_question,
+    nodes.FunctionDef: exec_function_def,
+    nodes.Call: exec_call,
+    nodes.Return: exec_return,
+    nodes.Attempt: exec_attempt,
+    nodes.Increase: exec_increase,
+    nodes.Decrease: exec_decrease,
+    nodes.Ask: exec_ask,
+    nodes.Output: exec_output,
+    nodes.Write: exec_write,
+    nodes.Read: exec_read,
+    nodes.ChangeCase: exec_change_case,
+    nodes.While: exec_while,
+    nodes.ForEach: exec_for_each,
+    nodes.ForEachLine: exec_for_each_line,
+    nodes.ForRange: exec_for_range,
+    nodes.Repeat: exec_repeat,
+    nodes.AddItem: exec_add_item,
+    nodes.RemoveItem: exec_remove_item,
+    nodes.Append: exec_append,
+    nodes.SortList: exec_sort,
+    nodes.Keep: exec_keep,
+    nodes.When: exec_when,
+    nodes.Scope: exec_scope,
+    nodes.Unknown: exec_unknown,
+}
+
+# ======== Programs and interpreters ========
+
+class Program:
+    """A parsed Whisper program.
+
+    Programs never change after parsing, so one Program can be run any
+    number of times, by many interpreters and from many threads at once.
+    """
+    __slots__ = ('source', 'statements', '__weakref__')
+
+    def __init__(self, source, statements):
+        self.source = source
+        self.statements = statements
+
+def compile_program(code):
+    """Parse Whisper source code into a reusable Program."""
+    return Program(code, parse(code))
+
+class Interpreter:
+    """Holds everything a running Whisper program can change.
+
+    Each Interpreter has its own variables, functions and story objects, so
+    scripts run by different interpreters never see each other's
+    definitions. Calls on one Interpreter are serialised with a lock; give
+    each thread its own Interpreter to run programs in parallel.
+
+    output is the sink program output goes to (anything with write() and
+    flush(), e.g. a CaptureSink); by default a buffered stdout sink.
+
+    max_steps, timeout (seconds) and max_depth limit every run: the number
+    of statements executed, the wall-clock time, and how deeply function
+    calls may nest (MAX_DEPTH unless given). None means no limit. Running
+    out raises LimitExceeded.
+
+    memo_size is how many results each remembered function keeps (None
+    keeps them all).
+
+    cache_conditions reuses the result of a condition or `let` value while
+    the variables it reads keep their values (see conditions.py);
+    condition_stats() reports how often it did.
+    """
+
+    def __init__(self, output=None, max_steps=None, timeout=None, max_depth=MAX_DEPTH,
+                 memo_size=MEMO_SIZE, cache_conditions=False):
+        self.output = output
+        self.max_steps = max_steps
+        self.timeout = timeout
+        self.max_depth = max_depth
+        self.memo_size = memo_size
+        self.variables = {}
+        self.functions = {}
+        self.memos = {}
+        self.conditions = None
+        if cache_conditions:
+            from .conditions import ConditionCache
+            self.conditions = ConditionCache()
+        self.lock = threading.RLock()
+
+    def run(self, program, variables=None):
+        """Run a Program (or source text) and return the variable store used.
+
+        variables is the store to run against; by default the interpreter's
+        own, which keeps its values between runs.
+        """
+        if isinstance(program, str):
+            program = compile_program(program)
+        if variables is None:
+            variables = self.variables
+        with self.lock:
+            statements = program.statements
+            if self.conditions is not None:
+                statements = self.conditions.prepare(program)
+            Machine(self, variables).run(statements)
+        return variables
+
+    def execute(self, statements, variables=None):
+        """Execute a list of parsed statements."""
+        return self.run(Program(None, statements), variables)
+
+    def call(self, name, *args):
+        """Call a function the program defined and return what it gives back."""
+        with self.lock:
+            machine = Machine(self, self.variables)
+            call = machine.call_function(name, list(args), {})
             try:
-                run_lines(attempt_block, variables)
-            except StopIteration:
-                raise
-            except Exception as e:
-                if handle_block:
-                    variables['error'] = str(e)
-                    run_lines(handle_block, variables)
-            
-            i = next_i
-            continue
-
-        # Variable assignment: let x be 5
-        if stripped.startswith("let "):
-            parts = stripped[4:].split(" be ", 1)
-            if len(parts) == 2:
-                name = parts[0].strip()
-                value = parts[1].strip()
-                variables[name] = evaluate(value, variables)
-                i += 1
-                continue
-        
-        # Conversational: so x is 5
-        if stripped.startswith("so "):
-            rest = stripped[3:].strip()
-            if " is " in rest:
-                parts = rest.split(" is ", 1)
-                name = parts[0].strip()
-                value = parts[1].strip()
-                variables[name] = evaluate(value, variables)
-                i += 1
-                continue
-        
-        # Alternative assignment: set x to 5
-        if stripped.startswith("set "):
-            parts = stripped[4:].split(" to ", 1)
-            if len(parts) == 2:
-                name = parts[0].strip()
-                value = parts[1].strip()
-                variables[name] = evaluate(value, variables)
-                i += 1
-                continue
-        
-        # Increment
-        if stripped.startswith("increase "):
-            parts = stripped[9:].split(" by ", 1)
-            if len(parts) == 2:
-                name = parts[0].strip()
-                value = parts[1].strip()
-                if name in variables:
-                    variables[name] = variables[name] + evaluate(value, variables)
-                else:
-                    variables[name] = evaluate(value, variables)
-                i += 1
-                continue
-        
-        # Decrement
-        if stripped.startswith("decrease "):
-            parts = stripped[9:].split(" by ", 1)
-            if len(parts) == 2:
-                name = parts[0].strip()
-                value = parts[1].strip()
-                if name in variables:
-                    variables[name] = variables[name] - evaluate(value, variables)
-                else:
-                    variables[name] = -evaluate(value, variables)
-                i += 1
-                continue
-
-        # User input
-        if stripped.startswith("ask "):
-            rest = stripped[4:].strip()
-            if " into " in rest:
-                parts = rest.split(" into ", 1)
-                prompt = parts[0].strip().strip('"').strip("'")
-                var_name = parts[1].strip()
-                user_input = input(prompt + " ")
-                try:
-                    if '.' in user_input:
-                        variables[var_name] = float(user_input)
-                    else:
-                        variables[var_name] = int(user_input)
-                except ValueError:
-                    variables[var_name] = user_input
-                i += 1
-                continue
-
-        # Output: whisper "text", show x, tell me x, just say x
-        if stripped.startswith("whisper "):
-            expr = stripped[8:].strip()
-            try:
-                result = evaluate(expr, variables)
-                # Format dictionaries nicely
-                if isinstance(result, dict):
-                    result = str(result)
-                print(result)
-            except NameError as e:
-                print(f"Error: {e}")
-            i += 1
-            continue
-        
-        if stripped.startswith("show "):
-            expr = stripped[5:].strip()
-            try:
-                result = evaluate(expr, variables)
-                # Format dictionaries nicely, but keep lists as-is
-                if isinstance(result, dict):
-                    result = str(result)
-                print(result)
-            except NameError as e:
-                print(f"Error: {e}")
-            i += 1
-            continue
-        
-        if stripped.startswith("tell me "):
-            expr = stripped[8:].strip()
-            try:
-                result = evaluate(expr, variables)
-                # Format dictionaries nicely
-                if isinstance(result, dict):
-                    result = str(result)
-                print(result)
-            except NameError as e:
-                print(f"Error: {e}")
-            i += 1
-            continue
-        
-        if stripped.startswith("just say ") or stripped.startswith("just tell "):
-            expr = stripped[9:].strip() if "say" in stripped else stripped[10:].strip()
-            try:
-                result = evaluate(expr, variables)
-                # Format dictionaries nicely
-                if isinstance(result, dict):
-                    result = str(result)
-                print(result)
-            except NameError as e:
-                print(f"Error: {e}")
-            i += 1
-            continue
-        
-        # Announce
-        if stripped.startswith("announce "):
-            expr = stripped[9:].strip()
-            try:
-                result = evaluate(expr, variables)
-                print(result, end='')
-            except NameError as e:
-                print(f"Error: {e}")
-            i += 1
-            continue
-
-        # File operations
-        if stripped.startswith("write ") and " to " in stripped:
-            parts = stripped[6:].split(" to ", 1)
-            if len(parts) == 2:
-                content_expr = parts[0].strip()
-                filename_expr = parts[1].strip()
-                content = str(evaluate(content_expr, variables))
-                filename = str(evaluate(filename_expr, variables))
-                with open(filename, 'w', encoding='utf-8') as f:
-                    f.write(content)
-                i += 1
-                continue
-        
-        if stripped.startswith("read ") and " into " in stripped:
-            parts = stripped[5:].split(" into ", 1)
-            if len(parts) == 2:
-                filename_expr = parts[0].strip()
-                var_name = parts[1].strip()
-                filename = str(evaluate(filename_expr, variables))
-                with open(filename, 'r', encoding='utf-8') as f:
-                    variables[var_name] = f.read()
-                i += 1
-                continue
-
-        # String operations
-        if stripped.startswith("uppercase ") and " into " in stripped:
-            parts = stripped[10:].split(" into ", 1)
-            if len(parts) == 2:
-                text_expr = parts[0].strip()
-                var_name = parts[1].strip()
-                text = str(evaluate(text_expr, variables))
-                variables[var_name] = text.upper()
-                i += 1
-                continue
-        
-        if stripped.startswith("lowercase ") and " into " in stripped:
-            parts = stripped[10:].split(" into ", 1)
-            if len(parts) == 2:
-                text_expr = parts[0].strip()
-                var_name = parts[1].strip()
-                text = str(evaluate(text_expr, variables))
-                variables[var_name] = text.lower()
-                i += 1
-                continue
-
-        # While loop
-        if stripped.startswith("while ") and stripped.endswith(":"):
-            condition = stripped[6:-1].strip()
-            block, nxt = collect_block(lines, i + 1, indent)
-            
-            cond_check = condition.replace(" is ", " == ")
-            cond_check = cond_check.replace(" equals ", " == ")
-            cond_check = cond_check.replace(" greater than ", " > ")
-            cond_check = cond_check.replace(" less than ", " < ")
-            cond_check = cond_check.replace(" bigger than ", " > ")
-            cond_check = cond_check.replace(" smaller than ", " < ")
-            cond_check = cond_check.replace(" not ", " != ")
-            
-            max_iterations = 10000
-            iterations = 0
-            
-            while iterations < max_iterations:
-                try:
-                    if not evaluate(cond_check, variables):
-                        break
-                    run_lines(block, variables)
-                    iterations += 1
-                except StopIteration as e:
-                    if str(e) == "break":
-                        break
-                    elif str(e) == "continue":
-                        continue
-                except Exception as e:
-                    print(f"Error in while loop: {e}")
-                    break
-            
-            i = nxt
-            continue
-
-        # For-each loop
-        if stripped.startswith("for each ") and " in " in stripped and stripped.endswith(":"):
-            parts = stripped[9:-1].split(" in ", 1)
-            if len(parts) == 2:
-                var_name = parts[0].strip()
-                list_expr = parts[1].strip()
-                
-                try:
-                    items = evaluate(list_expr, variables)
-                    if isinstance(items, str):
-                        items = list(items)
-                    elif not isinstance(items, (list, tuple, range)):
-                        items = [items]
-                except:
-                    items = []
-                
-                block, nxt = collect_block(lines, i + 1, indent)
-                
-                for item in items:
-                    variables[var_name] = item
-                    try:
-                        run_lines(block, variables)
-                    except StopIteration as e:
-                        if str(e) == "break":
-                            break
-                        elif str(e) == "continue":
-                            continue
-                
-                i = nxt
-                continue
-
-        # Loops
-        if stripped.startswith("do ") and " times:" in stripped:
-            parts = stripped[3:].split(" times:", 1)
-            count_expr = parts[0].strip()
-            count = int(evaluate(count_expr, variables))
-            block, nxt = collect_block(lines, i + 1, indent)
-            for _ in range(count):
-                try:
-                    run_lines(block, variables)
-                except StopIteration as e:
-                    if str(e) == "break":
-                        break
-                    elif str(e) == "continue":
-                        continue
-            i = nxt
-            continue
-        
-        if stripped.startswith("repeat ") and stripped.endswith(":"):
-            count_expr = stripped[7:-1].strip()
-            count = int(evaluate(count_expr, variables))
-            block, nxt = collect_block(lines, i + 1, indent)
-            for _ in range(count):
-                try:
-                    run_lines(block, variables)
-                except StopIteration as e:
-                    if str(e) == "break":
-                        break
-                    elif str(e) == "continue":
-                        continue
-            i = nxt
-            continue
-        
-        # List operations
-        if stripped.startswith("make ") and " with " in stripped:
-            parts = stripped[5:].split(" with ", 1)
-            if len(parts) == 2:
-                list_name = parts[0].strip()
-                list_expr = parts[1].strip()
-                variables[list_name] = evaluate(list_expr, variables)
-                i += 1
-                continue
-        
-        if stripped.startswith("add ") and " to " in stripped:
-            parts = stripped[4:].split(" to ", 1)
-            if len(parts) == 2:
-                item_expr = parts[0].strip()
-                list_name = parts[1].strip()
-                item = evaluate(item_expr, variables)
-                if list_name in variables:
-                    if isinstance(variables[list_name], list):
-                        variables[list_name].append(item)
-                    else:
-                        variables[list_name] = [variables[list_name], item]
-                else:
-                    variables[list_name] = [item]
-                i += 1
-                continue
-        
-        if stripped.startswith("remove ") and " from " in stripped:
-            parts = stripped[7:].split(" from ", 1)
-            if len(parts) == 2:
-                item_expr = parts[0].strip()
-                list_name = parts[1].strip()
-                item = evaluate(item_expr, variables)
-                if list_name in variables and isinstance(variables[list_name], list):
-                    try:
-                        variables[list_name].remove(item)
-                    except ValueError:
-                        pass
-                i += 1
-                continue
-
-        # Conditionals
-        if stripped.startswith("when ") and stripped.endswith(":"):
-            branches, nxt = parse_when_group(lines, i)
-            executed_any = False
-            
-            for cond, block in branches:
-                if cond is None:
-                    if not executed_any:
-                        run_lines(block, variables)
-                    break
-                else:
-                    try:
-                        cond = cond.replace(" is ", " == ")
-                        cond = cond.replace(" equals ", " == ")
-                        cond = cond.replace(" greater than ", " > ")
-                        cond = cond.replace(" less than ", " < ")
-                        cond = cond.replace(" bigger than ", " > ")
-                        cond = cond.replace(" smaller than ", " < ")
-                        cond = cond.replace(" not ", " != ")
-                        
-                        res = evaluate(cond, variables)
-                        if res:
-                            run_lines(block, variables)
-                            executed_any = True
-                            break
-                    except StopIteration:
-                        raise
-                    except Exception as e:
-                        print(f"Error evaluating condition '{cond}': {e}")
-                        break
-            
-            i = nxt
-            continue
-
-        # Unknown command
-        print(f"Unknown command: {stripped}")
-        i += 1
+                machine.resume(0)
+            finally:
+                machine.output.flush()
+            return call.result
+
+    def memo_stats(self):
+        """Return {function name: hits, misses, size, max_size} for remembered functions."""
+        with self.lock:
+            return {name: memo.stats() for name, memo in self.memos.items()}
+
+    def condition_stats(self):
+        """Return {expression source: hits, misses, cached} for cached conditions."""
+        with self.lock:
+            return self.conditions.stats() if self.conditions is not None else {}
+
+    def reset(self):
+        """Forget all variables, functions, remembered results and story objects."""
+        with self.lock:
+            self.variables = {}
+            self.functions = {}
+            self.memos = {}
+            if self.conditions is not None:
+                from .conditions import ConditionCache
+                self.conditions = ConditionCache()
+
+def execute(statements, variables, output=None):
+    """Execute a list of parsed statements in a fresh interpreter."""
+    Interpreter(output).execute(statements, variables)
+
+def run_lines(lines, variables, output=None):
+    """Execute Whisper code lines."""
+    execute(parse_lines(lines), variables, output)
 
-def run(code):
-    """Run Whisper code."""
-    variables = {}
-    lines = code.splitlines(keepends=True)
-    run_lines(lines, variables)
+def run(code, output=None):
+    """Run Whisper code, sending its output to output (stdout by default)."""
+    Interpreter(output).run(code)
 
 def main():
     """Main entry point."""
@@ -1072,11 +725,31 @@ def main():
     # Add --help flag
     if sys.argv[1] in ('--help', '-h', 'help'):
         print(f"🌙 Whisper v{__version__} - A Truly Unique Programming Language\n")
-        print("Usage: whisper <filename>")
+        print("Usage: whisper [run options] <filename>")
         print("       whisper [options]")
         print("\nOptions:")
         print("  --version, -v    Show version number")
         print("  --help, -h       Show this help message")
+        print("\nRun options:")
+        print("  --no-cache       Do not read or write the __wspcache__ program cache")
+        print("  --cache-dir DIR  Keep cached programs in DIR (or set WHISPER_CACHE_DIR)")
+        print("  --optimize       Fold constants, drop dead branches, hoist loop invariants")
+        print("  --optimize=fold,prune,hoist  Run only the optimizer passes listed")
+        print("  --max-steps N    Stop the program after N statements")
+        print("  --timeout SEC    Stop the program after SEC seconds")
+        print(f"  --max-depth N    Allow at most N nested function calls (default {MAX_DEPTH})")
+        print(f"  --memo-size N    Results kept per remembered function (default {MEMO_SIZE})")
+        print("  --cache-conditions  Reuse conditions whose variables have not changed")
+        print("  --condition-stats   Cache conditions and report the cache hits afterwards")
+        print("\nCompiling:")
+        print("  --compile        Translate the program to Python and run that instead")
+        print("  --compile -o OUT.py  Write the translated program to OUT.py")
+        print("\nProfiling:")
+        print("  --profile        Report time spent per line and function")
+        print("  --profile-json FILE  With --profile, also write the report as JSON")
+        print("\nCommands:")
+        print("  whisper bench    Run the built-in benchmark suite (whisper bench --help)")
+        print("  whisper run-many Run many scripts on a process pool (whisper run-many --help)")
         print("\nFile extensions: .wsp or .whisper")
         print("\nExamples:")
         print("  whisper hello.wsp")
@@ -1090,16 +763,137 @@ def main():
         print(f"Whisper v{__version__}")
         return
     
-    filename = sys.argv[1]
+    if sys.argv[1] == 'bench':
+        from .bench import bench_main
+        if '--help' in sys.argv[2:] or '-h' in sys.argv[2:]:
+            print(bench_main.__doc__)
+            return
+        sys.exit(bench_main(sys.argv[2:]))
+
+    if sys.argv[1] == 'run-many':
+        from .batch import run_many_main
+        if '--help' in sys.argv[2:] or '-h' in sys.argv[2:]:
+            print(run_many_main.__doc__)
+            return
+        sys.exit(run_many_main(sys.argv[2:]))
+
+    if sys.argv[1] == '--compile':
+        from .compiler import compile_main
+        compile_main(sys.argv[2:])
+        return
+
+    if sys.argv[1] == '--profile':
+        profile_main(sys.argv[2:])
+        return
+
+    run_main(sys.argv[1:])
+
+def run_main(args):
+    """whisper [--no-cache] [--cache-dir DIR] [--optimize[=PASSES]] [--max-steps N] [--timeout SEC] [--max-depth N] [--memo-size N] [--cache-conditions] [--condition-stats] <filename>"""
+    from .cache import load_program
+
+    use_cache = True
+    passes = ()
+    cache_conditions = condition_stats = False
+    cache_dir = os.environ.get("WHISPER_CACHE_DIR") or None
+    limits = {'--max-steps': None, '--timeout': None, '--max-depth': MAX_DEPTH,
+              '--memo-size': MEMO_SIZE}
+    filename = None
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--no-cache':
+            use_cache = False
+        elif arg == '--cache-dir':
+            if i + 1 >= len(args):
+                print("Error: --cache-dir needs a folder")
+                return
+            cache_dir = args[i + 1]
+            i += 1
+        elif arg == '--cache-conditions':
+            cache_conditions = True
+        elif arg == '--condition-stats':
+            cache_conditions = condition_stats = True
+        elif arg == '--optimize' or arg.startswith('--optimize='):
+            from .optimizer import passes_option
+            try:
+                passes = passes_option(arg)
+            except ValueError as e:
+                print(f"Error: {e}")
+                return
+        elif arg in limits:
+            if i + 1 >= len(args):
+                print(f"Error: {arg} needs a number")
+                return
+            try:
+                limits[arg] = float(args[i + 1]) if arg == '--timeout' else int(args[i + 1])
+            except ValueError:
+                print(f"Error: {arg} needs a number, got '{args[i + 1]}'")
+                return
+            i += 1
+        elif arg.startswith('--') or filename is not None:
+            print(f"Error: unexpected argument '{arg}'")
+            print(f"Usage: {run_main.__doc__}")
+            return
+        else:
+            filename = arg
+        i += 1
+    if filename is None:
+        print(f"Usage: {run_main.__doc__}")
+        return
+
+    try:
+        program = load_program(filename, cache_dir, use_cache)
+        if passes:
+            from .optimizer import optimize
+            program = optimize(program, passes)
+        interpreter = Interpreter(max_steps=limits['--max-steps'], timeout=limits['--timeout'],
+                                  max_depth=limits['--max-depth'], memo_size=limits['--memo-size'],
+                                  cache_conditions=cache_conditions)
+        try:
+            interpreter.run(program)
+        finally:
+            if condition_stats:
+                from .conditions import format_stats
+                print(format_stats(interpreter.condition_stats()), file=sys.stderr)
+    except FileNotFoundError:
+        print(f"Error: File '{filename}' not found")
+    except Exception as e:
+        print(f"Error: {e}")
+
+def profile_main(args):
+    """whisper --profile <filename> [--profile-json <report.json>]"""
+    from .profiler import profile
+
+    json_file = None
+    if '--profile-json' in args:
+        index = args.index('--profile-json')
+        if index + 1 >= len(args):
+            print("Error: --profile-json needs a file name")
+            return
+        json_file = args[index + 1]
+        args = args[:index] + args[index + 2:]
+    if len(args) != 1:
+        print("Usage: whisper --profile <filename> [--profile-json <report.json>]")
+        return
+    filename = args[0]
 
     try:
         with open(filename, "r", encoding="utf-8") as f:
             code = f.read()
-        run(code)
     except FileNotFoundError:
         print(f"Error: File '{filename}' not found")
+        return
+    try:
+        result = profile(code)
     except Exception as e:
         print(f"Error: {e}")
+        result = getattr(e, 'profile', None)
+        if result is None:
+            return
+    print(result.report(), file=sys.stderr)
+    if json_file:
+        result.write_json(json_file)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
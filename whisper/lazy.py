@@ -0,0 +1,58 @@
+"""
+Lazy sequences: values that produce their elements one at a time.
+
+range(...), lines("file.txt") and slices of them never build a list, so
+`for each` can walk a million numbers or a large file in constant memory.
+lines(...) and slices are read once: showing one, or joining it to text,
+reads the rest of it into a list.
+"""
+
+from collections.abc import Iterator
+from itertools import islice
+
+
+def read_lines(filename):
+    """Yield the lines of a text file one at a time, without line endings."""
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            yield line.rstrip('\r\n')
+
+
+class LazySequence(Iterator):
+    """A one-pass sequence that reads as a list when shown."""
+    __slots__ = ('items',)
+
+    def __init__(self, items):
+        self.items = items
+
+    def __iter__(self):
+        # the underlying iterator, so loops run at generator speed
+        return self.items
+
+    def __next__(self):
+        return next(self.items)
+
+    def __str__(self):
+        return str(list(self.items))
+
+    def __repr__(self):
+        # repr() must not use the sequence up
+        return "<lazy sequence>"
+
+
+def lines(filename):
+    """lines("file.txt"): the lines of a file, read as they are used."""
+    return LazySequence(read_lines(filename))
+
+
+def is_lazy(value):
+    """True for a one-pass sequence such as lines(...) or a slice of one."""
+    return isinstance(value, Iterator)
+
+
+def lazy_slice(items, part):
+    """Slice a one-pass sequence without reading more of it than needed."""
+    try:
+        return LazySequence(islice(items, part.start, part.stop, part.step))
+    except ValueError:
+        raise IndexError("slices of lines(...) need positive numbers")
@@ -0,0 +1,60 @@
+"""
+Result caches for remembered functions.
+
+A function defined with `define remembered name with ...:` keeps the value
+it gave back for each set of arguments. Calling it again with the same
+arguments reuses that value instead of running the body, so recursive
+helpers such as Fibonacci only compute each result once. Each cache holds
+at most max_size results and drops the least recently used one when full;
+defining the function again starts a new, empty cache.
+
+Only calls whose arguments are all hashable (numbers, text, ...) are
+cached; calls with a list argument always run the body. A remembered
+function should depend on its arguments alone: output it prints and
+variables it changes are not repeated when a cached result is used.
+"""
+
+from collections import OrderedDict
+
+MEMO_SIZE = 1024
+
+
+class Memo:
+    """Least-recently-used cache of one function's results."""
+
+    def __init__(self, max_size=MEMO_SIZE):
+        self.max_size = max_size
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, args):
+        """Return the cache key for args, or None if they cannot be cached."""
+        key = tuple(args)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def lookup(self, key):
+        """Return (True, result) for a cached call, else (False, None)."""
+        results = self.results
+        if key in results:
+            results.move_to_end(key)
+            self.hits += 1
+            return True, results[key]
+        self.misses += 1
+        return False, None
+
+    def store(self, key, result):
+        results = self.results
+        results[key] = result
+        results.move_to_end(key)
+        if self.max_size is not None and len(results) > self.max_size:
+            results.popitem(last=False)
+
+    def stats(self):
+        """Return hits, misses, size and max_size as a dict."""
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self.results), "max_size": self.max_size}
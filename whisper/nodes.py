@@ -0,0 +1,361 @@
+"""
+Statement tree for Whisper programs.
+
+The parser turns source text into these nodes once; the interpreter then
+walks them without looking at the original text again. Every node records
+the 1-based source line it came from.
+"""
+
+from .story import slot_name
+
+
+class Statement:
+    """Base class for all statement nodes."""
+    __slots__ = ('line',)
+
+    def __init__(self, line=0):
+        self.line = line
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class Break(Statement):
+    """break / end while / end loop / end for / stop"""
+    __slots__ = ()
+
+
+class Continue(Statement):
+    """continue / resume while / resume loop / resume for / next / skip"""
+    __slots__ = ()
+
+
+class Assign(Statement):
+    """remember that x is 5 / let x be 5 / so x is 5 / set x to 5 / make x with [..]"""
+    __slots__ = ('name', 'expr')
+
+    def __init__(self, name, expr, line=0):
+        super().__init__(line)
+        self.name = name
+        self.expr = expr
+
+
+class Forget(Statement):
+    """forget about x"""
+    __slots__ = ('name',)
+
+    def __init__(self, name, line=0):
+        super().__init__(line)
+        self.name = name
+
+
+class StoryObject(Statement):
+    """there is a hero with health 100, power 50"""
+    __slots__ = ('name', 'props', 'fields')
+
+    def __init__(self, name, props, line=0):
+        super().__init__(line)
+        self.name = name
+        # list of (slot, value expression), in declaration order
+        self.props = [(slot_name(prop), expr) for prop, expr in props]
+        # the record's property names, each once
+        self.fields = tuple(dict.fromkeys(prop for prop, expr in props))
+
+
+class Loses(Statement):
+    """the hero loses 20 health"""
+    __slots__ = ('obj', 'amount', 'prop', 'slot')
+
+    def __init__(self, obj, amount, prop, line=0):
+        super().__init__(line)
+        self.obj = obj
+        self.amount = amount
+        self.prop = prop
+        self.slot = slot_name(prop)
+
+
+class Gains(Statement):
+    """the hero gains 10 health"""
+    __slots__ = ('obj', 'amount', 'prop', 'slot')
+
+    def __init__(self, obj, amount, prop, line=0):
+        super().__init__(line)
+        self.obj = obj
+        self.amount = amount
+        self.prop = prop
+        self.slot = slot_name(prop)
+
+
+class GainsFrom(Statement):
+    """the hero gains dragon treasure gold"""
+    __slots__ = ('obj', 'source', 'source_prop', 'prop', 'source_slot', 'slot')
+
+    def __init__(self, obj, source, source_prop, prop, line=0):
+        super().__init__(line)
+        self.obj = obj
+        self.source = source
+        self.source_prop = source_prop
+        self.prop = prop
+        self.source_slot = slot_name(source_prop)
+        self.slot = slot_name(prop)
+
+
+class Question(Statement):
+    """is x greater than 5? with yes: / no: branches"""
+    __slots__ = ('condition', 'yes_body', 'no_body')
+
+    def __init__(self, condition, yes_body, no_body, line=0):
+        super().__init__(line)
+        self.condition = condition
+        self.yes_body = yes_body
+        self.no_body = no_body
+
+
+class When(Statement):
+    """when / or when / otherwise group"""
+    __slots__ = ('branches',)
+
+    def __init__(self, branches, line=0):
+        super().__init__(line)
+        self.branches = branches  # list of (condition or None, body)
+
+
+class FunctionDef(Statement):
+    """define name with a, b:  (define remembered name ... caches results)"""
+    __slots__ = ('name', 'params', 'body', 'remembered')
+
+    def __init__(self, name, params, body, line=0, remembered=False):
+        super().__init__(line)
+        self.name = name
+        self.params = params
+        self.body = body
+        self.remembered = remembered
+
+
+class Call(Statement):
+    """call name with 1, 2"""
+    __slots__ = ('name', 'args')
+
+    def __init__(self, name, args, line=0):
+        super().__init__(line)
+        self.name = name
+        self.args = args
+
+
+class Return(Statement):
+    """give back value"""
+    __slots__ = ('expr',)
+
+    def __init__(self, expr, line=0):
+        super().__init__(line)
+        self.expr = expr
+
+
+class Attempt(Statement):
+    """attempt: / handle:"""
+    __slots__ = ('body', 'handler')
+
+    def __init__(self, body, handler, line=0):
+        super().__init__(line)
+        self.body = body
+        self.handler = handler
+
+
+class Increase(Statement):
+    """increase x by 1"""
+    __slots__ = ('name', 'expr')
+
+    def __init__(self, name, expr, line=0):
+        super().__init__(line)
+        self.name = name
+        self.expr = expr
+
+
+class Decrease(Statement):
+    """decrease x by 1"""
+    __slots__ = ('name', 'expr')
+
+    def __init__(self, name, expr, line=0):
+        super().__init__(line)
+        self.name = name
+        self.expr = expr
+
+
+class Ask(Statement):
+    """ask "prompt" into x"""
+    __slots__ = ('prompt', 'name')
+
+    def __init__(self, prompt, name, line=0):
+        super().__init__(line)
+        self.prompt = prompt
+        self.name = name
+
+
+class Output(Statement):
+    """whisper / show / tell me / just say / just tell / announce"""
+    __slots__ = ('expr', 'newline')
+
+    def __init__(self, expr, newline=True, line=0):
+        super().__init__(line)
+        self.expr = expr
+        self.newline = newline
+
+
+class Write(Statement):
+    """write content to "file" """
+    __slots__ = ('content', 'filename')
+
+    def __init__(self, content, filename, line=0):
+        super().__init__(line)
+        self.content = content
+        self.filename = filename
+
+
+class Read(Statement):
+    """read "file" into x"""
+    __slots__ = ('filename', 'name')
+
+    def __init__(self, filename, name, line=0):
+        super().__init__(line)
+        self.filename = filename
+        self.name = name
+
+
+class ChangeCase(Statement):
+    """uppercase text into x / lowercase text into x"""
+    __slots__ = ('expr', 'name', 'upper')
+
+    def __init__(self, expr, name, upper, line=0):
+        super().__init__(line)
+        self.expr = expr
+        self.name = name
+        self.upper = upper
+
+
+class While(Statement):
+    """while condition:"""
+    __slots__ = ('condition', 'body')
+
+    def __init__(self, condition, body, line=0):
+        super().__init__(line)
+        self.condition = condition
+        self.body = body
+
+
+class ForEach(Statement):
+    """for each item in list:  /  for each item in list where condition:"""
+    __slots__ = ('var', 'expr', 'body', 'condition')
+
+    def __init__(self, var, expr, body, line=0, condition=None):
+        super().__init__(line)
+        self.var = var
+        self.expr = expr
+        self.body = body
+        self.condition = condition
+
+
+class ForEachLine(Statement):
+    """for each line in file "data.txt":  (optionally ... where condition:)"""
+    __slots__ = ('var', 'filename', 'body', 'condition')
+
+    def __init__(self, var, filename, body, line=0, condition=None):
+        super().__init__(line)
+        self.var = var
+        self.filename = filename
+        self.body = body
+        self.condition = condition
+
+
+class ForRange(Statement):
+    """for each i from 1 to 10:  /  for each i from 10 to 0 step -2:"""
+    __slots__ = ('var', 'start', 'stop', 'step', 'body')
+
+    def __init__(self, var, start, stop, step, body, line=0):
+        super().__init__(line)
+        self.var = var
+        self.start = start
+        self.stop = stop
+        self.step = step  # None: count up or down towards stop
+        self.body = body
+
+
+class Repeat(Statement):
+    """do N times: / repeat N:"""
+    __slots__ = ('count', 'body')
+
+    def __init__(self, count, body, line=0):
+        super().__init__(line)
+        self.count = count
+        self.body = body
+
+
+class AddItem(Statement):
+    """add item to list"""
+    __slots__ = ('item', 'name')
+
+    def __init__(self, item, name, line=0):
+        super().__init__(line)
+        self.item = item
+        self.name = name
+
+
+class RemoveItem(Statement):
+    """remove item from list"""
+    __slots__ = ('item', 'name')
+
+    def __init__(self, item, name, line=0):
+        super().__init__(line)
+        self.item = item
+        self.name = name
+
+
+class Append(Statement):
+    """append "text" to report"""
+    __slots__ = ('item', 'name')
+
+    def __init__(self, item, name, line=0):
+        super().__init__(line)
+        self.item = item
+        self.name = name
+
+
+class SortList(Statement):
+    """sort list  /  sort list descending"""
+    __slots__ = ('name', 'descending')
+
+    def __init__(self, name, descending=False, line=0):
+        super().__init__(line)
+        self.name = name
+        self.descending = descending
+
+
+class Keep(Statement):
+    """keep item in list where condition"""
+    __slots__ = ('var', 'name', 'condition')
+
+    def __init__(self, var, name, condition, line=0):
+        super().__init__(line)
+        self.var = var
+        self.name = name
+        self.condition = condition
+
+
+class Scope(Statement):
+    """A block whose hidden variables are forgotten however it is left
+    (the optimizer wraps a loop whose invariants it hoisted in one)."""
+    __slots__ = ('names', 'body')
+
+    def __init__(self, names, body, line=0):
+        super().__init__(line)
+        self.names = names
+        self.body = body
+
+
+class Unknown(Statement):
+    """A line that matched no command."""
+    __slots__ = ('text',)
+
+    def __init__(self, text, line=0):
+        super().__init__(line)
+        self.text = text
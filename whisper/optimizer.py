@@ -0,0 +1,465 @@
+"""
+Optimizer for parsed Whisper programs: `whisper --optimize`.
+
+optimize() rewrites a Program's statement tree with up to three passes,
+each of which can be switched on by itself:
+
+    fold    constant expressions are computed once, when the program is
+            loaded: `let max be 10 * 10` stores 100
+    prune   when / or when / otherwise branches and yes: / no: answers
+            that can never run are removed, as are loops that never start
+            and statements after break, continue or give back
+    hoist   sub-expressions of a loop that do not change while it runs
+            (`limit * 2` in `while i < limit * 2:`) are computed on first
+            use and then read back for the rest of the loop
+
+The optimized program prints exactly what the original does. Folding
+only keeps results that were computed without an error, and a hoisted
+value is worked out the first time the loop needs it, so an error in it
+still happens at the same place. Hoisting is only done in loops that
+call no functions or methods (`queue.pop(0)`, `items.append(1)`) and
+change no list, text or story object in place, and only numbers, text,
+True/False and None are kept.
+"""
+
+import copy
+
+from . import expressions as ex
+from . import nodes
+from .expressions import Expression
+from .interpreter import Program
+from .runtime import SCALARS, remember
+
+PASSES = ('fold', 'prune', 'hoist')
+
+# Statement fields holding an Expression (or None) and a statement list
+EXPRESSION_FIELDS = {
+    nodes.Assign: ('expr',), nodes.Loses: ('amount',), nodes.Gains: ('amount',),
+    nodes.Question: ('condition',), nodes.Return: ('expr',), nodes.Increase: ('expr',),
+    nodes.Decrease: ('expr',), nodes.Output: ('expr',), nodes.Write: ('content', 'filename'),
+    nodes.Read: ('filename',), nodes.ChangeCase: ('expr',), nodes.While: ('condition',),
+    nodes.ForEach: ('expr', 'condition'), nodes.ForEachLine: ('filename', 'condition'),
+    nodes.ForRange: ('start', 'stop', 'step'), nodes.Repeat: ('count',),
+    nodes.AddItem: ('item',), nodes.RemoveItem: ('item',), nodes.Append: ('item',),
+    nodes.Keep: ('condition',),
+}
+BODY_FIELDS = {
+    nodes.Question: ('yes_body', 'no_body'), nodes.FunctionDef: ('body',),
+    nodes.Attempt: ('body', 'handler'), nodes.While: ('body',), nodes.ForEach: ('body',),
+    nodes.ForEachLine: ('body',), nodes.ForRange: ('body',), nodes.Repeat: ('body',),
+    nodes.Scope: ('body',),
+}
+LOOPS = (nodes.While, nodes.Repeat, nodes.ForEach, nodes.ForEachLine, nodes.ForRange)
+
+MAX_FOLDED_TEXT = 4096
+
+
+def optimize(program, passes=PASSES):
+    """Return an optimized copy of a Program, running the named passes."""
+    unknown = set(passes) - set(PASSES)
+    if unknown:
+        raise ValueError(f"Unknown optimizer pass '{sorted(unknown)[0]}' (choose from {', '.join(PASSES)})")
+    statements = program.statements
+    if 'fold' in passes:
+        statements = fold(statements)
+    if 'prune' in passes:
+        statements = prune(statements)
+    if 'hoist' in passes:
+        statements = Hoister().block(statements)
+    return Program(program.source, statements)
+
+
+def passes_option(arg):
+    """The passes named by --optimize (all of them) or --optimize=fold,hoist."""
+    if arg == '--optimize':
+        return PASSES
+    passes = tuple(name.strip() for name in arg.split('=', 1)[1].split(',') if name.strip())
+    for name in passes:
+        if name not in PASSES:
+            raise ValueError(f"Unknown optimizer pass '{name}' (choose from {', '.join(PASSES)})")
+    return passes
+
+
+def rebuild(stmt, expr, body):
+    """Copy a statement, passing its expressions through expr and its blocks through body."""
+    new = copy.copy(stmt)
+    for field in EXPRESSION_FIELDS.get(type(stmt), ()):
+        value = getattr(stmt, field)
+        if value is not None:
+            setattr(new, field, expr(value))
+    for field in BODY_FIELDS.get(type(stmt), ()):
+        value = getattr(stmt, field)
+        if value:
+            setattr(new, field, body(value))
+    if isinstance(stmt, nodes.When):
+        new.branches = [(expr(cond) if cond is not None else None, body(block))
+                        for cond, block in stmt.branches]
+    elif isinstance(stmt, nodes.StoryObject):
+        new.props = [(slot, expr(value)) for slot, value in stmt.props]
+    elif isinstance(stmt, nodes.Call):
+        new.args = [expr(arg) for arg in stmt.args]
+    return new
+
+
+def replace_tree(expression, tree):
+    """An Expression with the same source text and a new syntax tree."""
+    if tree is expression.tree:
+        return expression
+    return Expression(expression.source, tree, tree.compile())
+
+
+def map_children(node, func):
+    """Copy an expression node with func applied to its child nodes (node itself if none change)."""
+    def apply(value):
+        if isinstance(value, ex.Node):
+            return func(value)
+        if isinstance(value, (list, tuple)):
+            items = [apply(item) for item in value]
+            if all(new is old for new, old in zip(items, value)):
+                return value
+            return items if isinstance(value, list) else tuple(items)
+        return value
+
+    values = {field: apply(getattr(node, field)) for field in node.__slots__}
+    if all(values[field] is getattr(node, field) for field in node.__slots__):
+        return node
+    new_node = copy.copy(node)
+    for field, value in values.items():
+        setattr(new_node, field, value)
+    return new_node
+
+
+def child_nodes(node):
+    """The expression nodes directly inside node."""
+    children = []
+
+    def collect(value):
+        if isinstance(value, ex.Node):
+            children.append(value)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                collect(item)
+    for field in node.__slots__:
+        collect(getattr(node, field))
+    return children
+
+
+# ======== Constant folding ========
+
+def fold(statements):
+    return [rebuild(stmt, fold_expression, fold) for stmt in statements]
+
+
+def fold_expression(expression):
+    if expression.tree is None:
+        return expression
+    return replace_tree(expression, fold_node(expression.tree))
+
+
+FOLDABLE = (ex.Unary, ex.Binary, ex.Additive, ex.Compare, ex.Subscript)
+
+
+def fold_node(node):
+    node = map_children(node, fold_node)
+    if isinstance(node, ex.BoolOp):
+        return fold_bool(node)
+    if isinstance(node, ex.IfExp) and isinstance(node.test, ex.Const):
+        return node.body if node.test.value else node.orelse
+    if not isinstance(node, FOLDABLE) or too_big(node):
+        return node
+    if not all(isinstance(child, ex.Const) for child in child_nodes(node)):
+        return node
+    try:
+        value = node.compile()({})
+    except Exception:
+        # left for the program to raise, if the line ever runs
+        return node
+    if type(value) not in SCALARS or (isinstance(value, str) and len(value) > MAX_FOLDED_TEXT):
+        return node
+    return ex.Const(value)
+
+
+def too_big(node):
+    """True if computing a constant operation could take much time or memory."""
+    if not isinstance(node, ex.Binary):
+        return False
+    left, right = node.left, node.right
+    if not (isinstance(left, ex.Const) and isinstance(right, ex.Const)):
+        return False
+    a, b = left.value, right.value
+    if node.op in ('**', '<<') and isinstance(b, int) and abs(b) > 64:
+        return not (node.op == '**' and a in (0, 1, -1))
+    if node.op == '*':
+        for text, count in ((a, b), (b, a)):
+            if isinstance(text, str) and isinstance(count, int) and len(text) * count > MAX_FOLDED_TEXT:
+                return True
+    return False
+
+
+def fold_bool(node):
+    """Drop constant operands of and / or that cannot decide the result."""
+    values = []
+    for index, value in enumerate(node.values):
+        last = index == len(node.values) - 1
+        if isinstance(value, ex.Const):
+            decides = not value.value if node.op == 'and' else bool(value.value)
+            if decides:
+                # the result is this value whenever evaluation reaches it
+                values.append(value)
+                break
+            if not last:
+                continue
+        values.append(value)
+    if len(values) == 1:
+        return values[0]
+    if len(values) == len(node.values):
+        return node
+    return ex.BoolOp(node.op, values)
+
+
+# ======== Dead branch elimination ========
+
+def constant(expression):
+    """(True, value) if an expression is a constant, else (False, None)."""
+    if expression is not None and isinstance(expression.tree, ex.Const):
+        return True, expression.tree.value
+    return False, None
+
+
+def prune(statements):
+    result = []
+    for stmt in statements:
+        stmt = rebuild(stmt, lambda expression: expression, prune)
+        result += prune_statement(stmt)
+        if isinstance(stmt, (nodes.Break, nodes.Continue, nodes.Return)):
+            # nothing after these in the same block can run
+            break
+    return result
+
+
+def prune_statement(stmt):
+    """Return the statements that replace stmt."""
+    if isinstance(stmt, nodes.When):
+        branches = []
+        for cond, body in stmt.branches:
+            known, value = constant(cond)
+            if known and not value:
+                continue
+            branches.append((cond, body))
+            if cond is None or known:
+                break
+        if not branches:
+            return []
+        if branches[0][0] is None:
+            # only otherwise is left: it runs as a plain block
+            return branches[0][1]
+        stmt.branches = branches
+        return [stmt]
+    if isinstance(stmt, nodes.Question):
+        known, value = constant(stmt.condition)
+        if known and value:
+            stmt.no_body = None
+        elif known:
+            if not stmt.no_body:
+                return []
+            stmt.yes_body = []
+        return [stmt]
+    if isinstance(stmt, nodes.While):
+        known, value = constant(stmt.condition)
+        return [] if known and not value else [stmt]
+    if isinstance(stmt, nodes.Repeat):
+        known, value = constant(stmt.count)
+        try:
+            never = known and int(value) <= 0
+        except (TypeError, ValueError):
+            never = False
+        return [] if never else [stmt]
+    return [stmt]
+
+
+# ======== Loop-invariant hoisting ========
+
+class Invariant(ex.Node):
+    """A loop-invariant expression, kept in a hidden variable once computed.
+
+    The loop runs in a Scope that clears the variable when it starts and
+    however it ends (break, give back, an error), so the value is worked
+    out afresh on each run of the loop, the first time it is needed, and
+    never stays in the program's variables.
+    """
+    __slots__ = ('key', 'value')
+
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+    def compile(self):
+        key = self.key
+        value = self.value.compile()
+
+        def load(v):
+            if key in v:
+                return v[key]
+            return remember(v, key, value(v))
+        return load
+
+
+# Statements that change values in place or can change any variable
+IMPURE = (nodes.Call, nodes.AddItem, nodes.RemoveItem, nodes.Append, nodes.SortList,
+          nodes.Keep, nodes.Loses, nodes.Gains, nodes.GainsFrom)
+# Builtins without side effects that give the same result for the same arguments
+PURE_FUNCTIONS = {'sqrt', 'abs', 'round', 'floor', 'ceil', 'pow', 'len', 'str'}
+PURE_NODES = (ex.Const, ex.Name, ex.Property, ex.NameSeq, ex.Unary, ex.Binary, ex.Additive,
+              ex.Compare, ex.BoolOp, ex.IfExp, ex.Subscript, ex.Slice, ex.TupleExpr)
+ASSIGNING = (nodes.Assign, nodes.Forget, nodes.StoryObject, nodes.Increase, nodes.Decrease,
+             nodes.Ask, nodes.Read, nodes.ChangeCase)
+
+
+def walk(statements):
+    """Yield every statement of a block and of the blocks nested in it
+    (function bodies are not part of the block)."""
+    for stmt in statements:
+        yield stmt
+        if isinstance(stmt, nodes.FunctionDef):
+            continue
+        if isinstance(stmt, nodes.When):
+            for cond, body in stmt.branches:
+                yield from walk(body)
+        for field in BODY_FIELDS.get(type(stmt), ()):
+            yield from walk(getattr(stmt, field) or [])
+
+
+def expressions_of(stmt):
+    """The Expressions a statement evaluates itself (not those of its blocks)."""
+    found = [getattr(stmt, field) for field in EXPRESSION_FIELDS.get(type(stmt), ())]
+    if isinstance(stmt, nodes.When):
+        found += [cond for cond, body in stmt.branches]
+    elif isinstance(stmt, nodes.StoryObject):
+        found += [value for slot, value in stmt.props]
+    elif isinstance(stmt, nodes.Call):
+        found += stmt.args
+    return [expression for expression in found if expression is not None]
+
+
+def calls_out(node):
+    """True if an expression calls anything but a pure builtin (a method such
+    as queue.pop(0) can change a list in place)."""
+    if isinstance(node, ex.Call):
+        if not isinstance(node.func, ex.Name) or node.func.name not in PURE_FUNCTIONS:
+            return True
+    return any(calls_out(child) for child in child_nodes(node))
+
+
+def assigned_names(loop):
+    """Names a loop can change, or None if it may change anything."""
+    names = set()
+    if isinstance(loop, (nodes.ForEach, nodes.ForEachLine, nodes.ForRange)):
+        names.add(loop.var)
+    for stmt in [loop] + list(walk(loop.body)):
+        if isinstance(stmt, IMPURE):
+            return None
+        for expression in expressions_of(stmt):
+            if expression.tree is not None and calls_out(expression.tree):
+                return None
+        if isinstance(stmt, ASSIGNING):
+            names.add(stmt.name)
+        elif isinstance(stmt, (nodes.ForEach, nodes.ForEachLine, nodes.ForRange)):
+            names.add(stmt.var)
+        elif isinstance(stmt, nodes.Attempt) and stmt.handler:
+            names.add('error')
+    return names
+
+
+def free_names(node):
+    """Every variable name an expression might read, or None if it is not pure."""
+    if isinstance(node, Invariant):
+        return None
+    if isinstance(node, ex.Call):
+        if not isinstance(node.func, ex.Name) or node.func.name not in PURE_FUNCTIONS or node.kwargs:
+            return None
+        names = {node.func.name}
+        children = node.args
+    elif not isinstance(node, PURE_NODES):
+        return None
+    else:
+        names = set()
+        children = child_nodes(node)
+        if isinstance(node, ex.Name):
+            names.add(node.name)
+        elif isinstance(node, ex.Property):
+            names |= {node.obj, f"{node.obj} {node.prop}"}
+        elif isinstance(node, ex.NameSeq):
+            parts = node.parts
+            names |= {' '.join(parts[:k]) for k in range(1, len(parts) + 1)}
+    for child in children:
+        child_names = free_names(child)
+        if child_names is None:
+            return None
+        names |= child_names
+    return names
+
+
+LEAVES = (ex.Const, ex.Name, ex.Property, ex.NameSeq)
+
+
+class Hoister:
+    """Replaces loop-invariant sub-expressions with Invariant nodes."""
+
+    def __init__(self):
+        self.count = 0
+
+    def block(self, statements):
+        result = []
+        for stmt in statements:
+            if isinstance(stmt, LOOPS):
+                result += self.loop(stmt)
+            else:
+                result.append(rebuild(stmt, lambda expression: expression, self.block))
+        return result
+
+    def loop(self, loop):
+        changed = assigned_names(loop)
+        keys = []
+        if changed is not None:
+            def hoist(node):
+                if isinstance(node, Invariant):
+                    return node
+                if not isinstance(node, LEAVES):
+                    names = free_names(node)
+                    if names is not None and not names & changed:
+                        self.count += 1
+                        key = f"__invariant_{self.count}__"
+                        keys.append(key)
+                        return Invariant(key, node)
+                return map_children(node, hoist)
+
+            def expression(value):
+                if value.tree is None:
+                    return value
+                return replace_tree(value, hoist(value.tree))
+
+            # everything the loop evaluates on every pass; the values it
+            # reads once when it starts are left alone
+            if isinstance(loop, nodes.While):
+                loop = rebuild(loop, expression, lambda body: body)
+            elif isinstance(loop, (nodes.ForEach, nodes.ForEachLine)) and loop.condition is not None:
+                loop = copy.copy(loop)
+                loop.condition = expression(loop.condition)
+            loop = copy.copy(loop)
+            loop.body = self.rewrite(loop.body, expression)
+        # loops nested in this one, for what only they keep unchanged
+        loop = copy.copy(loop)
+        loop.body = self.block(loop.body)
+        if not keys:
+            return [loop]
+        return [nodes.Scope(tuple(keys), [loop], loop.line)]
+
+    def rewrite(self, statements, expression):
+        """Apply expression to everything a block evaluates (function bodies aside)."""
+        result = []
+        for stmt in statements:
+            if isinstance(stmt, nodes.FunctionDef):
+                result.append(stmt)
+            else:
+                result.append(rebuild(stmt, expression, lambda body: self.rewrite(body, expression)))
+        return result
@@ -0,0 +1,69 @@
+"""
+Output sinks for Whisper programs.
+
+Everything a program shows (whisper, show, tell me, announce, error
+messages) goes through a sink instead of print(). The default sink buffers
+text and writes it to stdout in large chunks; it is flushed before ask
+reads input and when the program ends or fails. Hosts that run many
+programs can pass a CaptureSink (or any object with write and flush) to
+collect the output in memory.
+"""
+
+import sys
+
+BUFFER_SIZE = 8192
+
+
+class OutputSink:
+    """Buffer program output and write it to a stream in chunks.
+
+    buffer_size is the number of characters kept before writing; 0 writes
+    every piece immediately. By default output to a terminal is not
+    buffered, so interactive programs still show progress as they run.
+    """
+
+    def __init__(self, stream=None, buffer_size=None):
+        self.stream = stream if stream is not None else sys.stdout
+        if buffer_size is None:
+            isatty = getattr(self.stream, 'isatty', None)
+            buffer_size = 0 if isatty is not None and isatty() else BUFFER_SIZE
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        """Add text to the output."""
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write any buffered text to the stream."""
+        if self.parts:
+            self.stream.write(''.join(self.parts))
+            self.parts = []
+            self.size = 0
+        self.stream.flush()
+
+
+class CaptureSink:
+    """Keep all output in memory; getvalue() returns it as one string."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        """Add text to the output."""
+        self.parts.append(text)
+
+    def flush(self):
+        """Nothing to do: captured output stays in memory."""
+
+    def getvalue(self):
+        """Return everything written so far."""
+        return ''.join(self.parts)
+
+    def clear(self):
+        """Forget the captured output."""
+        self.parts = []
@@ -0,0 +1,505 @@
+"""
+Whisper front-end: turns source text into a tree of statement nodes.
+
+Each line is lexed once by the shared tokenizer (which also drops inline
+comments) and matched against the command table exactly once; the token
+slices that hold expressions are handed straight to the expression parser.
+Block structure (loop bodies, function bodies, when/otherwise and yes/no
+branches, attempt/handle) is resolved here, so the interpreter never has to
+look at raw text while running.
+"""
+
+from . import nodes
+from .expressions import compile_condition, compile_expression
+from .tokenizer import tokenize
+
+BREAK_WORDS = ("break", "end while", "end loop", "end for", "stop")
+CONTINUE_WORDS = ("continue", "resume while", "resume loop", "resume for", "next", "skip")
+
+# Commands that may follow a conversational "hey whisper," prefix
+CONVERSATIONAL_COMMANDS = [
+    ("remember", "that"), ("let",), ("set",), ("so",), ("whisper",), ("show",),
+    ("tell", "me"), ("ask",), ("when",), ("if",), ("while",), ("do",), ("repeat",),
+    ("for", "each"), ("call",), ("define",), ("make",), ("add",), ("remove",),
+    ("append",), ("sort",), ("keep",),
+    ("write",), ("read",), ("uppercase",), ("lowercase",), ("there", "is"),
+    ("the",), ("is",), ("are",), ("forget", "about"),
+]
+
+
+def indent_level(line):
+    """Return the indentation level of a line."""
+    return len(line) - len(line.lstrip('\t '))
+
+
+def starts_with(tokens, *words):
+    """Return True if tokens begin with the given words or symbols."""
+    if len(tokens) < len(words):
+        return False
+    for token, word in zip(tokens, words):
+        if token.text != word or token.kind not in ('name', 'op'):
+            return False
+    return True
+
+
+def ends_with(tokens, symbol):
+    """Return True if the last token is the given symbol."""
+    return bool(tokens) and tokens[-1].is_op(symbol)
+
+
+def find_word(tokens, word, start=0):
+    """Return the index of the first token that is word, or -1."""
+    for idx in range(start, len(tokens)):
+        if tokens[idx].is_word(word):
+            return idx
+    return -1
+
+
+def split_commas(tokens):
+    """Split tokens on commas that are not inside brackets."""
+    groups = [[]]
+    depth = 0
+    for token in tokens:
+        if token.kind == 'op':
+            if token.value in '([{':
+                depth += 1
+            elif token.value in ')]}':
+                depth -= 1
+            elif token.value == ',' and depth == 0:
+                groups.append([])
+                continue
+        groups[-1].append(token)
+    return groups
+
+
+class Parser:
+    """Parse a list of source lines into statement nodes."""
+
+    def __init__(self, lines):
+        self.lines = [raw.rstrip("\r\n") for raw in lines]
+        # indent of every line, or None for blank lines
+        self.indents = []
+        # tokens of every line without the end token ([] for comment-only lines)
+        self.tokens = []
+        # command text of every line with comments removed ("" for comment-only lines)
+        self.texts = []
+        for line in self.lines:
+            if not line.strip():
+                self.indents.append(None)
+                self.tokens.append([])
+                self.texts.append("")
+                continue
+            self.indents.append(indent_level(line))
+            tokens = tokenize(line)[:-1]
+            self.tokens.append(tokens)
+            self.texts.append(line[tokens[0].pos:tokens[-1].end] if tokens else "")
+        self.index_blocks()
+
+    def parse(self):
+        """Parse the whole program."""
+        return self.parse_block(0, len(self.lines))
+
+    def index_blocks(self):
+        """Record where the block under every line ends, in one pass.
+
+        block_end[i] is the index of the next non-blank line indented no
+        deeper than line i (its next sibling or an outer line), or the
+        number of lines; lines i+1 .. block_end[i]-1 are its body.
+        """
+        count = len(self.lines)
+        self.block_end = [count] * count
+        open_lines = []
+        for i, indent in enumerate(self.indents):
+            if indent is None:
+                continue
+            while open_lines and self.indents[open_lines[-1]] >= indent:
+                self.block_end[open_lines.pop()] = i
+            open_lines.append(i)
+
+    def body_end(self, header, end):
+        """Return the index just past the body of the block opened at header."""
+        block_end = self.block_end[header]
+        return block_end if block_end < end else end
+
+    def parse_block(self, start, end):
+        """Parse lines[start:end] into a list of statements."""
+        statements = []
+        i = start
+        while i < end:
+            if not self.texts[i]:
+                i += 1
+                continue
+            stmt, i = self.parse_statement(i, end)
+            if stmt is not None:
+                statements.append(stmt)
+        return statements
+
+    def text(self, i, tokens, start=0, stop=None):
+        """Return the source text covered by tokens[start:stop] of line i."""
+        tokens = tokens[start:stop]
+        if not tokens:
+            return ""
+        return self.lines[i][tokens[0].pos:tokens[-1].end]
+
+    def expression(self, i, tokens, start=0, stop=None):
+        """Compile tokens[start:stop] of line i as an expression."""
+        part = tokens[start:stop]
+        return compile_expression(self.text(i, part), part, i + 1)
+
+    def condition(self, i, tokens, start=0, stop=None):
+        """Compile tokens[start:stop] of line i as a condition."""
+        part = tokens[start:stop]
+        return compile_condition(self.text(i, part), part, i + 1)
+
+    def parse_statement(self, i, end):
+        """Parse the statement starting at line i; return (node, next index)."""
+        stripped = self.texts[i]
+        t = self.tokens[i]
+        indent = self.indents[i]
+        line = i + 1
+        text = self.text
+        expression = self.expression
+
+        # Break and Continue
+        if stripped in BREAK_WORDS:
+            return nodes.Break(line), i + 1
+
+        if stripped in CONTINUE_WORDS:
+            return nodes.Continue(line), i + 1
+
+        # Conversational: hey whisper, remember that x is 5
+        if starts_with(t, "hey", "whisper", ",") or starts_with(t, "whisper", ","):
+            t = t[3:] if t[0].is_word("hey") else t[2:]
+            # Check if this is just a comment/statement, not a command
+            if not any(starts_with(t, *cmd) for cmd in CONVERSATIONAL_COMMANDS):
+                return None, i + 1
+            # Process the rest as a normal command
+            stripped = text(i, t)
+
+        n = len(t)
+
+        # Remember (variable assignment): remember that x is 5
+        if starts_with(t, "remember", "that"):
+            k = find_word(t, "is", 3)
+            if 0 < k < n - 1:
+                return nodes.Assign(text(i, t, 2, k), expression(i, t, k + 1), line), i + 1
+
+        # Forget (delete variable): forget about x
+        if starts_with(t, "forget", "about") and n > 2:
+            return nodes.Forget(text(i, t, 2), line), i + 1
+
+        # Story objects: there is a hero with health 100
+        if (starts_with(t, "there", "is", "a") or starts_with(t, "there", "is", "an")) and n > 3:
+            k = find_word(t, "with", 4)
+            if k < 0:
+                return None, i + 1
+            props = []
+            for prop in split_commas(t[k + 1:]):
+                if prop:
+                    props.append((prop[0].text, expression(i, prop, 1)))
+            return nodes.StoryObject(text(i, t, 3, k), props, line), i + 1
+
+        # Story action: the hero loses 20 health
+        if starts_with(t, "the"):
+            k = find_word(t, "loses", 2)
+            if 0 < k < n - 1:
+                if n - k > 2:
+                    return nodes.Loses(text(i, t, 1, k), expression(i, t, k + 1, -1), t[-1].text, line), i + 1
+                return nodes.Loses(text(i, t, 1, k), expression(i, t, k + 1), "value", line), i + 1
+
+        # Story action: the hero gains 10 health OR the hero gains dragon treasure gold
+        if starts_with(t, "the"):
+            k = find_word(t, "gains", 2)
+            if 0 < k < n - 1:
+                obj_name = text(i, t, 1, k)
+                rest = t[k + 1:]
+                if len(rest) == 3 and all(token.kind == 'name' for token in rest):
+                    # Format: "dragon treasure gold" -> gain dragon's treasure and add to gold
+                    return nodes.GainsFrom(obj_name, rest[0].text, rest[1].text, rest[2].text, line), i + 1
+                # Format: "10 health" -> regular gains
+                if len(rest) > 1:
+                    return nodes.Gains(obj_name, expression(i, rest, 0, -1), rest[-1].text, line), i + 1
+                return nodes.Gains(obj_name, expression(i, rest), "value", line), i + 1
+
+        # Question-based condition: is x greater than 5?
+        if (starts_with(t, "is") or starts_with(t, "are")) and ends_with(t, "?"):
+            stop = n - 1
+            while stop > 1 and t[stop - 1].is_op("?"):
+                stop -= 1
+            return self.parse_question(self.condition(i, t, 1, stop), i, end)
+
+        # Function definition
+        if starts_with(t, "define") and ends_with(t, ":") and n > 2:
+            # define remembered fib with n:  (but not a function named "remembered")
+            remembered = (starts_with(t, "define", "remembered") and n > 3
+                          and not t[2].is_word("with"))
+            first = 2 if remembered else 1
+            k = find_word(t, "with", first + 1)
+            if k > 0:
+                func_name = text(i, t, first, k)
+                params = [text(i, group) for group in split_commas(t[k + 1:-1])]
+            else:
+                func_name = text(i, t, first, -1)
+                params = []
+            nxt = self.body_end(i, end)
+            body = self.parse_block(i + 1, nxt)
+            return nodes.FunctionDef(func_name, params, body, line, remembered), nxt
+
+        # Function call
+        if starts_with(t, "call") and n > 1:
+            k = find_word(t, "with", 2)
+            if k > 0:
+                func_name = text(i, t, 1, k)
+                args = [expression(i, group) for group in split_commas(t[k + 1:])] if k < n - 1 else []
+            else:
+                func_name = text(i, t, 1)
+                args = []
+            return nodes.Call(func_name, args, line), i + 1
+
+        # Return statement
+        if starts_with(t, "give", "back") and n > 2:
+            return nodes.Return(expression(i, t, 2), line), i + 1
+
+        # Try-catch
+        if starts_with(t, "attempt", ":"):
+            next_i = self.body_end(i, end)
+            body = self.parse_block(i + 1, next_i)
+            handler = []
+            if next_i < end and starts_with(self.tokens[next_i], "handle", ":"):
+                handle_end = self.body_end(next_i, end)
+                handler = self.parse_block(next_i + 1, handle_end)
+                next_i = handle_end
+            return nodes.Attempt(body, handler, line), next_i
+
+        # Variable assignment: let x be 5
+        if starts_with(t, "let"):
+            k = find_word(t, "be", 2)
+            if 0 < k < n - 1:
+                return nodes.Assign(text(i, t, 1, k), expression(i, t, k + 1), line), i + 1
+
+        # Conversational: so x is 5
+        if starts_with(t, "so"):
+            k = find_word(t, "is", 2)
+            if 0 < k < n - 1:
+                return nodes.Assign(text(i, t, 1, k), expression(i, t, k + 1), line), i + 1
+
+        # Alternative assignment: set x to 5
+        if starts_with(t, "set"):
+            k = find_word(t, "to", 2)
+            if 0 < k < n - 1:
+                return nodes.Assign(text(i, t, 1, k), expression(i, t, k + 1), line), i + 1
+
+        # Increment
+        if starts_with(t, "increase"):
+            k = find_word(t, "by", 2)
+            if 0 < k < n - 1:
+                return nodes.Increase(text(i, t, 1, k), expression(i, t, k + 1), line), i + 1
+
+        # Decrement
+        if starts_with(t, "decrease"):
+            k = find_word(t, "by", 2)
+            if 0 < k < n - 1:
+                return nodes.Decrease(text(i, t, 1, k), expression(i, t, k + 1), line), i + 1
+
+        # User input
+        if starts_with(t, "ask"):
+            k = find_word(t, "into", 1)
+            if 0 < k < n - 1:
+                if k == 2 and t[1].kind == 'string':
+                    prompt = t[1].value
+                else:
+                    prompt = text(i, t, 1, k).strip('"').strip("'")
+                return nodes.Ask(prompt, text(i, t, k + 1), line), i + 1
+
+        # Output: whisper "text", show x, tell me x, just say x
+        if (starts_with(t, "whisper") or starts_with(t, "show")) and n > 1:
+            return nodes.Output(expression(i, t, 1), True, line), i + 1
+
+        if (starts_with(t, "tell", "me") or starts_with(t, "just", "say")
+                or starts_with(t, "just", "tell")) and n > 2:
+            return nodes.Output(expression(i, t, 2), True, line), i + 1
+
+        # Announce
+        if starts_with(t, "announce") and n > 1:
+            return nodes.Output(expression(i, t, 1), False, line), i + 1
+
+        # File operations
+        if starts_with(t, "write"):
+            k = find_word(t, "to", 1)
+            if k > 0:
+                return nodes.Write(expression(i, t, 1, k), expression(i, t, k + 1), line), i + 1
+
+        if starts_with(t, "read"):
+            k = find_word(t, "into", 1)
+            if k > 0:
+                return nodes.Read(expression(i, t, 1, k), text(i, t, k + 1), line), i + 1
+
+        # String operations
+        if starts_with(t, "uppercase") or starts_with(t, "lowercase"):
+            k = find_word(t, "into", 1)
+            if k > 0:
+                upper = t[0].value == "uppercase"
+                return nodes.ChangeCase(expression(i, t, 1, k), text(i, t, k + 1), upper, line), i + 1
+
+        # While loop
+        if starts_with(t, "while") and ends_with(t, ":") and n > 2:
+            condition = self.condition(i, t, 1, -1)
+            nxt = self.body_end(i, end)
+            return nodes.While(condition, self.parse_block(i + 1, nxt), line), nxt
+
+        # For-each loop
+        if starts_with(t, "for", "each") and ends_with(t, ":"):
+            k = find_word(t, "in", 3)
+            if 0 < k < n - 2:
+                nxt = self.body_end(i, end)
+                body = self.parse_block(i + 1, nxt)
+                stop = n - 1
+                condition = None
+                w = find_word(t, "where", k + 2)
+                if 0 < w < n - 2:
+                    condition = self.condition(i, t, w + 1, -1)
+                    stop = w
+                if t[k + 1].is_word("file") and k + 2 < stop:
+                    filename = expression(i, t, k + 2, stop)
+                    return nodes.ForEachLine(text(i, t, 2, k), filename, body, line, condition), nxt
+                return nodes.ForEach(text(i, t, 2, k), expression(i, t, k + 1, stop), body, line,
+                                     condition), nxt
+            # for each i from 1 to 10 [step 2]:
+            k = find_word(t, "from", 3)
+            to = find_word(t, "to", k + 2) if k > 0 else -1
+            if 0 < to < n - 2:
+                s = find_word(t, "step", to + 2)
+                stop = s if 0 < s < n - 2 else n - 1
+                step = expression(i, t, s + 1, -1) if stop == s else None
+                nxt = self.body_end(i, end)
+                return nodes.ForRange(text(i, t, 2, k), expression(i, t, k + 1, to),
+                                      expression(i, t, to + 1, stop), step,
+                                      self.parse_block(i + 1, nxt), line), nxt
+
+        # Loops
+        if starts_with(t, "do"):
+            k = find_word(t, "times", 2)
+            if k > 0 and k + 1 < n and t[k + 1].is_op(":"):
+                nxt = self.body_end(i, end)
+                return nodes.Repeat(expression(i, t, 1, k), self.parse_block(i + 1, nxt), line), nxt
+
+        if starts_with(t, "repeat") and ends_with(t, ":") and n > 2:
+            nxt = self.body_end(i, end)
+            return nodes.Repeat(expression(i, t, 1, -1), self.parse_block(i + 1, nxt), line), nxt
+
+        # List operations
+        if starts_with(t, "make"):
+            k = find_word(t, "with", 1)
+            if k > 0:
+                return nodes.Assign(text(i, t, 1, k), expression(i, t, k + 1), line), i + 1
+
+        if starts_with(t, "add"):
+            k = find_word(t, "to", 1)
+            if k > 0:
+                return nodes.AddItem(expression(i, t, 1, k), text(i, t, k + 1), line), i + 1
+
+        if starts_with(t, "remove"):
+            k = find_word(t, "from", 1)
+            if k > 0:
+                return nodes.RemoveItem(expression(i, t, 1, k), text(i, t, k + 1), line), i + 1
+
+        if starts_with(t, "append"):
+            k = find_word(t, "to", 1)
+            if k > 0:
+                return nodes.Append(expression(i, t, 1, k), text(i, t, k + 1), line), i + 1
+
+        if starts_with(t, "sort") and n > 1:
+            if n > 2 and t[-1].is_word("descending"):
+                return nodes.SortList(text(i, t, 1, -1), True, line), i + 1
+            return nodes.SortList(text(i, t, 1), False, line), i + 1
+
+        if starts_with(t, "keep") and n > 5:
+            k = find_word(t, "in", 2)
+            w = find_word(t, "where", k + 2) if k > 0 else -1
+            if w > 0 and w + 1 < n:
+                return nodes.Keep(text(i, t, 1, k), text(i, t, k + 1, w),
+                                  self.condition(i, t, w + 1, n), line), i + 1
+
+        # Conditionals
+        if starts_with(t, "when") and ends_with(t, ":"):
+            return self.parse_when(i, end)
+
+        # Unknown command
+        return nodes.Unknown(stripped, line), i + 1
+
+    def parse_when(self, start, end):
+        """Parse when/or when/otherwise group."""
+        base_indent = self.indents[start]
+        branches = []
+
+        def parse_branch(idx):
+            tokens = self.tokens[idx]
+            if starts_with(tokens, "when"):
+                start = 1
+            elif starts_with(tokens, "or", "when"):
+                start = 2
+            else:
+                start = len(tokens)
+            # a branch without a condition ("otherwise:", "when:") always runs
+            condition = self.condition(idx, tokens, start, -1) if len(tokens) - 1 > start else None
+            nxt = self.body_end(idx, end)
+            return condition, self.parse_block(idx + 1, nxt), nxt
+
+        cond, body, i = parse_branch(start)
+        branches.append((cond, body))
+
+        while i < end:
+            if self.indents[i] is None:
+                i += 1
+                continue
+            if self.indents[i] != base_indent:
+                break
+            tokens = self.tokens[i]
+            if starts_with(tokens, "or", "when") and ends_with(tokens, ":"):
+                cond, body, i = parse_branch(i)
+                branches.append((cond, body))
+            elif starts_with(tokens, "otherwise") and ends_with(tokens, ":"):
+                cond, body, i = parse_branch(i)
+                branches.append((cond, body))
+                break
+            else:
+                break
+
+        return nodes.When(branches, start + 1), i
+
+    def parse_question(self, condition, start, end):
+        """Parse is/are question format with yes/no branches."""
+        base_indent = self.indents[start]
+        yes_body = []
+        no_body = []
+        i = start + 1
+        while i < end:
+            current_indent = self.indents[i]
+            if current_indent is None:
+                i += 1
+                continue
+            if current_indent <= base_indent:
+                break
+            tokens = self.tokens[i]
+            if starts_with(tokens, "yes", ":"):
+                nxt = self.body_end(i, end)
+                yes_body = self.parse_block(i + 1, nxt)
+                i = nxt
+            elif starts_with(tokens, "no", ":"):
+                nxt = self.body_end(i, end)
+                no_body = self.parse_block(i + 1, nxt)
+                i = nxt
+            else:
+                i = self.body_end(i, end)
+
+        return nodes.Question(condition, yes_body, no_body, start + 1), i
+
+
+def parse_lines(lines):
+    """Parse a list of source lines into a list of statements."""
+    return Parser(lines).parse()
+
+
+def parse(code):
+    """Parse Whisper source code into a list of statements."""
+    return parse_lines(code.splitlines(keepends=True))
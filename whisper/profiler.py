@@ -0,0 +1,243 @@
+"""
+Line and function profiler for Whisper programs.
+
+Used by `whisper --profile script.wsp`. Profiling runs the program on a
+ProfilingMachine, a Machine whose dispatch loop times every step; the normal
+Machine has no timing hooks at all, so running without --profile costs
+nothing extra.
+
+For every source line the profile records:
+  hits   how many times the statement ran (a loop or when line counts once
+         per entry, not per iteration)
+  total  time from the statement starting until every block it opened
+         (loop body, branch, function call) finished
+  self   time spent in the statement itself: evaluating its expressions
+         and, for loops, their conditions
+For every user-defined function it records calls, total time inside the
+function and self time (excluding the functions it calls).
+"""
+
+import json
+import time
+
+from .interpreter import EXECUTORS, CallActivation, Interpreter, LimitExceeded, Machine
+from .parser import parse
+
+
+class Stats:
+    """Hit count and timings of one line or function."""
+    __slots__ = ('hits', 'total', 'self_time', 'open')
+
+    def __init__(self):
+        self.hits = 0
+        self.total = 0.0
+        self.self_time = 0.0
+        # blocks currently open for it, so recursion is counted once in total
+        self.open = 0
+
+    def as_dict(self):
+        return {"hits": self.hits, "total": self.total, "self": self.self_time}
+
+
+class Profile:
+    """Collected statistics for one program run."""
+
+    def __init__(self, source_lines):
+        self.source_lines = source_lines
+        self.lines = {}
+        self.functions = {}
+        self.elapsed = 0.0
+
+    def line(self, number):
+        stats = self.lines.get(number)
+        if stats is None:
+            stats = self.lines[number] = Stats()
+        return stats
+
+    def function(self, name):
+        stats = self.functions.get(name)
+        if stats is None:
+            stats = self.functions[name] = Stats()
+        return stats
+
+    def source(self, number):
+        if 0 < number <= len(self.source_lines):
+            return self.source_lines[number - 1].strip()
+        return ""
+
+    def sorted_lines(self):
+        return sorted(self.lines.items(), key=lambda item: (-item[1].total, item[0]))
+
+    def sorted_functions(self):
+        return sorted(self.functions.items(), key=lambda item: (-item[1].total, item[0]))
+
+    def report(self, limit=None):
+        """Return a text report of lines and functions, most expensive first."""
+        out = [f"Total time: {self.elapsed:.6f}s", "", "Lines:",
+               f"{'line':>6} {'hits':>10} {'total (s)':>12} {'self (s)':>12}  source"]
+        for number, stats in self.sorted_lines()[:limit]:
+            out.append(f"{number:>6} {stats.hits:>10} {stats.total:>12.6f} "
+                       f"{stats.self_time:>12.6f}  {self.source(number)}")
+        if self.functions:
+            out += ["", "Functions:",
+                    f"{'function':<20} {'calls':>10} {'total (s)':>12} {'self (s)':>12}"]
+            for name, stats in self.sorted_functions()[:limit]:
+                out.append(f"{name:<20} {stats.hits:>10} {stats.total:>12.6f} "
+                           f"{stats.self_time:>12.6f}")
+        return "\n".join(out)
+
+    def as_dict(self):
+        """Return the profile as JSON-serialisable data."""
+        lines = []
+        for number, stats in self.sorted_lines():
+            entry = {"line": number, "source": self.source(number)}
+            entry.update(stats.as_dict())
+            lines.append(entry)
+        funcs = []
+        for name, stats in self.sorted_functions():
+            entry = {"function": name}
+            entry.update(stats.as_dict())
+            funcs.append(entry)
+        return {"total": self.elapsed, "lines": lines, "functions": funcs}
+
+    def write_json(self, filename):
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+
+class ProfilingMachine(Machine):
+    """A Machine that times every step of its dispatch loop."""
+
+    def __init__(self, interpreter, variables, profile):
+        Machine.__init__(self, interpreter, variables)
+        self.profile = profile
+        # one (activation, line stats, function stats, start) entry per stack
+        # entry; the stats are None for blocks no statement opened
+        self.marks = []
+
+    def resume(self, base):
+        stack = self.stack
+        marks = self.marks
+        executors = EXECUTORS
+        profile = self.profile
+        clock = time.perf_counter
+        self.reconcile(None, clock())
+        outer, self.base = self.base, base
+        try:
+            while len(stack) > base:
+                top = stack[-1]
+                pos = top.pos
+                depth = len(stack)
+                stmt = None
+                start = clock()
+                try:
+                    if pos < len(top.body):
+                        stmt = top.body[pos]
+                        top.pos = pos + 1
+                        executors[stmt.__class__](stmt, self.frame, self)
+                    else:
+                        top.finish(self)
+                except LimitExceeded:
+                    self.count_failed(stmt, start)
+                    raise
+                except Exception as e:
+                    try:
+                        self.unwind_error(e, base)
+                    except Exception:
+                        self.count_failed(stmt, start)
+                        raise
+                now = clock()
+                elapsed = now - start
+
+                # self time: the statement, or the loop that was advancing
+                mark = marks[depth - 1] if depth <= len(marks) else None
+                if stmt is not None:
+                    stats = profile.line(stmt.line)
+                    stats.hits += 1
+                    stats.self_time += elapsed
+                elif mark is not None and mark[1] is not None:
+                    mark[1].self_time += elapsed
+                index = min(depth, len(marks)) - 1
+                while index >= 0:
+                    if marks[index][2] is not None:
+                        marks[index][2].self_time += elapsed
+                        break
+                    index -= 1
+
+                if not self.reconcile(stmt, start, now) and stmt is not None:
+                    stats = profile.line(stmt.line)
+                    if not stats.open:
+                        stats.total += elapsed
+        finally:
+            self.base = outer
+
+    def count_failed(self, stmt, start):
+        """Count a statement whose error ends the run (the stack is left as it was)."""
+        if stmt is not None:
+            elapsed = time.perf_counter() - start
+            stats = self.profile.line(stmt.line)
+            stats.hits += 1
+            stats.self_time += elapsed
+            if not stats.open:
+                stats.total += elapsed
+
+    def reconcile(self, stmt, start, now=None):
+        """Match marks to the stack after a step; return True if stmt opened a block."""
+        stack = self.stack
+        marks = self.marks
+        keep = min(len(marks), len(stack))
+        while keep and marks[keep - 1][0] is not stack[keep - 1]:
+            keep -= 1
+        while len(marks) > keep:
+            self.close(marks.pop(), now)
+        opened = False
+        for activation in stack[keep:]:
+            line_stats = func_stats = None
+            if stmt is not None:
+                line_stats = self.profile.line(stmt.line)
+                if isinstance(activation, CallActivation):
+                    func_stats = self.profile.function(stmt.name)
+                    func_stats.hits += 1
+                line_stats.open += 1
+                if func_stats is not None:
+                    func_stats.open += 1
+                opened = True
+            marks.append((activation, line_stats, func_stats, start))
+        return opened
+
+    def close(self, mark, now):
+        """Add the time a block was open to the line/function that opened it."""
+        activation, line_stats, func_stats, start = mark
+        for stats in (line_stats, func_stats):
+            if stats is None:
+                continue
+            stats.open -= 1
+            if stats.open == 0:
+                stats.total += now - start
+
+    def close_all(self, now):
+        while self.marks:
+            self.close(self.marks.pop(), now)
+
+
+def profile(code, output=None):
+    """Run Whisper code under the profiler and return its Profile.
+
+    Errors that stop the program are raised after the profile is complete;
+    the partial profile is attached to the exception as `profile`.
+    """
+    result = Profile(code.splitlines())
+    statements = parse(code)
+    interpreter = Interpreter(output)
+    machine = ProfilingMachine(interpreter, interpreter.variables, result)
+    start = time.perf_counter()
+    try:
+        machine.run(statements)
+    except Exception as e:
+        e.profile = result
+        raise
+    finally:
+        now = time.perf_counter()
+        machine.close_all(now)
+        result.elapsed = now - start
+    return result
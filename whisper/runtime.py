@@ -0,0 +1,448 @@
+"""
+Statement helpers shared by the interpreter and compiled Whisper programs.
+
+The interpreter's statement executors and the Python source compiler.py
+generates both call the helpers below to do a statement's work, so a
+compiled statement behaves exactly like the interpreted one: the same
+variable lookups, the same text joining, the same error messages. A
+compiled program imports the names in __all__.
+"""
+
+import sys
+import threading
+
+from .arrays import NumberArray, sort_in_place, store
+from .expressions import BUILTINS, TEXT, NameSeq, Property, get_item, join_text, undefined
+from .lazy import is_lazy, read_lines
+from .memo import MEMO_SIZE, Memo
+from .output import OutputSink
+from .story import StoryRecord, record_type
+from .text import TextBuilder, share
+
+# Default limit on nested function calls, so runaway recursion stops with an error
+MAX_DEPTH = 10000
+
+MISSING = object()
+
+# Values that are safe to compute once: immutable and small
+SCALARS = (int, float, str, bool, type(None))
+
+# The interpreter's own recursion limit, before any program raised it
+BASE_RECURSION_LIMIT = sys.getrecursionlimit()
+_recursion_lock = threading.Lock()
+
+
+class LimitExceeded(RuntimeError):
+    """A program ran past its step, time or recursion budget.
+
+    Unlike other errors this cannot be handled with attempt: or reported by
+    a when/while block; it always stops the program. limit names the
+    budget that ran out: "steps", "time" or "depth".
+    """
+
+    def __init__(self, message, limit):
+        RuntimeError.__init__(self, message)
+        self.limit = limit
+
+
+# ======== Call frames ========
+
+class Frame(dict):
+    """Variables of one function call.
+
+    Only parameters and names assigned inside the call live here; any other
+    name is looked up in the program's global variables.
+    """
+    __slots__ = ('globals',)
+
+    def __init__(self, globals_, params=(), args=()):
+        dict.__init__(self, zip(params, map(share, args)))
+        self.globals = globals_
+
+    def __missing__(self, name):
+        return self.globals[name]
+
+
+def allow_recursion(depth):
+    """Let Python recurse deep enough for depth nested compiled calls.
+
+    The limit is process-wide, so it is only ever raised, never put back:
+    lowering it could cut short a program running in another thread.
+    """
+    # Each Whisper call is two Python calls (call() and the function)
+    needed = BASE_RECURSION_LIMIT + 2 * depth
+    with _recursion_lock:
+        if sys.getrecursionlimit() < needed:
+            sys.setrecursionlimit(needed)
+
+
+def lookup(variables, name, default=None):
+    """Read a variable through the frame chain, or return default."""
+    try:
+        return variables[name]
+    except KeyError:
+        return default
+
+
+class BreakLoop(BaseException):
+    """break inside a function, leaving a loop of the code that called it."""
+
+
+class ContinueLoop(BaseException):
+    """continue inside a function, for a loop of the code that called it."""
+
+
+class Runtime:
+    """The state a compiled program runs with: output, functions, call depth.
+
+    loops counts the running loops that call functions; a break or continue
+    outside any loop of its own function is raised to the innermost of them.
+    """
+
+    def __init__(self, variables, output=None, max_depth=MAX_DEPTH, memo_size=MEMO_SIZE):
+        self.globals = variables
+        self.output = output if output is not None else OutputSink()
+        self.write = self.output.write
+        self.functions = {}
+        self.memos = {}
+        self.memo_size = memo_size
+        self.max_depth = max_depth
+        self.depth = 0
+        self.loops = 0
+
+    def run(self, main):
+        """Run a compiled program's main function, then flush the output."""
+        if self.max_depth is not None:
+            allow_recursion(self.max_depth)
+        try:
+            main(self, self.globals)
+        finally:
+            self.output.flush()
+
+    def define(self, name, params, body, remembered):
+        """define: register a compiled function."""
+        self.functions[name] = (params, body)
+        # A new definition never reuses results of the old one
+        if remembered:
+            self.memos[name] = Memo(self.memo_size)
+        else:
+            self.memos.pop(name, None)
+
+    def call(self, name, args, caller):
+        """call: run a function, storing what it gives back in __last_result__."""
+        functions = self.functions
+        if name not in functions:
+            raise RuntimeError(f"Function '{name}' not defined")
+        params, body = functions[name]
+        memo = self.memos.get(name)
+        key = None
+        if memo is not None:
+            key = memo.key(args)
+            if key is not None:
+                found, result = memo.lookup(key)
+                if found:
+                    if result is not None:
+                        caller['__last_result__'] = result
+                    return
+        if self.depth == self.max_depth:
+            raise LimitExceeded(f"Recursion depth limit of {self.max_depth} reached in '{name}'", "depth")
+        self.depth += 1
+        try:
+            result = body(self, Frame(self.globals, params, args))
+        finally:
+            self.depth -= 1
+        if key is not None:
+            memo.store(key, result)
+        if result is not None:
+            caller['__last_result__'] = share(result)
+
+    def escape(self, word):
+        """break / continue outside any loop of the running function."""
+        if not self.loops:
+            raise RuntimeError(f"'{word}' used outside of a loop")
+        raise BreakLoop() if word == "break" else ContinueLoop()
+
+
+# ======== Expressions ========
+
+def load(v, name):
+    """Read a variable, or a builtin of that name."""
+    try:
+        return v[name]
+    except KeyError:
+        return undefined(name)
+
+
+def function(v, name):
+    """The function a call by name uses: a callable variable, else a builtin."""
+    try:
+        value = v[name]
+    except KeyError:
+        return undefined(name)
+    if callable(value):
+        return value
+    if name in BUILTINS:
+        return BUILTINS[name]
+    raise TypeError(f"'{type(value).__name__}' object is not callable")
+
+
+def add(a, b):
+    """a + b, joining text with other values."""
+    try:
+        return a + b
+    except TypeError:
+        if isinstance(a, TEXT) or isinstance(b, TEXT):
+            return join_text([a, b], ('+',))
+        raise
+
+
+def subtract(a, b):
+    try:
+        return a - b
+    except TypeError:
+        if isinstance(a, TEXT) or isinstance(b, TEXT):
+            return join_text([a, b], ('-',))
+        raise
+
+
+def additive(values, ops):
+    """A chain of three or more + and - operands (see expressions.Additive)."""
+    result = values[0]
+    try:
+        for op, value in zip(ops, values[1:]):
+            result = result + value if op == '+' else result - value
+        return result
+    except TypeError:
+        if any(isinstance(value, TEXT) for value in values):
+            return join_text(values, ops)
+        raise
+
+
+def fail(message):
+    """Evaluate an expression that did not parse."""
+    raise SyntaxError(message)
+
+
+def remember(v, key, value):
+    """Keep a computed loop invariant (optimizer.py) if it is immutable, and return it."""
+    if type(value) in SCALARS:
+        v[key] = value
+    return value
+
+
+# ======== Statements ========
+
+def story_record(v, name):
+    """Return the story object called name, or None."""
+    try:
+        record = v[name]
+    except KeyError:
+        return None
+    return record if isinstance(record, StoryRecord) else None
+
+
+def whole_number(value, word):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if not isinstance(value, int):
+        raise RuntimeError(f"'for each ... {word}' needs a whole number, got {value!r}")
+    return value
+
+
+def items_of(value):
+    """What for each walks, one item at a time: a single value is a list of one."""
+    if (not isinstance(value, (str, list, tuple, range, NumberArray, TextBuilder))
+            and not is_lazy(value)):
+        return [value]
+    return value
+
+
+def count_range(start, stop, step):
+    """The numbers of for each i from start to stop [step step]."""
+    if step is None:
+        step = 1 if start <= stop else -1
+    else:
+        step = whole_number(step, "step")
+        if step == 0:
+            raise RuntimeError("'for each ... step' cannot be 0")
+    # to is inclusive
+    return range(start, stop + (1 if step > 0 else -1), step)
+
+
+def increase(v, name, amount):
+    try:
+        current = v[name]
+    except KeyError:
+        v[name] = amount
+    else:
+        v[name] = current + amount
+
+
+def decrease(v, name, amount):
+    try:
+        current = v[name]
+    except KeyError:
+        v[name] = -amount
+    else:
+        v[name] = current - amount
+
+
+def lose(v, obj, slot, amount):
+    record = story_record(v, obj)
+    if record is not None:
+        try:
+            value = getattr(record, slot)
+        except AttributeError:
+            return
+        setattr(record, slot, value - amount)
+
+
+def gain(v, obj, slot, amount):
+    record = story_record(v, obj)
+    if record is not None:
+        try:
+            value = getattr(record, slot)
+        except AttributeError:
+            return
+        setattr(record, slot, value + amount)
+
+
+def gain_from(v, obj, slot, source, source_slot):
+    source = story_record(v, source)
+    record = story_record(v, obj)
+    if source is not None and record is not None:
+        try:
+            amount = getattr(source, source_slot)
+            value = getattr(record, slot)
+        except AttributeError:
+            return
+        setattr(record, slot, value + amount)
+
+
+def ask(output, prompt):
+    """ask "prompt" into name: the answer, as a number when it reads as one."""
+    output.write(prompt + " ")
+    output.flush()
+    user_input = input()
+    try:
+        if '.' in user_input:
+            return float(user_input)
+        return int(user_input)
+    except ValueError:
+        return user_input
+
+
+def write_file(content, filename):
+    with open(str(filename), 'w', encoding='utf-8') as f:
+        # Text builders and lazy sequences are streamed, never joined in memory
+        if isinstance(content, TextBuilder):
+            content.write_to(f)
+        elif is_lazy(content):
+            for item in content:
+                f.write(f"{item}\n")
+        else:
+            f.write(str(content))
+
+
+def read_file(filename):
+    with open(str(filename), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def add_item(v, name, item):
+    share(item)
+    current = lookup(v, name, MISSING)
+    if current is MISSING:
+        v[name] = [item]
+    elif isinstance(current, (list, NumberArray)):
+        current.append(item)
+    else:
+        v[name] = [current, item]
+
+
+def remove_item(v, name, item):
+    current = lookup(v, name)
+    if isinstance(current, list):
+        try:
+            current.remove(item)
+        except ValueError:
+            pass
+    elif isinstance(current, NumberArray):
+        current.remove(item)
+
+
+def append_to(v, name, item):
+    builder = dict.get(v, name)
+    if type(builder) is TextBuilder and not builder.shared:
+        builder.append(item)
+        return
+    current = lookup(v, name, MISSING)
+    if isinstance(current, TextBuilder):
+        # shared with another variable or a list, or a global seen from a
+        # function: append to a copy
+        builder = current.copy()
+        builder.append(item)
+        v[name] = builder
+    elif isinstance(current, list):
+        current.append(share(item))
+    elif current is MISSING or isinstance(current, str):
+        builder = TextBuilder(current if current is not MISSING else "")
+        builder.append(item)
+        v[name] = builder
+    else:
+        raise RuntimeError(f"Cannot append to '{name}': it is not text or a list")
+
+
+def sort_list(v, name, descending):
+    items = lookup(v, name, MISSING)
+    if items is MISSING:
+        raise NameError(f"Variable '{name}' is not defined")
+    sort_in_place(items, descending)
+
+
+def keep(v, name, var, condition):
+    """keep var in name where condition; condition is called with a scope."""
+    items = lookup(v, name, MISSING)
+    if items is MISSING:
+        raise NameError(f"Variable '{name}' is not defined")
+    scope = Frame(v)
+    if isinstance(items, NumberArray):
+        # Try the condition on the whole array at once; conditions that
+        # cannot work that way (and/or, calls on single numbers) fall back
+        # to one element at a time
+        scope[var] = items
+        try:
+            mask = condition(scope)
+        except Exception:
+            mask = None
+        if isinstance(mask, NumberArray) and mask.is_mask and len(mask) == len(items):
+            items.values = items[mask].values
+            return
+    elif not isinstance(items, list):
+        raise RuntimeError(f"'{name}' is not a list")
+    kept = []
+    for item in items:
+        scope[var] = item
+        if condition(scope):
+            kept.append(item)
+    if isinstance(items, NumberArray):
+        items.values = store(kept, getattr(items.values, 'typecode', None))
+    else:
+        items[:] = kept
+
+
+def run_standalone(main):
+    """Run a compiled program saved as a .py file, printing errors like whisper does."""
+    try:
+        Runtime({}).run(main)
+    except Exception as e:
+        print(f"Error: {e}")
+
+
+__all__ = [
+    'BreakLoop', 'ContinueLoop', 'LimitExceeded', 'NameSeq', 'Property', 'Runtime',
+    'add', 'add_item', 'additive', 'append_to', 'ask', 'count_range', 'decrease', 'fail',
+    'function', 'gain', 'gain_from', 'get_item', 'increase', 'items_of', 'keep', 'load',
+    'lose', 'read_file', 'read_lines', 'record_type', 'remember', 'remove_item', 'run_standalone',
+    'share', 'sort_list', 'subtract', 'whole_number', 'write_file',
+]
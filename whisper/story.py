@@ -0,0 +1,114 @@
+"""
+Compact records for story objects.
+
+`there is a hero with health 100, power 50` creates a StoryRecord: an
+object of a small class whose __slots__ are the declared properties, so
+each object costs a fixed-size block of memory instead of a dict. Objects
+declared with the same property names share one class.
+
+Each property is stored in the slot slot_name(property), which depends
+only on the property name; statements such as `the hero loses 20 health`
+work out the slot when they are parsed and update it directly. Records
+read like dicts (hero["health"], show hero) so programs see no difference.
+"""
+
+from collections.abc import Mapping
+
+
+def slot_name(prop):
+    """Return the slot that stores a property, whatever characters it has."""
+    if prop.isidentifier():
+        return "p_" + prop
+    return "x_" + prop.encode("utf-8").hex()
+
+
+class StoryRecord:
+    """Base class of story object records; fields lists the property names.
+
+    Not derived from Mapping (isinstance checks against an ABC are slow on
+    the hot path) but registered as one below.
+    """
+    __slots__ = ()
+    __hash__ = None
+    fields = ()
+    slots = ()
+
+    def __getitem__(self, prop):
+        try:
+            return getattr(self, slot_name(prop))
+        except (AttributeError, TypeError):
+            raise KeyError(prop)
+
+    def __setitem__(self, prop, value):
+        try:
+            setattr(self, slot_name(prop), value)
+        except (AttributeError, TypeError):
+            raise KeyError(prop)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __contains__(self, prop):
+        return prop in self.fields
+
+    def get(self, prop, default=None):
+        try:
+            return self[prop]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self.fields)
+
+    def values(self):
+        return [getattr(self, slot) for slot in self.slots]
+
+    def items(self):
+        return list(zip(self.fields, self.values()))
+
+    def __eq__(self, other):
+        if isinstance(other, (StoryRecord, dict)):
+            return self.as_dict() == dict(other.items())
+        return NotImplemented
+
+    def as_dict(self):
+        return {prop: getattr(self, slot) for prop, slot in zip(self.fields, self.slots)}
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
+    __str__ = __repr__
+
+    def __reduce__(self):
+        return make_record, (list(self.items()),)
+
+
+Mapping.register(StoryRecord)
+
+# One record class per list of property names
+_record_types = {}
+
+
+def record_type(fields):
+    """Return the StoryRecord class for a tuple of property names."""
+    cls = _record_types.get(fields)
+    if cls is None:
+        slots = tuple(slot_name(prop) for prop in fields)
+        cls = type("StoryRecord", (StoryRecord,), {
+            "__slots__": slots, "fields": fields, "slots": slots,
+        })
+        cls = _record_types.setdefault(fields, cls)
+    return cls
+
+
+def make_record(props):
+    """Build a record from (property, value) pairs; a repeated property keeps its last value."""
+    values = dict(props)
+    cls = record_type(tuple(values))
+    record = cls()
+    for slot, value in zip(cls.slots, values.values()):
+        setattr(record, slot, value)
+    return record
@@ -0,0 +1,107 @@
+"""
+Text builders: `append "..." to report`.
+
+Adding to a string copies it, so growing a report line by line with
+`let report be report + line` takes time proportional to the square of its
+length. A TextBuilder keeps the appended pieces in a list and joins them
+only when the text is needed (show, +, len, comparisons, ...), and
+`write report to "file"` writes the pieces straight to the file.
+
+Text is still a value: after `let saved be report`, appending to report
+must not change saved. A builder is marked shared as soon as its value is
+stored anywhere else (another variable, a list, a function argument, what
+a function gives back); append only adds to a builder in place while it
+is not shared, and otherwise appends to a copy, which is cheap because the
+pieces themselves are shared.
+"""
+
+
+class TextBuilder:
+    """Text that grows by appending pieces."""
+    __slots__ = ('parts', 'length', 'shared')
+    __hash__ = None
+
+    def __init__(self, text=""):
+        self.parts = [text] if text else []
+        self.length = len(text)
+        self.shared = False
+
+    def copy(self):
+        builder = TextBuilder()
+        builder.parts = self.parts[:]
+        builder.length = self.length
+        return builder
+
+    def append(self, value):
+        text = value if isinstance(value, str) else str(value)
+        self.parts.append(text)
+        self.length += len(text)
+
+    def __str__(self):
+        parts = self.parts
+        if not parts:
+            return ""
+        if len(parts) > 1:
+            parts[:] = [''.join(parts)]
+        return parts[0]
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __format__(self, spec):
+        return format(str(self), spec)
+
+    def write_to(self, f):
+        """Write the text to an open file without joining it first."""
+        f.writelines(self.parts)
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def __iter__(self):
+        return iter(str(self))
+
+    def __contains__(self, item):
+        return str(item) in str(self)
+
+    def __getitem__(self, key):
+        return str(self)[key]
+
+    def __eq__(self, other):
+        if isinstance(other, (str, TextBuilder)):
+            return str(self) == str(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        if isinstance(other, (str, TextBuilder)):
+            return str(self) != str(other)
+        return NotImplemented
+
+    def __add__(self, other):
+        if isinstance(other, (str, TextBuilder)):
+            return str(self) + str(other)
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, str):
+            return other + str(self)
+        return NotImplemented
+
+    def __mul__(self, count):
+        return str(self) * count
+
+    def __getattr__(self, name):
+        # text methods such as report.upper() work on the joined text
+        if name in TextBuilder.__slots__:
+            raise AttributeError(name)
+        return getattr(str(self), name)
+
+
+def share(value):
+    """Mark value as held by more than one binding if it is a builder; return it."""
+    if type(value) is TextBuilder:
+        value.shared = True
+    return value
@@ -0,0 +1,124 @@
+"""
+Whisper tokenizer.
+
+Every source line is lexed exactly once into tokens that remember their
+column. The statement parser matches command words against these tokens and
+hands slices of them to the expression parser, so string literals and
+comments are recognised in one place only.
+"""
+
+import ast
+import re
+import warnings
+
+TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)
+  | (?P<name>[^\W\d]\w*)
+  | (?P<string>["'])
+  | (?P<comment>\#)
+  | (?P<op>\*\*|//|==|!=|<=|>=|<<|>>|[-+*/%<>()\[\]{},:.&|^~=?])
+""", re.VERBOSE)
+
+
+class Token:
+    """One lexical token.
+
+    kind is 'name', 'number', 'string', 'op', 'error' or 'end'; value is the
+    decoded value (the number, the string contents, the operator or word);
+    pos and end are 0-based columns in the source text.
+    """
+    __slots__ = ('kind', 'value', 'text', 'pos', 'end')
+
+    def __init__(self, kind, value, text, pos):
+        self.kind = kind
+        self.value = value
+        self.text = text
+        self.pos = pos
+        self.end = pos + len(text)
+
+    def is_word(self, word):
+        return self.kind == 'name' and self.value == word
+
+    def is_op(self, op):
+        return self.kind == 'op' and self.value == op
+
+    def __repr__(self):
+        return f"Token({self.kind}, {self.text!r}, {self.pos})"
+
+
+def scan_string(text, start):
+    """Return the index just past the string literal starting at text[start], or -1."""
+    quote = text[start]
+    j = start + 1
+    length = len(text)
+    while j < length:
+        char = text[j]
+        if char == '\\' and j + 1 < length:
+            j += 2
+            continue
+        if char == quote:
+            return j + 1
+        j += 1
+    return -1
+
+
+def decode_string(literal):
+    """Return the value of a quoted string literal, resolving escapes."""
+    with warnings.catch_warnings():
+        # Unknown escapes such as "\d" are kept as written
+        warnings.simplefilter("ignore")
+        return ast.literal_eval(literal)
+
+
+def tokenize(text):
+    """Split text into tokens, stopping at a # comment.
+
+    Characters that cannot start a token and unterminated strings become
+    'error' tokens rather than raising, so a statement can still be
+    recognised; the expression parser reports them with their column.
+    The list always ends with an 'end' token.
+    """
+    tokens = []
+    pos = 0
+    length = len(text)
+    match_token = TOKEN_RE.match
+    while pos < length:
+        match = match_token(text, pos)
+        if not match:
+            tokens.append(Token('error', text[pos], text[pos], pos))
+            pos += 1
+            continue
+        kind = match.lastgroup
+        if kind == 'space':
+            pos = match.end()
+            continue
+        if kind == 'comment':
+            break
+        if kind == 'string':
+            end = scan_string(text, pos)
+            if end < 0:
+                tokens.append(Token('error', text[pos:], text[pos:], pos))
+                pos = length
+                break
+            literal = text[pos:end]
+            tokens.append(Token('string', decode_string(literal), literal, pos))
+            pos = end
+            continue
+        value = match.group()
+        if kind == 'number':
+            number = float(value) if ('.' in value or 'e' in value or 'E' in value) else int(value)
+            tokens.append(Token('number', number, value, pos))
+        else:
+            tokens.append(Token(kind, value, value, pos))
+        pos = match.end()
+    end = tokens[-1].end if tokens else pos
+    tokens.append(Token('end', None, '', end))
+    return tokens
+
+
+def describe_error(token):
+    """Explain why an 'error' token could not be lexed."""
+    if token.text[:1] in ('"', "'"):
+        return f"unterminated string starting at column {token.pos + 1}"
+    return f"unexpected character '{token.text}' at column {token.pos + 1}"